@@ -0,0 +1,529 @@
+"""End-to-end pipeline benchmarks against a local Postgres.
+
+Generates a synthetic lake, then times each stage and writes the numbers to
+benchmarks/results/<timestamp>-<commit>.json so runs can be compared across
+commits. Point POSTGRES_DB at a scratch database: the load and dbt stages
+write to the raw and analytics schemas.
+
+Usage:
+    POSTGRES_DB=pharmadb_bench python -m benchmarks.run_benchmarks --messages 100000
+    python -m benchmarks.run_benchmarks --stages load,api --baseline benchmarks/results/<file>.json
+    python -m benchmarks.run_benchmarks --stages startup --reuse-data
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.synthetic_data import generate
+
+STAGES = ['startup', 'tag', 'dedup', 'images', 'load', 'dbt', 'enrich', 'detections', 'serialize', 'api']
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+API_REQUESTS = [
+    ('top_products', '/api/reports/top-products', {'limit': 10}),
+    ('channel_activity', '/api/channels/bench_channel_000/activity', {}),
+    ('search_messages', '/api/search/messages', {'query': 'paracetamol'}),
+    ('visual_content', '/api/reports/visual-content', {'limit': 20}),
+]
+
+# Cold starts timed by the startup stage: the API and Dagster code location as
+# their servers import them, and the CLIs with --help
+STARTUP_TARGETS = {
+    'api': ['-c', 'import src.api.main'],
+    'dagster_definitions': ['-c', 'import src.dagster_pipeline'],
+    'scrape_service': ['-c', 'import src.scrape_service'],
+    'yolo_enrichment_help': ['-m', 'src.yolo_enrichment', '--help'],
+    'detection_service_help': ['-m', 'src.detection_service', '--help'],
+    'scrape_service_help': ['-m', 'src.scrape_service', '--help'],
+    'lake_maintenance_help': ['-m', 'src.lake_maintenance', '--help'],
+    'dbt_transform_help': ['-m', 'src.dbt_transform', '--help'],
+    'product_tagger_help': ['-m', 'src.product_tagger', '--help'],
+}
+# Only the code paths that use these may import them
+HEAVY_MODULES = ('ultralytics', 'torch', 'telethon', 'pandas')
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def lake_texts(data_dir):
+    from src.lake_catalog import PartitionCatalog, read_messages
+
+    texts = []
+    for partition in PartitionCatalog(data_dir).partitions():
+        texts.extend(message.get('message') for message in read_messages(partition.path))
+    return texts
+
+def bench_tag(args):
+    from src.product_tagger import get_tagger
+
+    texts = lake_texts(args.data_dir)
+    start = time.perf_counter()
+    tagger = get_tagger()
+    build_seconds = time.perf_counter() - start
+
+    # Single core: the tagger runs inline in the loader
+    start = time.perf_counter()
+    tagged = sum(1 for text in texts if tagger.tag(text))
+    seconds = time.perf_counter() - start
+    return {
+        'messages': len(texts),
+        'tagged_messages': tagged,
+        'seconds': seconds,
+        'messages_per_sec': len(texts) / seconds if seconds else None,
+        'automaton_build_seconds': build_seconds,
+    }
+
+def bench_dedup(args):
+    from src.message_dedup import ClusterIndex, simhashes
+
+    texts = lake_texts(args.data_dir)
+    start = time.perf_counter()
+    hashes = simhashes(texts)
+    hash_seconds = time.perf_counter() - start
+
+    # In-memory part of assign_clusters(); the database lookup is covered by the load stage
+    index = ClusterIndex()
+    start = time.perf_counter()
+    clusters = {index.assign(simhash) for simhash in hashes if simhash is not None}
+    assign_seconds = time.perf_counter() - start
+    return {
+        'messages': len(texts),
+        'clusters': len(clusters),
+        'simhash_per_sec': len(texts) / hash_seconds if hash_seconds else None,
+        'assign_per_sec': len(texts) / assign_seconds if assign_seconds else None,
+    }
+
+def bench_load(args):
+    from src.load_raw_to_postgres import create_raw_schema, load_raw_data
+
+    create_raw_schema()
+    start = time.perf_counter()
+    rows = load_raw_data(data_dir=args.data_dir)
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else None}
+
+def bench_dbt(args):
+    from src.dbt_transform import build_models
+
+    start = time.perf_counter()
+    build_models(full=True, state_name='bench')
+    full_seconds = time.perf_counter() - start
+
+    # Nothing changed since the full build, so this measures the no-op path
+    start = time.perf_counter()
+    build_models(state_name='bench')
+    noop_seconds = time.perf_counter() - start
+    return {'full_build_seconds': full_seconds, 'noop_build_seconds': noop_seconds}
+
+def bench_enrich(args):
+    from src.yolo_enrichment import get_model, process_images_with_yolo
+
+    # Model load is reported separately from steady-state throughput
+    start = time.perf_counter()
+    get_model()
+    model_load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    images = process_images_with_yolo(data_dir=args.data_dir, resume=False)
+    seconds = time.perf_counter() - start
+    return {
+        'images': images,
+        'seconds': seconds,
+        'images_per_sec': images / seconds if seconds else None,
+        'model_load_seconds': model_load_seconds,
+    }
+
+# Class-frequency report over each detection layout (src/detection_arrays.py)
+DETECTION_SCANS = {
+    'rows': """
+        SELECT detected_object_class, count(*), avg(confidence_score),
+               count(*) FILTER (WHERE confidence_score >= 0.8)
+        FROM bench_detection_rows
+        GROUP BY detected_object_class
+    """,
+    'compact': """
+        SELECT c.class_name, count(*), avg(d.confidence), count(*) FILTER (WHERE d.confidence >= 0.8)
+        FROM bench_detection_arrays a
+        CROSS JOIN LATERAL unnest(a.class_ids, a.confidences) AS d(class_id, confidence)
+        JOIN raw.detection_classes c ON c.class_id = d.class_id
+        GROUP BY c.class_name
+    """,
+}
+
+def bench_detections(args):
+    """Table size and class-frequency scan time of the per-box and compact detection layouts.
+
+    Both are filled with the same synthetic detections in temporary tables;
+    nothing is committed.
+    """
+    from src.db import connection, insert_values
+    from src.detection_arrays import class_ids, to_arrays
+    from src.yolo_enrichment import create_image_detections_table
+
+    create_image_detections_table()
+    rng = random.Random(args.seed)
+    classes = [f'class_{index:02d}' for index in range(80)]
+    images = [
+        (hashlib.sha256(str(index).encode()).hexdigest(), [
+            {'class': rng.choice(classes), 'confidence': rng.random(),
+             'bbox': [round(rng.uniform(0, 640), 2) for _ in range(4)]}
+            for _ in range(rng.randint(0, 8))
+        ])
+        for index in range(args.detection_images)
+    ]
+    results = {'images': len(images), 'detections': sum(len(detections) for _, detections in images)}
+
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE bench_detection_rows (LIKE raw.image_detections INCLUDING ALL)")
+        cur.execute("CREATE TEMP TABLE bench_detection_arrays (LIKE raw.image_detection_arrays INCLUDING ALL)")
+        insert_values(cur, """
+            INSERT INTO bench_detection_rows
+            (message_id, image_path, image_hash, detected_object_class, confidence_score,
+             bbox_x1, bbox_y1, bbox_x2, bbox_y2, channel_name, message_date)
+            VALUES %s
+        """, [
+            (str(message_id), f'data/raw/images/{image_hash[:2]}/{image_hash}.jpg', image_hash,
+             detection['class'], detection['confidence'], *detection['bbox'], 'bench_channel_000', '2024-01-01')
+            for message_id, (image_hash, detections) in enumerate(images) for detection in detections
+        ])
+        ids = class_ids(cur, classes)
+        insert_values(cur, """
+            INSERT INTO bench_detection_arrays
+            (channel_name, message_date, message_id, image_hash, class_ids, confidences, boxes)
+            VALUES %s
+        """, [
+            ('bench_channel_000', '2024-01-01', message_id, image_hash, *to_arrays(detections, ids))
+            for message_id, (image_hash, detections) in enumerate(images)
+        ], template='(%s, %s, %s, %s, %s::smallint[], %s::real[], %s::real[])')
+        cur.execute("ANALYZE bench_detection_rows")
+        cur.execute("ANALYZE bench_detection_arrays")
+
+        for layout, table in (('rows', 'bench_detection_rows'), ('compact', 'bench_detection_arrays')):
+            cur.execute("SELECT pg_total_relation_size(%s)", (table,))
+            size = cur.fetchone()[0]
+            latencies = []
+            for _ in range(args.detection_repeats):
+                start = time.perf_counter()
+                cur.execute(DETECTION_SCANS[layout])
+                cur.fetchall()
+                latencies.append(time.perf_counter() - start)
+            results[layout] = {
+                'table_bytes': size,
+                'bytes_per_detection': size / results['detections'] if results['detections'] else None,
+                'scan_p50_ms': percentile(latencies, 50) * 1000,
+            }
+        conn.rollback()
+    results['size_ratio'] = results['rows']['table_bytes'] / results['compact']['table_bytes']
+    results['scan_speedup'] = results['rows']['scan_p50_ms'] / results['compact']['scan_p50_ms']
+    return results
+
+def camera_photos(count, size=(2560, 1920), seed=42):
+    """Full-resolution JPEGs like those Telegram serves; the synthetic lake's images are already small."""
+    import io
+    import random
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.rectangle([x, y, x + rng.randrange(50, 600), y + rng.randrange(50, 600)],
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=92)
+        photos.append(buffer.getvalue())
+    return photos
+
+def bench_images(args):
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+
+    from src.image_store import DECODE_WORKERS, DETECTOR_SIZE, downscale
+
+    photos = camera_photos(args.image_samples)
+
+    def detector_decode(data):
+        # What the detector does with a full photo: decode it all, then resize
+        with Image.open(io.BytesIO(data)) as image:
+            image.convert('RGB').thumbnail((DETECTOR_SIZE, DETECTOR_SIZE))
+
+    start = time.perf_counter()
+    for data in photos:
+        detector_decode(data)
+    full_decode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    small = [downscale(data) for data in photos]
+    downscale_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(DECODE_WORKERS) as executor:
+        list(executor.map(downscale, photos))
+    threaded_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in small:
+        detector_decode(data)
+    small_decode_seconds = time.perf_counter() - start
+    return {
+        'images': len(photos),
+        'full_decode_ms': full_decode_seconds / len(photos) * 1000,
+        'small_decode_ms': small_decode_seconds / len(photos) * 1000,
+        'downscale_ms': downscale_seconds / len(photos) * 1000,
+        'downscale_per_sec_threaded': len(photos) / threaded_seconds if threaded_seconds else None,
+        'original_bytes': sum(len(data) for data in photos),
+        'small_bytes': sum(len(data) for data in small),
+    }
+
+async def time_requests(app, requests_per_endpoint):
+    import httpx
+
+    results = {}
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for name, path, params in API_REQUESTS:
+            latencies = []
+            errors = 0
+            for _ in range(requests_per_endpoint):
+                start = time.perf_counter()
+                response = await client.get(path, params=params)
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += response.status_code >= 400
+            results[name] = {
+                'requests': requests_per_endpoint,
+                'errors': errors,
+                'p50_ms': percentile(latencies, 50),
+                'p99_ms': percentile(latencies, 99),
+                'max_ms': max(latencies),
+            }
+    return results
+
+async def time_paths(app, paths, repeats):
+    import httpx
+
+    latencies = {path: [] for path in paths}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for _ in range(repeats):
+            for path in paths:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies[path].append(time.perf_counter() - start)
+                response.raise_for_status()
+    return latencies
+
+def bench_serialize(args):
+    """Response encoding of one large list, response models against API_FAST_JSON, without the database."""
+    from typing import List
+    from fastapi import FastAPI
+
+    from src.api.fast_json import rows_response
+    from src.api.main import MessageSearch
+
+    columns = ('message_id', 'channel_name', 'message_text', 'date', 'has_image')
+    rows = [
+        (message_id, f'bench_channel_{message_id % 5:03d}',
+         f'Paracetamol 500mg and Amoxicillin 250mg in stock, call 09{message_id:08d}', '2024-01-01',
+         message_id % 3 == 0)
+        for message_id in range(args.serialize_rows)
+    ]
+    dict_rows = [dict(zip(columns, row)) for row in rows]
+
+    class TupleCursor:
+        description = [(name,) for name in columns]
+
+    app = FastAPI()
+
+    @app.get('/models', response_model=List[MessageSearch])
+    async def models():
+        return [MessageSearch(**row) for row in dict_rows]
+
+    @app.get('/fast', response_model=List[MessageSearch])
+    async def fast():
+        return rows_response(TupleCursor, rows)
+
+    latencies = asyncio.run(time_paths(app, ['/models', '/fast'], args.serialize_repeats))
+    results = {'rows': len(rows)}
+    for name, path in (('models', '/models'), ('fast_json', '/fast')):
+        p50 = percentile(latencies[path], 50)
+        results[name] = {'p50_ms': p50 * 1000, 'rows_per_sec': len(rows) / p50 if p50 else None}
+    results['speedup'] = results['models']['p50_ms'] / results['fast_json']['p50_ms']
+    return results
+
+def startup_profile(argv):
+    """Run python -X importtime with argv: wall time, exit code, total import time and which heavy modules loaded."""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', *argv], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    import_us = 0
+    self_us = {}
+    heavy = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        module = name.strip()
+        self_us[module] = int(own)
+        if module.split('.')[0] in HEAVY_MODULES:
+            heavy.add(module.split('.')[0])
+        # Nested imports are indented by two more spaces per level
+        if not name.startswith('  '):
+            import_us += int(cumulative)
+    return {
+        'wall_ms': elapsed * 1000,
+        'returncode': completed.returncode,
+        'import_ms': import_us / 1000,
+        'slowest_imports_ms': {
+            module: us / 1000 for module, us in sorted(self_us.items(), key=lambda item: -item[1])[:5]
+        },
+        'heavy_modules': sorted(heavy),
+    }
+
+def bench_startup(args):
+    """Cold-start time of the API, the Dagster code location and CLI --help, as python -X importtime sees it."""
+    results = {}
+    for name, argv in STARTUP_TARGETS.items():
+        runs = [startup_profile(argv) for _ in range(args.startup_repeats)]
+        result = runs[-1]
+        result['wall_ms'] = percentile([run['wall_ms'] for run in runs], 50)
+        result['import_ms'] = percentile([run['import_ms'] for run in runs], 50)
+        results[name] = result
+    return results
+
+def bench_api(args):
+    from src.api.main import app
+
+    return asyncio.run(time_requests(app, args.api_requests))
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'tag': bench_tag,
+    'dedup': bench_dedup,
+    'images': bench_images,
+    'load': bench_load,
+    'dbt': bench_dbt,
+    'enrich': bench_enrich,
+    'detections': bench_detections,
+    'serialize': bench_serialize,
+    'api': bench_api,
+}
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def compare(current, baseline):
+    """Print each metric next to the baseline run's value."""
+    now, before = flatten(current['results']), flatten(baseline['results'])
+    for metric in sorted(now):
+        if metric in before and before[metric]:
+            change = (now[metric] - before[metric]) / before[metric] * 100
+            print(f"{metric:55s} {before[metric]:14.3f} -> {now[metric]:14.3f} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PharmaTelemetry pipeline stages.")
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--image-ratio', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default='data/bench/telegram_messages')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"comma-separated subset of {', '.join(STAGES)}")
+    parser.add_argument('--api-requests', type=int, default=200, help="requests per API endpoint")
+    parser.add_argument('--serialize-rows', type=int, default=10000, help="rows per response for the serialize stage")
+    parser.add_argument('--serialize-repeats', type=int, default=20, help="requests per path for the serialize stage")
+    parser.add_argument('--startup-repeats', type=int, default=5, help="cold starts per target for the startup stage")
+    parser.add_argument('--detection-images', type=int, default=50000, help="synthetic images for the detections stage")
+    parser.add_argument('--detection-repeats', type=int, default=10, help="scans per layout for the detections stage")
+    parser.add_argument('--image-samples', type=int, default=40, help="full-size photos for the images stage")
+    parser.add_argument('--reuse-data', action='store_true', help="skip generation if data-dir exists")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if args.reuse_data and os.path.isdir(args.data_dir):
+        summary = None
+    else:
+        shutil.rmtree(args.data_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(os.path.dirname(os.path.normpath(args.data_dir)), 'images'), ignore_errors=True)
+        start = time.perf_counter()
+        summary = generate(
+            args.data_dir, messages=args.messages, channels=args.channels, days=args.days,
+            image_ratio=args.image_ratio, seed=args.seed,
+        )
+        summary['seconds'] = time.perf_counter() - start
+        print(f"Generated {summary['messages']} messages and {summary['images']} images")
+
+    results = {}
+    for stage in stages:
+        print(f"Running {stage} benchmark...")
+        results[stage] = BENCHMARKS[stage](args)
+        print(json.dumps(results[stage], indent=2))
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'messages': args.messages,
+            'channels': args.channels,
+            'days': args.days,
+            'image_ratio': args.image_ratio,
+            'seed': args.seed,
+            'stages': stages,
+        },
+        'generated': summary,
+        'results': results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(RESULTS_DIR, f'{stamp}-{commit}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Deterministic synthetic Telegram data in the layout scrape_channel() writes.
+
+    <data_dir>/YYYY-MM-DD/<channel>.json           list of Message.to_dict() payloads
+    <image_store_dir>/<hash[:2]>/<hash>.jpg        photos referenced by downloaded_image/image_hash
+
+Usage:
+    python -m benchmarks.synthetic_data --messages 100000 --data-dir data/bench/telegram_messages
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from src.image_store import ImageStore
+from src.lake_catalog import PartitionCatalog
+from src.scrape_telegram import DateTimeEncoder
+
+PRODUCTS = [
+    'paracetamol', 'amoxicillin', 'vitamin c', 'ibuprofen', 'omeprazole',
+    'metformin', 'ciprofloxacin', 'azithromycin', 'cetirizine', 'sunscreen',
+    'ፓራሲታሞል', 'አሞክሲሲሊን', 'ቫይታሚን',
+]
+TEMPLATES = [
+    "{product} available now, price {price} birr. Call {phone}",
+    "New stock: {product} {dose}mg. Delivery in Addis. {phone}",
+    "{product} እና ሌሎች መድሃኒቶች በቅናሽ ዋጋ {price} ብር ☎️ {phone}",
+    "Original {product} imported, {price} ETB per pack",
+    "ለበለጠ መረጃ {phone} ይደውሉ - {product}",
+]
+DEFAULT_START_DATE = '2024-01-01'
+
+def channel_names(count):
+    return [f'bench_channel_{i:03d}' for i in range(count)]
+
+def make_template_images(image_store, count, size, rng):
+    """Put `count` distinct JPEGs in the image store and return their hashes."""
+    import io
+    from PIL import Image, ImageDraw
+
+    hashes = []
+    for _ in range(count):
+        image = Image.new('RGB', (size, size), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x0, y0 = rng.randrange(size), rng.randrange(size)
+            x1, y1 = x0 + rng.randrange(1, size // 2), y0 + rng.randrange(1, size // 2)
+            draw.rectangle([x0, y0, x1, y1], fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        hashes.append(image_store.put(buffer.getvalue()))
+    return hashes
+
+def make_message(rng, message_id, channel_id, posted_at, text, image_path=None, image_hash=None):
+    """Build a payload shaped like telethon's Message.to_dict()."""
+    media = None
+    if image_path:
+        media = {
+            '_': 'MessageMediaPhoto',
+            'spoiler': False,
+            'photo': {'_': 'Photo', 'id': rng.getrandbits(63), 'date': posted_at},
+            'ttl_seconds': None,
+        }
+    message = {
+        '_': 'Message',
+        'id': message_id,
+        'peer_id': {'_': 'PeerChannel', 'channel_id': channel_id},
+        'date': posted_at,
+        'message': text,
+        'out': False,
+        'mentioned': False,
+        'media_unread': False,
+        'silent': False,
+        'post': True,
+        'from_id': None,
+        'fwd_from': None,
+        'reply_to': None,
+        'media': media,
+        'reply_markup': None,
+        'entities': [],
+        'views': rng.randrange(50, 20000),
+        'forwards': rng.randrange(0, 200),
+        'replies': None,
+        'edit_date': None,
+        'post_author': None,
+        'grouped_id': None,
+        'restriction_reason': [],
+        'ttl_period': None,
+    }
+    if image_path:
+        message['downloaded_image'] = image_path
+        message['image_hash'] = image_hash
+    return message
+
+def make_text(rng):
+    return rng.choice(TEMPLATES).format(
+        product=rng.choice(PRODUCTS),
+        price=rng.randrange(50, 5000),
+        dose=rng.choice([100, 250, 500, 1000]),
+        phone=f'09{rng.randrange(10**8):08d}',
+    )
+
+def generate(data_dir, messages=1000, channels=5, days=7, image_ratio=0.3,
+             repost_rate=0.2, unique_images=50, image_size=640,
+             start_date=DEFAULT_START_DATE, seed=42, image_store_dir=None):
+    """Write a synthetic lake under data_dir and return a summary of what was written.
+
+    Messages are spread evenly over channels x days. repost_rate is the share
+    of messages that repeat an earlier text, and photos are drawn from
+    `unique_images` distinct images, mimicking reposted product ads. Images
+    go to image_store_dir (default: an `images` directory next to data_dir).
+    """
+    rng = random.Random(seed)
+    names = channel_names(channels)
+    start = datetime.strptime(start_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    partitions = [(day, name) for day in range(days) for name in names]
+    per_partition, remainder = divmod(messages, len(partitions))
+
+    if image_store_dir is None:
+        image_store_dir = os.path.join(os.path.dirname(os.path.normpath(data_dir)), 'images')
+    image_store = ImageStore(store_dir=image_store_dir, use_phash=False)
+    catalog = PartitionCatalog(data_dir)
+    templates = make_template_images(image_store, unique_images, image_size, rng) if image_ratio else []
+
+    texts = []
+    next_message_id = {name: 1 for name in names}
+    summary = {'messages': 0, 'images': 0, 'files': 0}
+    for index, (day, channel_name) in enumerate(partitions):
+        count = per_partition + (1 if index < remainder else 0)
+        if count == 0:
+            continue
+        date_str = (start + timedelta(days=day)).strftime('%Y-%m-%d')
+        out_dir = os.path.join(data_dir, date_str)
+        os.makedirs(out_dir, exist_ok=True)
+
+        channel_id = 1000000 + names.index(channel_name)
+        batch = []
+        for _ in range(count):
+            message_id = next_message_id[channel_name]
+            next_message_id[channel_name] += 1
+            posted_at = start + timedelta(days=day, seconds=rng.randrange(86400))
+            if texts and rng.random() < repost_rate:
+                text = rng.choice(texts)
+            else:
+                text = make_text(rng)
+                if len(texts) < 10000:
+                    texts.append(text)
+
+            image_path = image_hash = None
+            if templates and rng.random() < image_ratio:
+                image_hash = rng.choice(templates)
+                image_path = image_store.path(image_hash)
+                summary['images'] += 1
+            batch.append(make_message(rng, message_id, channel_id, posted_at, text, image_path, image_hash))
+
+        out_path = os.path.join(out_dir, f'{channel_name}.json')
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(batch, f, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
+        catalog.register(date_str, channel_name, out_path, messages=count)
+        summary['messages'] += count
+        summary['files'] += 1
+
+    summary['unique_images'] = len(templates)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Telegram data lake.")
+    parser.add_argument('--data-dir', default='data/bench/telegram_messages')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--image-ratio', type=float, default=0.3)
+    parser.add_argument('--repost-rate', type=float, default=0.2)
+    parser.add_argument('--unique-images', type=int, default=50)
+    parser.add_argument('--image-size', type=int, default=640)
+    parser.add_argument('--start-date', default=DEFAULT_START_DATE)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    summary = generate(
+        args.data_dir, messages=args.messages, channels=args.channels, days=args.days,
+        image_ratio=args.image_ratio, repost_rate=args.repost_rate,
+        unique_images=args.unique_images, image_size=args.image_size,
+        start_date=args.start_date, seed=args.seed,
+    )
+    print(json.dumps(summary))
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,7 @@
-import psycopg2
-import os
-from dotenv import load_dotenv
+from src.db import connect
 
-# Load environment variables
-load_dotenv()
-
-# Connect to database
-conn = psycopg2.connect(
-    host="localhost",
-    port=5433,
-    database=os.getenv('POSTGRES_DB'),
-    user=os.getenv('POSTGRES_USER'),
-    password=os.getenv('POSTGRES_PASSWORD')
-)
+# Connect to database (POSTGRES_HOST/PORT/DB/USER/PASSWORD, see src/db.py)
+conn = connect()
 
 cur = conn.cursor()
 
@@ -0,0 +1,27 @@
+{#
+    Overrides dbt's get_where_subquery so a test's `where` config can say
+    __loaded_since__: the start of the previous build (var dq_loaded_since,
+    passed by src/dbt_transform.py) minus var dq_test_lookback. Row-level
+    tests on raw-derived models then only check rows loaded since the last
+    build; without the var (full builds) they check every row.
+#}
+{% macro get_where_subquery(relation) -%}
+    {% set where = config.get('where', '') %}
+    {% if where %}
+        {% if '__loaded_since__' in where %}
+            {% set since = var('dq_loaded_since', none) %}
+            {% if since %}
+                {% set cutoff = "'" ~ since ~ "'::timestamp - interval '" ~ var('dq_test_lookback') ~ "'" %}
+            {% else %}
+                {% set cutoff = "'-infinity'::timestamp" %}
+            {% endif %}
+            {% set where = where | replace('__loaded_since__', cutoff) %}
+        {% endif %}
+        {%- set filtered -%}
+            (select * from {{ relation }} where {{ where }}) dbt_subquery
+        {%- endset -%}
+        {% do return(filtered) %}
+    {%- else -%}
+        {% do return(relation) %}
+    {%- endif -%}
+{%- endmacro %}
@@ -0,0 +1,47 @@
+{{
+  config(
+    materialized='table',
+    tags=['detections']
+  )
+}}
+
+-- Class frequency and confidence per channel and day across both detection layouts.
+-- The compact arrays are aggregated directly, one narrow row per image instead of
+-- one wide row per box; raw.image_detections adds the rows-layout boxes
+
+WITH detections AS (
+  SELECT
+    a.channel_name,
+    a.message_date,
+    a.message_id,
+    d.class_id,
+    d.confidence
+  FROM {{ ref('stg_image_detection_arrays') }} a
+  CROSS JOIN LATERAL unnest(a.class_ids, a.confidences) AS d(class_id, confidence)
+
+  UNION ALL
+
+  SELECT
+    r.channel_name,
+    r.message_date,
+    r.message_id,
+    c.class_id,
+    r.confidence_score::real as confidence
+  FROM {{ source('raw', 'image_detections') }} r
+  JOIN {{ ref('dim_detection_classes') }} c ON c.class_name = r.detected_object_class
+)
+
+SELECT
+  d.channel_name,
+  d.message_date,
+  d.class_id,
+  c.class_name,
+  count(*) as detections,
+  -- Rewriting a message clears it from both layouts, so each message image is in one
+  count(DISTINCT d.message_id) as images,
+  avg(d.confidence) as avg_confidence,
+  max(d.confidence) as max_confidence,
+  count(*) FILTER (WHERE d.confidence >= 0.8) as high_confidence_detections
+FROM detections d
+JOIN {{ ref('dim_detection_classes') }} c ON c.class_id = d.class_id
+GROUP BY d.channel_name, d.message_date, d.class_id, c.class_name
@@ -18,7 +18,9 @@ with channel_data as (
 )
 
 select
-    row_number() over (order by channel_name) as channel_id,
+    -- Derived from the name so ids stay stable as channels are added and
+    -- incrementally built facts keep pointing at the right channel
+    ('x' || substr(md5(channel_name), 1, 15))::bit(60)::bigint as channel_id,
     channel_name,
     total_messages,
     total_images,
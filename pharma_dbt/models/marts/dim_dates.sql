@@ -1,12 +1,31 @@
 {{
   config(
-    materialized='table'
+    materialized='incremental',
+    unique_key='date_key',
+    indexes=[
+      {'columns': ['date_key'], 'unique': True}
+    ]
   )
 }}
 
-with date_spine as (
-    select distinct date_scraped as date_key
-    from {{ ref('stg_telegram_messages') }}
+-- Generated calendar spine. The first build covers var('date_spine_start')
+-- through current_date + var('date_spine_horizon_days'); later builds only
+-- append the days past the current max(date_key), so no raw data is scanned.
+
+with bounds as (
+    select
+        {% if is_incremental() %}
+        (select max(date_key) from {{ this }}) + 1 as start_date,
+        {% else %}
+        '{{ var("date_spine_start") }}'::date as start_date,
+        {% endif %}
+        (current_date + {{ var('date_spine_horizon_days') }})::date as end_date
+),
+
+date_spine as (
+    select day::date as date_key
+    from bounds,
+        generate_series(bounds.start_date, bounds.end_date, interval '1 day') as day
 ),
 
 date_attributes as (
@@ -23,4 +42,4 @@ date_attributes as (
     from date_spine
 )
 
-select * from date_attributes 
\ No newline at end of file
+select * from date_attributes
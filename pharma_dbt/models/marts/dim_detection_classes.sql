@@ -0,0 +1,37 @@
+{{
+  config(
+    materialized='table',
+    tags=['detections']
+  )
+}}
+
+-- Classes of the compact layout keep the ids stored in its class_ids arrays. Classes
+-- only ever written in the rows layout are numbered after them in name order; the
+-- models using class_id are rebuilt in full, so those ids only have to hold within a build
+
+WITH compact_classes AS (
+  SELECT
+    class_id::integer as class_id,
+    class_name
+  FROM {{ source('raw', 'detection_classes') }}
+),
+
+row_classes AS (
+  SELECT DISTINCT detected_object_class as class_name
+  FROM {{ source('raw', 'image_detections') }}
+  WHERE detected_object_class IS NOT NULL
+    AND detected_object_class NOT IN (SELECT class_name FROM compact_classes)
+)
+
+SELECT
+  class_id,
+  class_name
+FROM compact_classes
+
+UNION ALL
+
+SELECT
+  (SELECT coalesce(max(class_id), 0) FROM compact_classes)
+    + row_number() OVER (ORDER BY class_name) as class_id,
+  class_name
+FROM row_classes
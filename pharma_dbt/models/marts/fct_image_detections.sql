@@ -1,6 +1,7 @@
 {{
   config(
-    materialized='table'
+    materialized='table',
+    tags=['detections']
   )
 }}
 
@@ -11,6 +12,7 @@ WITH image_detections AS (
     confidence_score,
     detection_timestamp,
     image_path,
+    image_hash,
     channel_name,
     message_date
   FROM {{ ref('stg_image_detections') }}
@@ -24,6 +26,7 @@ SELECT
   confidence_score,
   detection_timestamp,
   image_path,
+  image_hash,
   channel_name,
   message_date,
   CASE 
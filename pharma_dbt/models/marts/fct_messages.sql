@@ -1,6 +1,14 @@
 {{
   config(
-    materialized='table'
+    materialized='incremental',
+    unique_key=['channel_id', 'telegram_message_id'],
+    incremental_strategy='delete+insert',
+    on_schema_change='append_new_columns',
+    indexes=[
+      {'columns': ['date_key']},
+      {'columns': ['channel_id', 'date_key']},
+      {'columns': ['product_tags'], 'type': 'gin'}
+    ]
   )
 }}
 
@@ -11,14 +19,25 @@ with messages as (
         date_scraped,
         telegram_message_id,
         message_date,
+        message_day,
         message_text,
         has_media,
         has_image,
         message_length,
         contains_numbers,
         downloaded_image,
+        product_tags,
+        duplicate_cluster_id,
         created_at
     from {{ ref('stg_telegram_messages') }}
+    {% if is_incremental() %}
+    -- Only rows loaded since the last build; the lookback covers loads whose
+    -- transactions committed after a later-stamped row was already built
+    where created_at > (
+        select coalesce(max(created_at), '1900-01-01'::timestamp) - interval '{{ var("fct_messages_lookback") }}'
+        from {{ this }}
+    )
+    {% endif %}
 ),
 
 channels as (
@@ -43,7 +62,9 @@ select
     m.message_length,
     m.contains_numbers,
     m.downloaded_image,
+    m.product_tags,
+    m.duplicate_cluster_id,
     m.created_at
 from messages m
 left join channels c on m.channel_name = c.channel_name
-left join dates d on m.date_scraped = d.date_key 
\ No newline at end of file
+left join dates d on m.message_day = d.date_key 
\ No newline at end of file
@@ -0,0 +1,24 @@
+{{
+  config(
+    materialized='view',
+    tags=['detections']
+  )
+}}
+
+-- One row per message image from raw.image_detection_arrays (DETECTION_STORAGE=compact),
+-- with parallel class id / confidence arrays and boxes flattened 4 values per detection
+
+SELECT
+  a.id as image_detection_id,
+  a.message_id::text as message_id,
+  a.class_ids,
+  a.confidences,
+  a.boxes,
+  cardinality(a.class_ids) as detection_count,
+  a.created_at as detection_timestamp,
+  p.image_path,
+  a.image_hash,
+  a.channel_name,
+  a.message_date
+FROM {{ source('raw', 'image_detection_arrays') }} a
+LEFT JOIN {{ source('raw', 'processed_images') }} p ON p.image_hash = a.image_hash
@@ -1,11 +1,13 @@
 {{
   config(
-    materialized='view'
+    materialized='view',
+    tags=['detections']
   )
 }}
 
 -- This staging model reads from raw.image_detections table
--- populated by the YOLO enrichment process
+-- populated by the YOLO enrichment process, plus the compact
+-- raw.image_detection_arrays layout unnested to one row per detection
 
 SELECT
   message_id,
@@ -13,7 +15,23 @@ SELECT
   confidence_score,
   created_at as detection_timestamp,
   image_path,
+  image_hash,
   channel_name,
   message_date::date as message_date
 FROM {{ source('raw', 'image_detections') }}
-WHERE detected_object_class IS NOT NULL 
\ No newline at end of file
+WHERE detected_object_class IS NOT NULL
+
+UNION ALL
+
+SELECT
+  a.message_id,
+  c.class_name as detected_object_class,
+  d.confidence::decimal(5,4) as confidence_score,
+  a.detection_timestamp,
+  a.image_path,
+  a.image_hash,
+  a.channel_name,
+  a.message_date
+FROM {{ ref('stg_image_detection_arrays') }} a
+CROSS JOIN LATERAL unnest(a.class_ids, a.confidences) AS d(class_id, confidence)
+JOIN {{ source('raw', 'detection_classes') }} c ON c.class_id = d.class_id
@@ -31,8 +31,14 @@ cleaned as (
         message_data->>'restriction_reason' as restriction_reason,
         message_data->>'ttl_period' as ttl_period,
         message_data->>'downloaded_image' as downloaded_image,
+        coalesce(product_tags, '{}'::text[]) as product_tags,
+        duplicate_cluster_id,
         created_at,
         -- Derived fields
+        coalesce(
+            ((message_data->>'date')::timestamptz at time zone 'UTC')::date,
+            date_scraped
+        ) as message_day,
         case when message_data->>'media' is not null then true else false end as has_media,
         case when message_data->>'downloaded_image' is not null then true else false end as has_image,
         length(message_data->>'message') as message_length,
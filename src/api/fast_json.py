@@ -0,0 +1,39 @@
+"""Opt-in fast JSON path for the API's list endpoints.
+
+By default each row is built into its Pydantic response model, and FastAPI
+then validates and encodes the list again on the way out, which dominates
+CPU time for large responses. With API_FAST_JSON=1 the endpoints fetch plain
+tuples, orjson encodes them straight to bytes and those bytes are the
+response. Nothing is validated on this path, so it is only used for rows from
+our own queries, whose column aliases already match the response model's
+fields.
+"""
+import os
+from decimal import Decimal
+
+from starlette.responses import Response
+
+FAST_JSON = os.getenv('API_FAST_JSON', '').lower() in ('1', 'true', 'yes')
+
+class JSONBytesResponse(Response):
+    """Response whose body is already-encoded JSON."""
+    media_type = 'application/json'
+
+def default(value):
+    # numeric columns (AVG, confidence scores) arrive as Decimal; the models declare float
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content):
+    import orjson
+
+    return orjson.dumps(content, default=default)
+
+def dumps_rows(columns, rows):
+    """JSON array of objects for tuple rows, keyed by column name."""
+    return dumps([dict(zip(columns, row)) for row in rows])
+
+def rows_response(cur, rows):
+    """The rows a tuple cursor fetched, as a ready-to-send JSON response."""
+    return JSONBytesResponse(dumps_rows([column[0] for column in cur.description], rows))
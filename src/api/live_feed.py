@@ -0,0 +1,215 @@
+"""Live feed of new messages, product mentions and detections for SSE clients.
+
+One LISTEN connection per API process receives the notifications from
+src/notifications.py, fetches the announced rows once and fans the
+resulting events out to every connected client's in-memory queue. Clients
+therefore cost no database work of their own, however many are connected.
+The LISTEN connection is a dedicated one; the rows are fetched on a pooled
+connection to the primary, which has them as soon as they are announced.
+Detection notifications name the layout their ids belong to, so the feed
+follows whatever DETECTION_STORAGE the writers use.
+"""
+import asyncio
+import itertools
+import json
+
+import psycopg2
+import psycopg2.extensions
+from loguru import logger
+
+from src.db import connection
+from src.metrics import LIVE_FEED_CLIENTS, LIVE_FEED_DROPPED_EVENTS
+from src.notifications import NEW_DETECTIONS_CHANNEL, NEW_MESSAGES_CHANNEL
+
+EVENT_TYPES = ('message', 'product_mention', 'detection')
+# Announced detection ids as one row per box, for each storage layout (src/detection_arrays.py).
+# Notifications from before the layout was announced are in the rows layout.
+DETECTION_QUERIES = {
+    'rows': """
+        SELECT id, channel_name, message_id, detected_object_class, confidence_score, image_path
+        FROM raw.image_detections
+        WHERE channel_name = %s AND id BETWEEN %s AND %s
+        ORDER BY id
+    """,
+    'compact': """
+        SELECT a.id, a.channel_name, a.message_id::text, c.class_name, d.confidence, p.image_path
+        FROM raw.image_detection_arrays a
+        CROSS JOIN LATERAL unnest(a.class_ids, a.confidences) AS d(class_id, confidence)
+        JOIN raw.detection_classes c ON c.class_id = d.class_id
+        LEFT JOIN raw.processed_images p ON p.image_hash = a.image_hash
+        WHERE a.channel_name = %s AND a.id BETWEEN %s AND %s
+        ORDER BY a.id
+    """,
+}
+
+def message_events(row):
+    """Events for one raw.telegram_messages row: the message plus one per product mentioned."""
+    raw_id, channel_name, telegram_message_id, posted_at, text, has_image, products = row
+    message = {
+        'message_id': raw_id,
+        'telegram_message_id': telegram_message_id,
+        'channel_name': channel_name,
+        'date': posted_at,
+        'message_text': text,
+        'has_image': has_image,
+        'products': products,
+    }
+    events = [('message', message)]
+    for product in products:
+        events.append(('product_mention', {
+            'product_name': product,
+            'channel_name': channel_name,
+            'message_id': raw_id,
+            'date': posted_at,
+        }))
+    return events
+
+def detection_event(row):
+    _, channel_name, message_id, detected_object, confidence, image_path = row
+    return ('detection', {
+        'message_id': message_id,
+        'channel_name': channel_name,
+        'detected_object': detected_object,
+        'confidence': float(confidence),
+        'image_path': image_path,
+    })
+
+def fetch_events(borrow, notification_channel, payload):
+    """Fetch the rows announced by one notification, on a connection from borrow(), and turn them into events."""
+    with borrow() as conn:
+        with conn.cursor() as cur:
+            if notification_channel == NEW_MESSAGES_CHANNEL:
+                cur.execute("""
+                    SELECT id, channel_name, message_data->>'id', message_data->>'date',
+                           message_data->>'message', message_data->>'downloaded_image' IS NOT NULL,
+                           coalesce(product_tags, '{}')
+                    FROM raw.telegram_messages
+                    WHERE channel_name = %s AND id BETWEEN %s AND %s
+                    ORDER BY id
+                """, (payload['channel'], payload['first_id'], payload['last_id']))
+                return [event for row in cur.fetchall() for event in message_events(row)]
+            cur.execute(DETECTION_QUERIES[payload.get('storage', 'rows')],
+                        (payload['channel'], payload['first_id'], payload['last_id']))
+            return [detection_event(row) for row in cur.fetchall()]
+
+class Subscription:
+    """One client's filtered view of the feed, buffered in a bounded queue."""
+
+    def __init__(self, channels=None, products=None, event_types=None, max_queue=1000):
+        self.channels = set(channels) if channels else None
+        self.products = set(products) if products else None
+        self.event_types = set(event_types) if event_types else set(EVENT_TYPES)
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def matches(self, event_type, data):
+        if event_type not in self.event_types:
+            return False
+        if self.channels is not None and data.get('channel_name') not in self.channels:
+            return False
+        if self.products is not None:
+            # Detections carry no product, so a product filter only narrows the text events
+            if event_type == 'message':
+                return bool(self.products.intersection(data['products']))
+            if event_type == 'product_mention':
+                return data['product_name'] in self.products
+        return True
+
+class LiveFeed:
+    """Shared database listener fanned out to in-memory subscriber queues.
+
+    connect opens the LISTEN connection and borrow lends a connection for
+    fetching announced rows. The listener starts with the first subscriber and reconnects after
+    reconnect_seconds if the connection is lost. A client too slow to keep
+    up loses events rather than holding back everyone else.
+    """
+
+    def __init__(self, connect, borrow=connection, reconnect_seconds=5):
+        self.connect = connect
+        self.borrow = borrow
+        self.reconnect_seconds = reconnect_seconds
+        self.subscribers = set()
+        self._ids = itertools.count(1)
+        self._listener = None
+
+    def subscribe(self, **filters):
+        subscription = Subscription(**filters)
+        self.subscribers.add(subscription)
+        LIVE_FEED_CLIENTS.set(len(self.subscribers))
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return subscription
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+        LIVE_FEED_CLIENTS.set(len(self.subscribers))
+
+    def publish(self, event_type, data):
+        event = (next(self._ids), event_type, data)
+        for subscription in list(self.subscribers):
+            if not subscription.matches(event_type, data):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                LIVE_FEED_DROPPED_EVENTS.inc()
+
+    async def _handle(self, notification):
+        try:
+            payload = json.loads(notification.payload)
+            events = await asyncio.get_running_loop().run_in_executor(
+                None, fetch_events, self.borrow, notification.channel, payload
+            )
+        except Exception as e:
+            logger.error(f"Live feed could not fetch rows for {notification.channel}: {e}")
+            return
+        for event_type, data in events:
+            self.publish(event_type, data)
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            conn = fd = None
+            lost = asyncio.Event()
+            try:
+                conn = await loop.run_in_executor(None, self.connect)
+                # A lost connection is closed before we get to clean up, and fileno() then raises
+                fd = conn.fileno()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NEW_MESSAGES_CHANNEL}; LISTEN {NEW_DETECTIONS_CHANNEL};")
+
+                def on_readable():
+                    try:
+                        conn.poll()
+                    except psycopg2.Error:
+                        lost.set()
+                        return
+                    while conn.notifies:
+                        loop.create_task(self._handle(conn.notifies.pop(0)))
+
+                loop.add_reader(fd, on_readable)
+                logger.info("Live feed listening for new messages and detections")
+                await lost.wait()
+                logger.warning("Live feed lost its database connection")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Live feed listener failed: {e}")
+            finally:
+                # libpq reuses the fd number on reconnect, so the old reader must always go
+                if fd is not None:
+                    loop.remove_reader(fd)
+                if conn is not None and not conn.closed:
+                    conn.close()
+            await asyncio.sleep(self.reconnect_seconds)
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
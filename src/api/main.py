@@ -1,13 +1,24 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import psycopg2
+import psycopg2.errors
 import psycopg2.extras
-from typing import List, Optional
+from contextlib import ExitStack, contextmanager
+from typing import List, NamedTuple, Optional
+from datetime import date
 from pydantic import BaseModel
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import asyncio
 import os
-from dotenv import load_dotenv
+import threading
+import time
 
-load_dotenv()
+from src.api.fast_json import FAST_JSON, JSONBytesResponse, dumps, rows_response
+from src.api.live_feed import EVENT_TYPES, LiveFeed, format_sse
+from src.api.profiling import QueryProfilingMiddleware, phase, record_query
+from src.db import PoolTimeout, connect, get_pool, read_connection
+from src.metrics import API_QUERY_SECONDS, API_REQUEST_SECONDS, API_REQUESTS_SHED, REGISTRY, timed
+from src.trends import trending
 
 app = FastAPI(title="PharmaTelemetry API", version="1.0.0")
 
@@ -20,14 +31,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection
-DB_CONFIG = {
-    'host': 'localhost',
-    'port': 5433,
-    'database': os.getenv('POSTGRES_DB', 'pharmadb'),
-    'user': os.getenv('POSTGRES_USER', 'pharmauser'),
-    'password': os.getenv('POSTGRES_PASSWORD', 'pharmapass')
-}
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record per-endpoint request latency, labelled by route template rather than raw path."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        endpoint = route.path if route else 'unmatched'
+        API_REQUEST_SECONDS.labels(
+            method=request.method, endpoint=endpoint, status=status
+        ).observe(time.perf_counter() - start)
 
 # Pydantic models for API responses
 class TopProduct(BaseModel):
@@ -54,73 +72,235 @@ class ImageDetection(BaseModel):
     confidence: float
     image_path: str
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+class TrendingItem(BaseModel):
+    name: str
+    current_mentions: int
+    previous_mentions: int
+    growth: float
+
+class TrendingReport(BaseModel):
+    window_days: int
+    as_of: str
+    products: List[TrendingItem]
+    terms: List[TrendingItem]
+
+def get_db_connection(timeout=None):
+    """Borrow a connection from the shared pool; hand it back with release_db_connection."""
+    with phase('db_connect'):
+        return get_pool().getconn(timeout)
+
+def release_db_connection(conn):
+    get_pool().putconn(conn)
+
+def report_cursor(conn):
+    """Tuple cursor for the fast JSON path, dict rows for the response models."""
+    if FAST_JSON:
+        return conn.cursor()
+    return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+def serialize_rows(cur, rows, model):
+    """Build the response from fetched rows: response models, or pre-encoded JSON with API_FAST_JSON."""
+    with phase('serialize'):
+        if FAST_JSON:
+            return rows_response(cur, rows)
+        return [model(**row) for row in rows]
+
+def fetch_all(cur, endpoint, query, params):
+    """Execute a query and fetch its rows, recording the time under API_QUERY_SECONDS."""
+    with timed(API_QUERY_SECONDS, span_name='query', endpoint=endpoint):
+        with phase('sql_exec'):
+            cur.execute(query, params)
+        with phase('sql_fetch'):
+            rows = cur.fetchall()
+    # Recorded once it completed: explaining a failed or cancelled query would only run it again
+    record_query(query, params)
+    return rows
+
+# Opt-in per-request profiling: Server-Timing headers and EXPLAIN for slow requests
+if os.getenv('API_PROFILING', '').lower() in ('1', 'true', 'yes'):
+    app.add_middleware(
+        QueryProfilingMiddleware,
+        borrow=lambda: read_connection(timeout=POOL_WAIT_SECONDS),
+        sample_rate=float(os.getenv('API_PROFILING_SAMPLE_RATE', '0.1')),
+        slow_request_ms=float(os.getenv('API_SLOW_REQUEST_MS', '500')),
+        explain_timeout_ms=int(os.getenv('API_EXPLAIN_TIMEOUT_MS', '2000')),
+        max_explains=int(os.getenv('API_MAX_CONCURRENT_EXPLAINS', '1')),
+    )
+
+# One LISTEN connection shared by every live feed client
+live_feed = LiveFeed(connect=connect)
+LIVE_FEED_KEEPALIVE_SECONDS = 15
+
+# Default engine for reports that can also be served from the DuckDB/Parquet snapshots
+REPORT_SOURCE = os.getenv('API_REPORT_SOURCE', 'postgres')
+
+def split_param(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+class EndpointLimit(NamedTuple):
+    statement_timeout_ms: int
+    max_concurrent: int
+
+DEFAULT_ENDPOINT_LIMIT = EndpointLimit(statement_timeout_ms=5000, max_concurrent=8)
+ENDPOINT_LIMITS = {
+    'top_products': EndpointLimit(10000, 4),
+    'channel_activity': EndpointLimit(5000, 8),
+    # An unanchored LIKE scans every message, so searches get the shortest leash
+    'search_messages': EndpointLimit(2000, 4),
+    'visual_content': EndpointLimit(5000, 8),
+    'trending': EndpointLimit(5000, 8),
+}
+
+def parse_endpoint_limits(value):
+    """API_ENDPOINT_LIMITS overrides, "endpoint=timeout_ms:max_concurrent,..."; either half may be left out."""
+    limits = {}
+    for item in split_param(value) or []:
+        endpoint, _, spec = item.partition('=')
+        timeout_ms, _, max_concurrent = spec.partition(':')
+        default = ENDPOINT_LIMITS.get(endpoint, DEFAULT_ENDPOINT_LIMIT)
+        limits[endpoint] = EndpointLimit(
+            int(timeout_ms) if timeout_ms else default.statement_timeout_ms,
+            int(max_concurrent) if max_concurrent else default.max_concurrent,
+        )
+    return limits
+
+ENDPOINT_LIMITS.update(parse_endpoint_limits(os.getenv('API_ENDPOINT_LIMITS')))
+# How long a request waits for a pooled connection before it is shed
+POOL_WAIT_SECONDS = float(os.getenv('API_POOL_WAIT_MS', '100')) / 1000
+RETRY_AFTER_SECONDS = os.getenv('API_RETRY_AFTER_SECONDS', '1')
+
+_endpoint_slots = {}
+_endpoint_slots_lock = threading.Lock()
+
+def endpoint_slots(endpoint):
+    with _endpoint_slots_lock:
+        if endpoint not in _endpoint_slots:
+            limit = ENDPOINT_LIMITS.get(endpoint, DEFAULT_ENDPOINT_LIMIT)
+            _endpoint_slots[endpoint] = threading.BoundedSemaphore(limit.max_concurrent)
+        return _endpoint_slots[endpoint]
+
+def shed(endpoint, reason, detail):
+    """503 telling the client when to retry, instead of queueing behind a saturated database."""
+    API_REQUESTS_SHED.labels(endpoint=endpoint, reason=reason).inc()
+    return HTTPException(status_code=503, detail=detail, headers={'Retry-After': RETRY_AFTER_SECONDS})
+
+@contextmanager
+def request_cursor(limit, dict_rows, replica=True):
+    """Cursor on a read connection with the endpoint's statement_timeout applied."""
+    with ExitStack() as stack:
+        with phase('db_connect'):
+            conn = stack.enter_context(read_connection(timeout=POOL_WAIT_SECONDS, replica=replica))
+        cur = stack.enter_context(report_cursor(conn) if dict_rows else conn.cursor())
+        # Scoped to this request's transaction, which the pool rolls back on return
+        cur.execute("SET LOCAL statement_timeout = %s", (limit.statement_timeout_ms,))
+        yield cur
+
+@contextmanager
+def endpoint_cursor(endpoint, dict_rows=True):
+    """Cursor for one read-only request, on the replica when there is one, under the endpoint's limits.
+
+    Requests beyond the endpoint's concurrency limit, or that wait longer than
+    API_POOL_WAIT_MS for a connection, are shed with 503 and Retry-After.
+    A pooled connection that turns out to be dead is replaced once from the
+    primary. Queries cancelled by the endpoint's statement_timeout become 504,
+    and other database errors 500.
+    """
+    limit = ENDPOINT_LIMITS.get(endpoint, DEFAULT_ENDPOINT_LIMIT)
+    slots = endpoint_slots(endpoint)
+    if not slots.acquire(blocking=False):
+        raise shed(endpoint, 'concurrency', f"Too many concurrent {endpoint} requests")
+    try:
+        with ExitStack() as stack:
+            for replica in (True, False):
+                try:
+                    cur = stack.enter_context(request_cursor(limit, dict_rows, replica=replica))
+                    break
+                except PoolTimeout:
+                    raise shed(endpoint, 'pool', "No database connection available")
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    # The first statement is where a connection that died in the pool fails
+                    if not replica:
+                        raise shed(endpoint, 'unavailable', f"Database unavailable: {str(e)}")
+            try:
+                yield cur
+            except psycopg2.errors.QueryCanceled:
+                API_REQUESTS_SHED.labels(endpoint=endpoint, reason='statement_timeout').inc()
+                raise HTTPException(status_code=504, detail=f"Query exceeded {limit.statement_timeout_ms} ms")
+            except psycopg2.Error as e:
+                raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        slots.release()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/")
 async def root():
     return {"message": "PharmaTelemetry API - Ethiopian Medical Business Analytics"}
 
+def message_count_sql(distinct, condition=None):
+    """COUNT over fct_messages fm, counting each near-duplicate cluster once when distinct."""
+    key = 'COALESCE(fm.duplicate_cluster_id, fm.message_id)' if distinct else '*'
+    if condition:
+        key = f"CASE WHEN {condition} THEN {key if distinct else '1'} END"
+    return f"COUNT(DISTINCT {key})" if distinct else f"COUNT({key})"
+
+def top_products_from_parquet(limit, distinct):
+    """Serve the report from the Parquet snapshots so the scan never reaches Postgres."""
+    from src.duckdb_reports import top_products
+
+    try:
+        with timed(API_QUERY_SECONDS, span_name='query', endpoint='top_products_parquet'):
+            with phase('sql_exec'):
+                results = top_products(limit=limit, distinct=distinct)
+        with phase('serialize'):
+            if FAST_JSON:
+                return JSONBytesResponse(dumps(results))
+            return [TopProduct(**row) for row in results]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Parquet engine error: {str(e)}")
+
 @app.get("/api/reports/top-products", response_model=List[TopProduct])
-async def get_top_products(limit: int = Query(10, description="Number of top products to return")):
+def get_top_products(
+    limit: int = Query(10, description="Number of top products to return"),
+    distinct: bool = Query(False, description="Count reposted near-duplicate messages once"),
+    source: str = Query(REPORT_SOURCE, pattern="^(postgres|parquet)$",
+                        description="postgres, or parquet to scan the DuckDB snapshots instead"),
+):
     """Get the most frequently mentioned medical products across all channels."""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
-    try:
-        # Simple keyword-based product detection
-        cur.execute("""
-            SELECT 
-                'paracetamol' as product_name,
-                COUNT(*) as mention_count,
-                STRING_AGG(DISTINCT c.channel_name, ', ') as channels
-            FROM analytics.fct_messages fm
-            JOIN analytics.dim_channels c ON fm.channel_id = c.channel_id
-            WHERE LOWER(fm.message_text) LIKE '%paracetamol%'
-            GROUP BY product_name
-            UNION ALL
+    if source == 'parquet':
+        return top_products_from_parquet(limit, distinct)
+    with endpoint_cursor('top_products') as cur:
+        # Tags come from the load-time product tagger; the GIN index on product_tags serves product filters
+        results = fetch_all(cur, 'top_products', f"""
             SELECT 
-                'amoxicillin' as product_name,
-                COUNT(*) as mention_count,
+                tag as product_name,
+                {message_count_sql(distinct)} as mention_count,
                 STRING_AGG(DISTINCT c.channel_name, ', ') as channels
             FROM analytics.fct_messages fm
+            CROSS JOIN LATERAL unnest(fm.product_tags) as tag
             JOIN analytics.dim_channels c ON fm.channel_id = c.channel_id
-            WHERE LOWER(fm.message_text) LIKE '%amoxicillin%'
-            GROUP BY product_name
-            UNION ALL
-            SELECT 
-                'vitamin' as product_name,
-                COUNT(*) as mention_count,
-                STRING_AGG(DISTINCT c.channel_name, ', ') as channels
-            FROM analytics.fct_messages fm
-            JOIN analytics.dim_channels c ON fm.channel_id = c.channel_id
-            WHERE LOWER(fm.message_text) LIKE '%vitamin%'
-            GROUP BY product_name
+            GROUP BY tag
             ORDER BY mention_count DESC
             LIMIT %s
         """, (limit,))
         
-        results = cur.fetchall()
-        return [TopProduct(**row) for row in results]
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+        return serialize_rows(cur, results, TopProduct)
 
 @app.get("/api/channels/{channel_name}/activity", response_model=List[ChannelActivity])
-async def get_channel_activity(channel_name: str):
+def get_channel_activity(
+    channel_name: str,
+    distinct: bool = Query(False, description="Count reposted near-duplicate messages once"),
+):
     """Get posting activity for a specific channel."""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
-    try:
-        cur.execute("""
+    with endpoint_cursor('channel_activity') as cur:
+        results = fetch_all(cur, 'channel_activity', f"""
             SELECT 
                 d.date_key::text as date,
-                COUNT(*) as message_count,
-                COUNT(CASE WHEN fm.has_image THEN 1 END) as image_count,
+                {message_count_sql(distinct)} as message_count,
+                {message_count_sql(distinct, 'fm.has_image')} as image_count,
                 AVG(fm.message_length) as avg_message_length
             FROM analytics.fct_messages fm
             JOIN analytics.dim_channels c ON fm.channel_id = c.channel_id
@@ -130,23 +310,13 @@ async def get_channel_activity(channel_name: str):
             ORDER BY d.date_key DESC
         """, (channel_name,))
         
-        results = cur.fetchall()
-        return [ChannelActivity(**row) for row in results]
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+        return serialize_rows(cur, results, ChannelActivity)
 
 @app.get("/api/search/messages", response_model=List[MessageSearch])
-async def search_messages(query: str = Query(..., description="Search term")):
+def search_messages(query: str = Query(..., description="Search term")):
     """Search for messages containing a specific keyword."""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
-    try:
-        cur.execute("""
+    with endpoint_cursor('search_messages') as cur:
+        results = fetch_all(cur, 'search_messages', """
             SELECT 
                 fm.message_id,
                 c.channel_name,
@@ -160,23 +330,13 @@ async def search_messages(query: str = Query(..., description="Search term")):
             LIMIT 50
         """, (f'%{query.lower()}%',))
         
-        results = cur.fetchall()
-        return [MessageSearch(**row) for row in results]
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+        return serialize_rows(cur, results, MessageSearch)
 
 @app.get("/api/reports/visual-content", response_model=List[ImageDetection])
-async def get_visual_content(limit: int = Query(20, description="Number of detections to return")):
+def get_visual_content(limit: int = Query(20, description="Number of detections to return")):
     """Get YOLO object detection results for visual content analysis."""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
-    try:
-        cur.execute("""
+    with endpoint_cursor('visual_content') as cur:
+        results = fetch_all(cur, 'visual_content', """
             SELECT 
                 fid.message_id,
                 fid.detected_object_class as detected_object,
@@ -187,25 +347,71 @@ async def get_visual_content(limit: int = Query(20, description="Number of detec
             LIMIT %s
         """, (limit,))
         
-        results = cur.fetchall()
-        return [ImageDetection(**row) for row in results]
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+        return serialize_rows(cur, results, ImageDetection)
+
+@app.get("/api/reports/trending", response_model=TrendingReport)
+def get_trending(
+    window_days: int = Query(7, ge=1, le=90, description="Length of the current and previous windows in days"),
+    as_of: Optional[date] = Query(None, description="Last day of the current window (YYYY-MM-DD), default today"),
+    channel: Optional[str] = Query(None, description="Restrict to one channel"),
+    limit: int = Query(10, ge=1, le=100, description="Number of products and terms to return"),
+):
+    """Products and terms whose mentions grew most against the previous window."""
+    with endpoint_cursor('trending', dict_rows=False) as cur:
+        # Reads the per-day counters kept by the loaders, never fct_messages
+        with timed(API_QUERY_SECONDS, span_name='query', endpoint='trending'):
+            with phase('sql_exec'):
+                report = trending(cur, window_days=window_days, as_of=as_of, channel_name=channel, limit=limit)
+
+        with phase('serialize'):
+            return TrendingReport(**report)
+
+@app.get("/api/live")
+async def live_events(
+    request: Request,
+    channels: Optional[str] = Query(None, description="Comma-separated channel names"),
+    products: Optional[str] = Query(None, description="Comma-separated product names"),
+    events: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(EVENT_TYPES)}"),
+):
+    """Server-sent events stream of new messages, product mentions and detections."""
+    event_types = split_param(events)
+    if event_types and set(event_types) - set(EVENT_TYPES):
+        raise HTTPException(status_code=400, detail=f"events must be among {', '.join(EVENT_TYPES)}")
+    subscription = live_feed.subscribe(
+        channels=split_param(channels), products=split_param(products), event_types=event_types
+    )
+
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), LIVE_FEED_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment lines keep proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(*event)
+        finally:
+            live_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/api/health")
-async def health_check():
-    """Health check endpoint."""
+def health_check():
+    """Health check endpoint. Checks the primary, waiting at most API_POOL_WAIT_MS for a connection."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.fetchone()
-        cur.close()
-        conn.close()
+        conn = get_db_connection(timeout=POOL_WAIT_SECONDS)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+        finally:
+            release_db_connection(conn)
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
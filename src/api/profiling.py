@@ -0,0 +1,122 @@
+"""Opt-in per-request query profiling for the API.
+
+When enabled, each sampled request collects a timing breakdown (connection
+setup, SQL execution, row fetching, response model serialisation) that is
+returned as a Server-Timing header. Requests slower than the threshold are
+logged with their SQL and EXPLAIN (ANALYZE, BUFFERS) output.
+
+EXPLAIN ANALYZE runs the query again, so it must not add to the load that
+made the request slow: only queries that completed are explained, under a
+statement_timeout, on a borrowed read connection, and only a few at a time.
+Slow requests beyond that limit are logged without plans.
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from loguru import logger
+from starlette.middleware.base import BaseHTTPMiddleware
+
+_current_profile = ContextVar('request_profile', default=None)
+
+class RequestProfile:
+    """Timing breakdown and SQL statements collected for one request."""
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self, total_seconds):
+        entries = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.phases.items()]
+        other = total_seconds - sum(self.phases.values())
+        entries.append(f'app;dur={max(other, 0) * 1000:.2f}')
+        entries.append(f'total;dur={total_seconds * 1000:.2f}')
+        return ', '.join(entries)
+
+@contextmanager
+def phase(name):
+    """Add the block's duration to the current request's profile, if it is being profiled."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+def record_query(query, params):
+    """Remember a statement that completed, so slow requests can be explained."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.queries.append((query, params))
+
+class QueryProfilingMiddleware(BaseHTTPMiddleware):
+    """Attach Server-Timing headers and explain slow requests' SQL.
+
+    sample_rate is the fraction of requests profiled; slow_request_ms is the
+    total duration above which the request's queries are explained and
+    logged. borrow() returns a context manager lending a connection for
+    EXPLAIN, which runs under explain_timeout_ms with at most max_explains
+    slow requests explained at once.
+    """
+
+    def __init__(self, app, borrow, sample_rate=0.1, slow_request_ms=500, explain_timeout_ms=2000,
+                 max_explains=1):
+        super().__init__(app)
+        self.borrow = borrow
+        self.sample_rate = sample_rate
+        self.slow_request_ms = slow_request_ms
+        self.explain_timeout_ms = explain_timeout_ms
+        self._explain_slots = threading.BoundedSemaphore(max_explains)
+
+    async def dispatch(self, request, call_next):
+        if random.random() >= self.sample_rate:
+            return await call_next(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _current_profile.reset(token)
+        total = time.perf_counter() - start
+
+        response.headers['Server-Timing'] = profile.server_timing(total)
+        if total * 1000 >= self.slow_request_ms:
+            if profile.queries and self._explain_slots.acquire(blocking=False):
+                # Explaining re-runs the queries, so keep it off the response path
+                asyncio.get_running_loop().run_in_executor(
+                    None, self.log_slow_request, request.url.path, total, profile
+                )
+            else:
+                logger.warning(f"Slow request {request.url.path} ({total * 1000:.0f} ms, "
+                               f"{profile.server_timing(total)})")
+        return response
+
+    def log_slow_request(self, path, total, profile):
+        """Log a slow request's queries with their plans; releases the explain slot taken for it."""
+        try:
+            with self.borrow() as conn, conn.cursor() as cur:
+                # Scoped to this transaction, which the pool rolls back on return
+                cur.execute("SET LOCAL statement_timeout = %s", (self.explain_timeout_ms,))
+                for query, params in profile.queries:
+                    cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, params)
+                    plan = '\n'.join(row[0] for row in cur.fetchall())
+                    logger.warning(
+                        f"Slow request {path} ({total * 1000:.0f} ms, "
+                        f"{profile.server_timing(total)})\nSQL: {query.strip()}\n"
+                        f"Params: {params}\nPlan:\n{plan}"
+                    )
+        except Exception as e:
+            logger.warning(f"Slow request {path} ({total * 1000:.0f} ms); could not explain it: {e}")
+        finally:
+            self._explain_slots.release()
@@ -1,210 +1,208 @@
-from dagster import job, op, In, Out, Nothing, repository
+import asyncio
+import os
 import subprocess
 import sys
-import os
-from loguru import logger
+from typing import Optional
+
+from dagster import (
+    AssetExecutionContext,
+    AssetSelection,
+    Config,
+    DailyPartitionsDefinition,
+    Definitions,
+    Failure,
+    MaterializeResult,
+    MultiPartitionsDefinition,
+    ScheduleDefinition,
+    StaticPartitionsDefinition,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    job,
+    op,
+)
+
+from src.dbt_transform import DETECTION_MODELS
+from src.metrics import export_metrics
+from src.scrape_telegram import CHANNELS
+
+# Assets are partitioned by channel-day so daily runs and backfills only touch
+# the lake files and raw rows of the partitions they target, and Dagster can
+# run independent partitions in parallel.
+CHANNEL_URLS = {url.split('/')[-1]: url for url in CHANNELS}
+
+date_partitions = DailyPartitionsDefinition(
+    start_date=os.getenv('PIPELINE_START_DATE', '2024-01-01')
+)
+channel_partitions = StaticPartitionsDefinition(list(CHANNEL_URLS))
+channel_day_partitions = MultiPartitionsDefinition(
+    {'date': date_partitions, 'channel': channel_partitions}
+)
+
+def partition_date_and_channel(context: AssetExecutionContext):
+    """Return the (YYYY-MM-DD, channel_name) pair of the partition being materialized."""
+    keys = context.partition_key.keys_by_dimension
+    return keys['date'], keys['channel']
+
+class ScrapeConfig(Config):
+    # None fetches every message posted on the partition day
+    limit: Optional[int] = None
+
+@asset(partitions_def=channel_day_partitions, group_name='ingestion', pool='telegram')
+def telegram_raw_files(context: AssetExecutionContext, config: ScrapeConfig) -> MaterializeResult:
+    """Channel-day JSON file and images in data/raw/telegram_messages."""
+    # Imported here so loading the code location doesn't pay for every stage's dependencies
+    from src.scrape_telegram import scrape_summary
+
+    date_str, channel_name = partition_date_and_channel(context)
+    context.log.info(f"Scraping {channel_name} for {date_str}...")
+
+    # Goes to the scraper service's connected client when one is configured
+    results = asyncio.run(scrape_summary(
+        [CHANNEL_URLS[channel_name]], date_str=date_str, limit=config.limit, restrict_to_date=True
+    ))
+    export_metrics(f'scrape-{channel_name}')
+    if channel_name not in results:
+        raise Failure(f"Telegram scraping failed for {channel_name} on {date_str}")
+
+    return MaterializeResult(metadata=results[channel_name])
+
+@asset(partitions_def=channel_day_partitions, group_name='ingestion', deps=[telegram_raw_files])
+def raw_telegram_messages(context: AssetExecutionContext) -> MaterializeResult:
+    """raw.telegram_messages rows loaded from the channel-day JSON file."""
+    from src.load_raw_to_postgres import create_raw_schema, load_raw_data
+
+    date_str, channel_name = partition_date_and_channel(context)
+    context.log.info(f"Loading {channel_name} for {date_str} to PostgreSQL...")
+
+    create_raw_schema()
+    loaded = load_raw_data(date_str=date_str, channels=[channel_name])
+    export_metrics(f'load-{channel_name}')
+    return MaterializeResult(metadata={'rows_loaded': loaded})
+
+@asset(group_name='transformation', pool='dbt', deps=[raw_telegram_messages])
+def analytics_marts(context: AssetExecutionContext) -> None:
+    """dbt message staging, dimension and fact models in the analytics schema."""
+    from src.dbt_transform import DbtCommandError, build_models
 
-@op
-def scrape_telegram_data(context) -> str:
-    """Scrape data from Telegram channels."""
-    context.log.info("Starting Telegram data scraping...")
-    
+    context.log.info("Running dbt transformations...")
     try:
-        # Run the scraping script
-        result = subprocess.run([
-            sys.executable, "src/scrape_telegram.py"
-        ], capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            context.log.info("Telegram scraping completed successfully")
-            return "scraping_completed"
-        else:
-            context.log.error(f"Scraping failed: {result.stderr}")
-            raise Exception("Telegram scraping failed")
-    
-    except Exception as e:
-        context.log.error(f"Error in scraping: {e}")
-        raise
+        build_models(exclude=DETECTION_MODELS, state_name='messages')
+    except DbtCommandError as e:
+        raise Failure(str(e))
+    context.log.info("dbt transformations completed successfully")
 
-@op
-def load_raw_to_postgres(context, scraping_result: str) -> str:
-    """Load raw data from data lake to PostgreSQL."""
-    context.log.info("Loading raw data to PostgreSQL...")
-    
-    try:
-        # Run the loading script
-        result = subprocess.run([
-            sys.executable, "src/load_raw_to_postgres.py"
-        ], capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            context.log.info("Data loading completed successfully")
-            return "loading_completed"
-        else:
-            context.log.error(f"Loading failed: {result.stderr}")
-            raise Exception("Data loading failed")
-    
-    except Exception as e:
-        context.log.error(f"Error in loading: {e}")
-        raise
+@asset(partitions_def=channel_day_partitions, group_name='enrichment', deps=[telegram_raw_files])
+def raw_image_detections(context: AssetExecutionContext) -> MaterializeResult:
+    """raw.image_detections rows for the channel-day's downloaded images.
 
-@op
-def run_dbt_transformations(context, loading_result: str) -> str:
-    """Run dbt transformations to create staging and mart models."""
-    context.log.info("Running dbt transformations...")
-    
-    try:
-        # Change to dbt project directory
-        dbt_dir = "pharma_dbt"
-        
-        # Run dbt commands
-        commands = [
-            ["dbt", "debug"],
-            ["dbt", "run"],
-            ["dbt", "test"],
-            ["dbt", "docs", "generate"]
-        ]
-        
-        for cmd in commands:
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                cwd=os.path.join(os.getcwd(), dbt_dir)
-            )
-            
-            if result.returncode != 0:
-                context.log.error(f"dbt command failed: {cmd}, Error: {result.stderr}")
-                raise Exception(f"dbt command failed: {cmd}")
-            else:
-                context.log.info(f"dbt command completed: {cmd}")
-        
-        context.log.info("dbt transformations completed successfully")
-        return "dbt_completed"
-    
-    except Exception as e:
-        context.log.error(f"Error in dbt transformations: {e}")
-        raise
+    Only needs the downloaded images, so it runs alongside loading and dbt
+    rather than after them.
+    """
+    from src.yolo_enrichment import process_images_with_yolo
 
-@op
-def run_yolo_enrichment(context, dbt_result: str) -> str:
-    """Run YOLO object detection on images and enrich data."""
-    context.log.info("Running YOLO enrichment...")
-    
+    date_str, channel_name = partition_date_and_channel(context)
+    context.log.info(f"Running YOLO enrichment for {channel_name} on {date_str}...")
+
+    processed = process_images_with_yolo(date_str=date_str, channels=[channel_name])
+    export_metrics(f'enrich-{channel_name}')
+    return MaterializeResult(metadata={'images_processed': processed})
+
+@asset(group_name='transformation', pool='dbt', deps=[raw_image_detections])
+def detection_marts(context: AssetExecutionContext) -> None:
+    """dbt image detection models, built once the run's detections are in raw."""
+    from src.dbt_transform import DbtCommandError, build_models
+
+    context.log.info("Running dbt detection models...")
     try:
-        # Run the YOLO enrichment script
-        result = subprocess.run([
-            sys.executable, "src/yolo_enrichment.py"
-        ], capture_output=True, text=True, cwd=os.getcwd())
-        
-        if result.returncode == 0:
-            context.log.info("YOLO enrichment completed successfully")
-            return "yolo_completed"
-        else:
-            context.log.error(f"YOLO enrichment failed: {result.stderr}")
-            raise Exception("YOLO enrichment failed")
-    
-    except Exception as e:
-        context.log.error(f"Error in YOLO enrichment: {e}")
-        raise
+        build_models(select=DETECTION_MODELS, state_name='detections')
+    except DbtCommandError as e:
+        raise Failure(str(e))
+    context.log.info("dbt detection models completed successfully")
+
+@asset(group_name='export', deps=[analytics_marts, detection_marts])
+def parquet_marts(context: AssetExecutionContext) -> MaterializeResult:
+    """Date-partitioned Parquet snapshots of the marts for DuckDB, rewriting only changed partitions."""
+    from src.parquet_export import export_marts
+
+    written = export_marts()
+    context.log.info(f"Exported marts to Parquet: {written}")
+    return MaterializeResult(metadata={f'{model}_rows': rows for model, rows in written.items()})
+
+# Jobs
+pharma_telemetry_pipeline = define_asset_job(
+    name='pharma_telemetry_pipeline',
+    selection=AssetSelection.all(),
+    description="Complete data pipeline for PharmaTelemetry.",
+)
+
+# For running individual stages
+test_scraping = define_asset_job(name='test_scraping', selection=[telegram_raw_files])
+test_loading = define_asset_job(name='test_loading', selection=[raw_telegram_messages])
+test_dbt = define_asset_job(name='test_dbt', selection=[analytics_marts, detection_marts])
+test_yolo = define_asset_job(name='test_yolo', selection=[raw_image_detections])
+
+# One run per channel for the previous day
+daily_pipeline_schedule = build_schedule_from_partitioned_job(
+    pharma_telemetry_pipeline, hour_of_day=1
+)
 
 @op
-def start_fastapi_server(context, yolo_result: str) -> str:
+def start_fastapi_server(context) -> str:
     """Start the FastAPI server for the analytical API."""
     context.log.info("Starting FastAPI server...")
-    
-    try:
-        # Start the FastAPI server in background
-        process = subprocess.Popen([
-            sys.executable, "src/api/main.py"
-        ], cwd=os.getcwd())
-        
-        context.log.info(f"FastAPI server started with PID: {process.pid}")
-        return f"api_server_started_pid_{process.pid}"
-    
-    except Exception as e:
-        context.log.error(f"Error starting FastAPI server: {e}")
-        raise
+
+    # Start the FastAPI server in background
+    process = subprocess.Popen([
+        sys.executable, "-m", "src.api.main"
+    ], cwd=os.getcwd())
+
+    context.log.info(f"FastAPI server started with PID: {process.pid}")
+    return f"api_server_started_pid_{process.pid}"
 
 @job
-def pharma_telemetry_pipeline():
-    """Complete data pipeline for PharmaTelemetry."""
-    scraping_result = scrape_telegram_data()
-    loading_result = load_raw_to_postgres(scraping_result)
-    dbt_result = run_dbt_transformations(loading_result)
-    yolo_result = run_yolo_enrichment(dbt_result)
-    api_result = start_fastapi_server(yolo_result)
-    
-    # Don't return anything - just execute the pipeline
-    return None
-
-# Standalone test ops (no dependencies)
-@op
-def test_scraping_op(context) -> str:
-    """Standalone scraping test op."""
-    context.log.info("Testing scraping functionality...")
-    return scrape_telegram_data(context)
+def serve_api():
+    """Start the analytical API outside the partitioned pipeline."""
+    start_fastapi_server()
 
 @op
-def test_loading_op(context) -> str:
-    """Standalone loading test op."""
-    context.log.info("Testing loading functionality...")
-    # Create a dummy result for testing
-    dummy_result = "test_scraping_completed"
-    return load_raw_to_postgres(context, dummy_result)
+def generate_dbt_docs(context) -> None:
+    """Run dbt debug and docs generate, kept out of the pipeline run."""
+    from src.dbt_transform import generate_docs
 
-@op
-def test_dbt_op(context) -> str:
-    """Standalone dbt test op."""
-    context.log.info("Testing dbt functionality...")
-    # Create a dummy result for testing
-    dummy_result = "test_loading_completed"
-    return run_dbt_transformations(context, dummy_result)
+    generate_docs()
+    context.log.info("dbt docs generated")
 
-@op
-def test_yolo_op(context) -> str:
-    """Standalone YOLO test op."""
-    context.log.info("Testing YOLO functionality...")
-    # Create a dummy result for testing
-    dummy_result = "test_dbt_completed"
-    return run_yolo_enrichment(context, dummy_result)
-
-# For testing individual ops
 @job
-def test_scraping():
-    """Test job for scraping only."""
-    test_scraping_op()
+def dbt_docs():
+    """Refresh dbt docs on demand."""
+    generate_dbt_docs()
 
-@job
-def test_loading():
-    """Test job for loading only."""
-    test_loading_op()
+@op
+def maintain_lake(context) -> None:
+    """Compact, expire and tier lake partitions and images."""
+    from src.lake_maintenance import run_maintenance
 
-@job
-def test_dbt():
-    """Test job for dbt only."""
-    test_dbt_op()
+    context.log.info(f"Lake maintenance: {run_maintenance()}")
 
 @job
-def test_yolo():
-    """Test job for YOLO only."""
-    test_yolo_op() 
-
-@repository
-def pharma_repo():
-    return [
-        pharma_telemetry_pipeline,
-        test_dbt,
-        test_loading,
-        test_scraping,
-        test_yolo,
-    ]
-
-# Add jobs property to repository for easier access
-pharma_repo.jobs = [
-    pharma_telemetry_pipeline,
-    test_dbt,
-    test_loading,
-    test_scraping,
-    test_yolo,
-] 
\ No newline at end of file
+def lake_maintenance():
+    """Retention, compaction and image tiering for the data lake."""
+    maintain_lake()
+
+# After the daily pipeline, so yesterday's partitions are loaded and enriched first
+lake_maintenance_schedule = ScheduleDefinition(job=lake_maintenance, cron_schedule='0 3 * * *')
+
+defs = Definitions(
+    assets=[
+        telegram_raw_files,
+        raw_telegram_messages,
+        analytics_marts,
+        raw_image_detections,
+        detection_marts,
+        parquet_marts,
+    ],
+    jobs=[pharma_telemetry_pipeline, test_scraping, test_loading, test_dbt, test_yolo, serve_api, dbt_docs,
+          lake_maintenance],
+    schedules=[daily_pipeline_schedule, lake_maintenance_schedule],
+)
@@ -0,0 +1,169 @@
+"""Load-time data-quality checks for Telegram messages.
+
+Every channel-day the loader reads, and every micro-batch the stream
+ingester writes, is checked against MESSAGE_SCHEMA in one pass of pandas
+column operations rather than message by message. Rows that break a rule go
+to raw.quarantined_messages together with the rules they broke, instead of
+into raw.telegram_messages. Each batch's row counts, rule failures and value
+ranges go to raw.load_batch_stats. Since bad rows never reach raw, the dbt
+tests only look at rows loaded since the previous build (see
+dbt_transform.build_models).
+
+Rules, per field kind:
+
+    required  <field>_missing         null or absent
+    int       <field>_not_int         present but not an integer
+    timestamp <field>_unparseable     present but not a date/time
+              <field>_in_future       later than now + DQ_MAX_FUTURE_MINUTES (default 60)
+              <field>_too_old         before EARLIEST_MESSAGE_AT
+    text      <field>_control_chars   ASCII control characters other than tab and newlines
+    any       null_bytes              \\u0000 anywhere in the message, which jsonb rejects
+              duplicate_id            id already seen earlier in the batch (per channel)
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from src.db import copy_rows, insert_values
+from src.metrics import ROWS_QUARANTINED
+
+class Field(NamedTuple):
+    kind: str
+    required: bool = False
+
+MESSAGE_SCHEMA = {
+    'id': Field('int', required=True),
+    'date': Field('timestamp', required=True),
+    'message': Field('text'),
+}
+MAX_FUTURE = timedelta(minutes=int(os.getenv('DQ_MAX_FUTURE_MINUTES', '60')))
+# Telegram launched in August 2013
+EARLIEST_MESSAGE_AT = datetime(2013, 8, 1, tzinfo=timezone.utc)
+CONTROL_CHARS = '[\x00-\x08\x0b\x0c\x0e-\x1f]'
+QUARANTINE_COLUMNS = ('channel_name', 'date_scraped', 'message_data', 'reasons')
+
+class BatchReport(NamedTuple):
+    valid: list
+    rejected: dict
+    stats: dict
+
+def validate_messages(messages, payloads, channels=None, now=None, schema=MESSAGE_SCHEMA):
+    """Check a batch of message dicts; payloads are their JSON encodings, as written to raw.
+
+    channels gives each message's channel for batches mixing channels, whose
+    message ids are only unique within a channel. Returns the indexes of the
+    rows that passed, {index: [rules broken]} for the rest, and the batch's
+    stats.
+    """
+    import pandas as pd
+
+    now = pd.Timestamp(now or datetime.now(timezone.utc))
+    frame = pd.DataFrame({name: [message.get(name) for message in messages] for name in schema}, dtype=object)
+    failures = {}
+    parsed = {}
+    for name, field in schema.items():
+        column = frame[name]
+        present = column.notna()
+        if field.required:
+            failures[f'{name}_missing'] = ~present
+        if field.kind == 'int':
+            numbers = pd.to_numeric(column, errors='coerce')
+            failures[f'{name}_not_int'] = present & (numbers.isna() | (numbers % 1 != 0))
+        elif field.kind == 'timestamp':
+            times = pd.to_datetime(column, utc=True, errors='coerce', format='ISO8601')
+            failures[f'{name}_unparseable'] = present & times.isna()
+            failures[f'{name}_in_future'] = times > now + MAX_FUTURE
+            failures[f'{name}_too_old'] = times < pd.Timestamp(EARLIEST_MESSAGE_AT)
+            parsed[name] = times
+        elif field.kind == 'text':
+            text = column.astype('string')
+            failures[f'{name}_control_chars'] = text.str.contains(CONTROL_CHARS, regex=True).fillna(False)
+            parsed[name] = text
+    failures['null_bytes'] = pd.Series(payloads, dtype='string').str.contains('\\u0000', regex=False)
+    if 'id' in schema:
+        keys = frame[['id']].assign(channel=channels)
+        failures['duplicate_id'] = frame['id'].notna() & keys.duplicated()
+
+    broken = pd.DataFrame(failures).fillna(False).astype(bool)
+    bad = broken.any(axis=1)
+    rejected = {
+        int(index): [rule for rule, failed in row.items() if failed]
+        for index, row in broken[bad].iterrows()
+    }
+    good = ~bad
+    stats = {
+        'rows': len(frame),
+        'valid_rows': int(good.sum()),
+        'quarantined_rows': len(rejected),
+        'rule_failures': {rule: int(count) for rule, count in broken.sum().items() if count},
+    }
+    if 'date' in parsed:
+        dates = parsed['date'][good].dropna()
+        stats['min_message_at'] = dates.min().isoformat() if len(dates) else None
+        stats['max_message_at'] = dates.max().isoformat() if len(dates) else None
+    if 'message' in parsed:
+        text = parsed['message'][good]
+        stats['empty_text_rows'] = int((text.isna() | (text == '')).sum())
+        lengths = text.str.len().dropna()
+        stats['avg_text_length'] = float(lengths.mean()) if len(lengths) else None
+    return BatchReport(frame.index[good].tolist(), rejected, stats)
+
+def create_quality_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.quarantined_messages (
+            id SERIAL PRIMARY KEY,
+            channel_name VARCHAR(255),
+            date_scraped DATE,
+            message_data TEXT,
+            reasons TEXT[],
+            quarantined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS quarantined_messages_partition_idx
+        ON raw.quarantined_messages (channel_name, date_scraped)
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.load_batch_stats (
+            id SERIAL PRIMARY KEY,
+            source VARCHAR(20) NOT NULL,
+            channel_name VARCHAR(255),
+            date_scraped DATE,
+            rows INTEGER NOT NULL,
+            valid_rows INTEGER NOT NULL,
+            quarantined_rows INTEGER NOT NULL,
+            rule_failures JSONB,
+            min_message_at TIMESTAMPTZ,
+            max_message_at TIMESTAMPTZ,
+            empty_text_rows INTEGER,
+            avg_text_length REAL,
+            loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+def quarantine(cur, rows):
+    """Write (channel_name, date_scraped, message JSON, reasons) rows to raw.quarantined_messages."""
+    for _, _, _, reasons in rows:
+        for rule in reasons:
+            ROWS_QUARANTINED.labels(rule=rule).inc()
+    return copy_rows(cur, 'raw.quarantined_messages', QUARANTINE_COLUMNS, rows)
+
+def clear_quarantine(cur, channel_name, date_scraped):
+    """Drop a channel-day's quarantined rows before it is loaded again."""
+    cur.execute("""
+        DELETE FROM raw.quarantined_messages WHERE channel_name = %s AND date_scraped = %s
+    """, (channel_name, date_scraped))
+
+def record_batch_stats(cur, source, stats, channel_name=None, date_scraped=None):
+    from psycopg2.extras import Json
+
+    insert_values(cur, """
+        INSERT INTO raw.load_batch_stats
+        (source, channel_name, date_scraped, rows, valid_rows, quarantined_rows, rule_failures,
+         min_message_at, max_message_at, empty_text_rows, avg_text_length)
+        VALUES %s
+    """, [(
+        source, channel_name, date_scraped, stats['rows'], stats['valid_rows'], stats['quarantined_rows'],
+        Json(stats['rule_failures']), stats.get('min_message_at'), stats.get('max_message_at'),
+        stats.get('empty_text_rows'), stats.get('avg_text_length'),
+    )])
@@ -0,0 +1,257 @@
+"""Shared Postgres access for every stage: configuration, pooling and bulk writes.
+
+Connection settings come from the same POSTGRES_* variables the dbt profile
+reads, defaulting to the docker-compose database on localhost:5433. Each
+process keeps one thread-safe pool, created on first use and recreated
+after a fork, so Dagster's subprocesses never share sockets.
+
+    with transaction() as cur:                  # commit on success, rollback on error
+        copy_rows(cur, 'raw.table', columns, rows)
+
+    for rows in fetch_batches(query, params):   # server-side cursor, bounded memory
+        ...
+
+connect() opens a dedicated connection outside the pool for callers that
+hold one for a long time or change its session state, such as LISTEN.
+
+With POSTGRES_REPLICA_DSN set, read_connection() borrows from a second pool
+on that streaming replica, so API reads stay off the primary that the loader
+and dbt write to. When the replica cannot be reached, or a connection to it
+is lost mid-request, reads go to the primary for
+POSTGRES_REPLICA_RETRY_SECONDS before the replica is tried again.
+"""
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def db_config(environ=os.environ):
+    return {
+        'host': environ.get('POSTGRES_HOST', 'localhost'),
+        'port': int(environ.get('POSTGRES_PORT', '5433')),
+        'database': environ.get('POSTGRES_DB', 'pharmadb'),
+        'user': environ.get('POSTGRES_USER', 'pharmauser'),
+        'password': environ.get('POSTGRES_PASSWORD', 'pharmapass'),
+        'application_name': environ.get('POSTGRES_APPLICATION_NAME', 'pharma_telemetry'),
+    }
+
+DB_CONFIG = db_config()
+POOL_MIN = int(os.getenv('POSTGRES_POOL_MIN', '1'))
+POOL_MAX = int(os.getenv('POSTGRES_POOL_MAX', '10'))
+# How long a caller waits for a free pooled connection before giving up
+POOL_TIMEOUT_SECONDS = float(os.getenv('POSTGRES_POOL_TIMEOUT', '30'))
+# Rows per statement for insert_values
+BATCH_SIZE = int(os.getenv('POSTGRES_BATCH_SIZE', '1000'))
+REPLICA_DSN = os.getenv('POSTGRES_REPLICA_DSN')
+REPLICA_RETRY_SECONDS = float(os.getenv('POSTGRES_REPLICA_RETRY_SECONDS', '30'))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('POSTGRES_REPLICA_CONNECT_TIMEOUT', '2'))
+
+def connect(**overrides):
+    """A dedicated connection outside the pool; the caller closes it."""
+    return psycopg2.connect(**{**DB_CONFIG, **overrides})
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Every pooled connection stayed in use for the whole wait."""
+
+class ConnectionPool:
+    """ThreadedConnectionPool that waits for a free connection instead of raising when all are in use.
+
+    Connections are rolled back before they go back, so no transaction
+    leaks from one user to the next, and broken ones are discarded.
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT_SECONDS, **config):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **(config or DB_CONFIG))
+
+    def getconn(self, timeout=None):
+        """Borrow a connection, waiting up to timeout seconds (default: the pool's) for one to come back."""
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolTimeout(f"No database connection free after {timeout}s")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    if conn.autocommit:
+                        conn.autocommit = False
+                except psycopg2.Error:
+                    broken = True
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """This process's pool, created on first use."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # A forked child must not reuse its parent's sockets
+            _pool = ConnectionPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+def close_pool():
+    global _pool, _replica_pool
+    with _pool_lock:
+        for pool, pid in ((_pool, _pool_pid), (_replica_pool, _replica_pid)):
+            if pool is not None and pid == os.getpid():
+                pool.closeall()
+        _pool = _replica_pool = None
+
+_replica_pool = None
+_replica_pid = None
+_replica_down_until = 0.0
+
+def get_replica_pool():
+    """This process's replica pool, or None without a replica or while it is marked down."""
+    global _replica_pool, _replica_pid
+    if not REPLICA_DSN or time.monotonic() < _replica_down_until:
+        return None
+    with _pool_lock:
+        if _replica_pool is None or _replica_pid != os.getpid():
+            # minconn=0 so creating the pool never blocks on an unreachable replica
+            _replica_pool = ConnectionPool(minconn=0, dsn=REPLICA_DSN, connect_timeout=REPLICA_CONNECT_TIMEOUT,
+                                           application_name=DB_CONFIG['application_name'])
+            _replica_pid = os.getpid()
+        return _replica_pool
+
+def mark_replica_down(seconds=REPLICA_RETRY_SECONDS):
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + seconds
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; whatever it did and did not commit is rolled back on return."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+@contextmanager
+def read_connection(timeout=None, replica=True):
+    """Borrow a connection for read-only queries: on the replica when one is configured and up, else the primary.
+
+    A full pool raises PoolTimeout after timeout seconds; it does not spill
+    over to the other server. A replica connection that is found dead while
+    in use marks the replica down; the error still reaches the caller, which
+    can retry with replica=False.
+    """
+    pool = get_replica_pool() if replica else None
+    conn = None
+    if pool is not None:
+        try:
+            conn = pool.getconn(timeout)
+        except psycopg2.OperationalError:
+            mark_replica_down()
+    on_replica = conn is not None
+    if conn is None:
+        pool = get_pool()
+        conn = pool.getconn(timeout)
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # A lost server closes the connection; a cancelled or failed query leaves it open
+        if on_replica and conn.closed:
+            mark_replica_down()
+        raise
+    finally:
+        pool.putconn(conn)
+
+@contextmanager
+def transaction(cursor_factory=None):
+    """A cursor on a pooled connection, committed if the block succeeds and rolled back otherwise."""
+    with connection() as conn:
+        with conn.cursor(cursor_factory=cursor_factory) as cur:
+            yield cur
+        conn.commit()
+
+def fetch_batches(query, params=None, batch_size=10000):
+    """Yield the rows of a query in lists of up to batch_size from a server-side cursor.
+
+    The cursor lives on its own pooled connection inside one read-only
+    transaction, so the result is a consistent snapshot however long the
+    caller takes, and the client never holds more than one batch.
+    """
+    with connection() as conn:
+        conn.set_session(readonly=True)
+        try:
+            with conn.cursor(name='fetch_batches') as cur:
+                cur.itersize = batch_size
+                cur.execute(query, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            conn.rollback()
+            conn.set_session(readonly=False)
+
+def insert_values(cur, query, rows, template=None, page_size=BATCH_SIZE, fetch=False):
+    """execute_values with the shared page size; returns RETURNING rows when fetch is set."""
+    if not rows:
+        return []
+    return execute_values(cur, query, rows, template=template, page_size=page_size, fetch=fetch)
+
+def copy_field(value):
+    """One COPY CSV field. Strings are always quoted, so only NULL is the unquoted empty field."""
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        items = ('NULL' if item is None else '"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                 for item in value)
+        value = '{' + ','.join(items) + '}'
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+def copy_buffer(rows):
+    """CSV text for COPY FROM STDIN; lists become array literals."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(copy_field(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+def copy_rows(cur, table, columns, rows):
+    """Bulk-insert rows with COPY, much faster than row-by-row INSERTs for large loads.
+
+    COPY has no ON CONFLICT or RETURNING; use insert_values when those are needed.
+    """
+    if not rows:
+        return 0
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        copy_buffer(rows),
+    )
+    return len(rows)
@@ -0,0 +1,196 @@
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from loguru import logger
+
+DBT_PROJECT_DIR = os.getenv('DBT_PROJECT_DIR', 'pharma_dbt')
+# Artifacts of the last successful build of each selection, compared against
+# for state:modified and source_status:fresher selection
+DBT_STATE_DIR = os.path.join(DBT_PROJECT_DIR, 'target', 'last_build_state')
+# Each state's builds write their artifacts under here (relative to the project
+# dir), so a saved state never holds artifacts of another selection's build
+BUILD_TARGET_DIR = os.path.join('target', 'builds')
+# Postgres advisory lock key held for the duration of every build of the project
+BUILD_LOCK_ID = int(os.getenv('DBT_BUILD_LOCK_ID', '727001'))
+# Written next to a build's saved state: when it started, by the database's clock
+BUILD_STARTED_FILE = 'build_started_at'
+PROJECT_SOURCE_DIRS = ['models', 'macros', 'seeds', 'snapshots', 'tests']
+# Models without ref() or source() parents, which state and freshness selection never
+# picks up again: dim_dates has to run every day to extend its spine past the horizon
+ALWAYS_BUILD = ['dim_dates']
+# Models that depend on YOLO output and are built separately from the message marts
+DETECTION_MODELS = 'tag:detections'
+
+_runner = None
+_manifest_mtime = None
+
+class DbtCommandError(Exception):
+    """Raised when a dbt invocation fails."""
+
+def project_mtime():
+    """Latest modification time across the dbt project files that affect parsing."""
+    paths = [os.path.join(DBT_PROJECT_DIR, 'dbt_project.yml')]
+    for source_dir in PROJECT_SOURCE_DIRS:
+        for root, _, files in os.walk(os.path.join(DBT_PROJECT_DIR, source_dir)):
+            paths.extend(os.path.join(root, name) for name in files)
+    return max(os.path.getmtime(path) for path in paths if os.path.exists(path))
+
+def project_args():
+    return ['--project-dir', DBT_PROJECT_DIR, '--profiles-dir', DBT_PROJECT_DIR]
+
+def get_runner():
+    """Return a dbtRunner holding a parsed manifest, re-parsing only when project files change."""
+    global _runner, _manifest_mtime
+    from dbt.cli.main import dbtRunner
+
+    mtime = project_mtime()
+    if _runner is None or mtime != _manifest_mtime:
+        result = dbtRunner().invoke(['parse', *project_args()])
+        if not result.success:
+            raise DbtCommandError(f"dbt parse failed: {result.exception}")
+        _runner = dbtRunner(manifest=result.result)
+        _manifest_mtime = mtime
+        logger.info("Parsed dbt project and cached manifest.")
+    return _runner
+
+def invoke(args):
+    """Run a dbt command through the cached programmatic runner."""
+    result = get_runner().invoke([*args, *project_args()])
+    if not result.success:
+        raise DbtCommandError(f"dbt {' '.join(args)} failed: {result.exception}")
+    logger.info(f"dbt command completed: {args}")
+    return result
+
+def state_dir(state_name):
+    return os.path.join(DBT_STATE_DIR, state_name)
+
+def target_path(state_name):
+    """--target-path of the builds saved under state_name, relative to the project dir."""
+    return os.path.join(BUILD_TARGET_DIR, state_name)
+
+@contextmanager
+def build_lock():
+    """Hold the project-wide build lock.
+
+    The stream ingester and the Dagster assets build the same models from
+    different processes, and concurrent builds would run the same incremental
+    deletes and inserts at once. The lock is a session-level advisory lock on
+    a dedicated connection, released when the connection closes.
+    """
+    from src.db import connect
+
+    conn = connect()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (BUILD_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                logger.info("Waiting for another dbt build of the project to finish")
+                cur.execute("SELECT pg_advisory_lock(%s)", (BUILD_LOCK_ID,))
+        yield
+    finally:
+        conn.close()
+
+def has_previous_state(state_name):
+    return all(
+        os.path.exists(os.path.join(state_dir(state_name), name))
+        for name in ('manifest.json', 'sources.json')
+    )
+
+def state_selection(select=None):
+    """Restrict a selection to models whose code changed or whose sources received new data.
+
+    Models in ALWAYS_BUILD are added either way.
+    """
+    criteria = ['state:modified+', 'source_status:fresher+', *ALWAYS_BUILD]
+    if select:
+        # dbt selection syntax: space is union, comma is intersection
+        return ' '.join(f'{criterion},{select}' for criterion in criteria)
+    return ' '.join(criteria)
+
+def build_started_at():
+    """Now, by the clock that stamps created_at on raw and mart rows."""
+    from src.db import transaction
+
+    with transaction() as cur:
+        cur.execute("SELECT LOCALTIMESTAMP")
+        return cur.fetchone()[0].isoformat()
+
+def previous_build_start(state_name):
+    path = os.path.join(state_dir(state_name), BUILD_STARTED_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+def save_state(state_name, started_at=None):
+    """Keep this build's manifest and source freshness as the baseline for the next one."""
+    os.makedirs(state_dir(state_name), exist_ok=True)
+    if started_at:
+        with open(os.path.join(state_dir(state_name), BUILD_STARTED_FILE), 'w') as f:
+            f.write(started_at)
+    for name in ('manifest.json', 'sources.json'):
+        artifact = os.path.join(DBT_PROJECT_DIR, target_path(state_name), name)
+        if os.path.exists(artifact):
+            shutil.copy2(artifact, os.path.join(state_dir(state_name), name))
+
+def build_models(select=None, exclude=None, full=False, state_name='all'):
+    """Build and test the models affected since the last successful build.
+
+    Source freshness is collected first; together with the state saved under
+    state_name it lets dbt skip every model whose code and upstream raw data
+    are unchanged. Builds of different selections must use different
+    state_names. Without saved state (or with full=True) the whole selection
+    is built.
+
+    Incremental builds also pass the previous build's start time as the var
+    dq_loaded_since, so tests configured with __loaded_since__ only check
+    rows loaded since then; full builds test every row.
+
+    Builds from every process run one at a time (build_lock), and each
+    state_name's builds write their artifacts to their own target path.
+    """
+    with build_lock():
+        started_at = build_started_at()
+        target = ['--target-path', target_path(state_name)]
+        # Staleness is only used for selection, so a freshness failure is not fatal
+        freshness = get_runner().invoke(['source', 'freshness', *target, *project_args()])
+        if not freshness.success:
+            logger.warning(f"dbt source freshness did not succeed: {freshness.exception}")
+
+        args = ['build', *target]
+        if full or not has_previous_state(state_name):
+            if select:
+                args += ['--select', select]
+        else:
+            args += ['--select', state_selection(select), '--state', state_dir(state_name)]
+            loaded_since = previous_build_start(state_name)
+            if loaded_since:
+                args += ['--vars', json.dumps({'dq_loaded_since': loaded_since})]
+        if exclude:
+            args += ['--exclude', exclude]
+
+        result = invoke(args)
+        save_state(state_name, started_at)
+        return result
+
+def generate_docs():
+    """Check the connection and regenerate docs; kept off the pipeline's hot path."""
+    invoke(['debug'])
+    invoke(['docs', 'generate'])
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build dbt models affected since the last build.")
+    parser.add_argument('--select', help="dbt selection to restrict the build to")
+    parser.add_argument('--exclude', help="dbt selection to exclude from the build")
+    parser.add_argument('--full', action='store_true', help="ignore saved state and build everything")
+    parser.add_argument('--docs', action='store_true', help="run dbt debug and docs generate instead")
+    args = parser.parse_args()
+
+    if args.docs:
+        generate_docs()
+    else:
+        build_models(select=args.select, exclude=args.exclude, full=args.full)
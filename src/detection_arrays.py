@@ -0,0 +1,93 @@
+"""Compact detection storage: one row per image with array columns.
+
+raw.image_detections stores one row per box with DECIMAL columns and repeats
+the image path, channel and date on every box. With DETECTION_STORAGE=compact,
+enrichment and the detection service write raw.image_detection_arrays
+instead. Each image is one row holding parallel arrays:
+
+    class_ids     SMALLINT[]  ids into raw.detection_classes
+    confidences   REAL[]
+    boxes         REAL[]      x1, y1, x2, y2 of each detection, flattened (4 per detection)
+
+Images with no detections get a row with empty arrays. Rewriting a
+partition or message clears it from both layouts, so switching layouts never
+counts detections twice. The image path is not
+repeated; stg_image_detection_arrays takes it from raw.processed_images.
+stg_image_detections unnests the arrays into its per-box rows, so the
+per-detection marts and the API read either layout. agg_detection_classes
+aggregates the arrays directly and adds the rows layout's boxes.
+"""
+import os
+
+from src.db import insert_values
+
+DETECTION_TABLES = {'rows': 'raw.image_detections', 'compact': 'raw.image_detection_arrays'}
+DETECTION_STORAGE_LAYOUTS = tuple(DETECTION_TABLES)
+DETECTION_STORAGE = os.getenv('DETECTION_STORAGE', 'rows').lower()
+
+def check_storage(storage):
+    if storage not in DETECTION_STORAGE_LAYOUTS:
+        raise ValueError(f"storage must be one of {DETECTION_STORAGE_LAYOUTS}, not {storage!r}")
+
+def create_detection_array_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.detection_classes (
+            class_id SMALLSERIAL PRIMARY KEY,
+            class_name VARCHAR(100) NOT NULL UNIQUE
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.image_detection_arrays (
+            id BIGSERIAL PRIMARY KEY,
+            channel_name VARCHAR(100),
+            message_date DATE,
+            message_id BIGINT,
+            image_hash VARCHAR(64),
+            class_ids SMALLINT[] NOT NULL,
+            confidences REAL[] NOT NULL,
+            boxes REAL[] NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS image_detection_arrays_channel_date_idx
+        ON raw.image_detection_arrays (channel_name, message_date)
+    """)
+
+def class_ids(cur, class_names):
+    """{class name: class_id}, adding names not in raw.detection_classes yet."""
+    names = sorted(set(class_names))
+    if not names:
+        return {}
+    cur.execute("SELECT class_name, class_id FROM raw.detection_classes WHERE class_name = ANY(%s)", (names,))
+    known = dict(cur.fetchall())
+    missing = [name for name in names if name not in known]
+    if missing:
+        # Only unseen names are inserted, so the smallint sequence isn't spent on conflicts
+        insert_values(cur, """
+            INSERT INTO raw.detection_classes (class_name) VALUES %s
+            ON CONFLICT (class_name) DO NOTHING
+        """, [(name,) for name in missing])
+        cur.execute("SELECT class_name, class_id FROM raw.detection_classes WHERE class_name = ANY(%s)", (missing,))
+        known.update(cur.fetchall())
+    return known
+
+def to_arrays(detections, ids):
+    """Detection dicts as (class_ids, confidences, flattened boxes)."""
+    return (
+        [ids[detection['class']] for detection in detections],
+        [detection['confidence'] for detection in detections],
+        [coordinate for detection in detections for coordinate in detection['bbox']],
+    )
+
+def insert_detection_arrays(cur, message_id, image_hash, detections, channel_name, message_date):
+    """Write one message image's detections as a single row and return its id in a list."""
+    ids = class_ids(cur, [detection['class'] for detection in detections])
+    rows = insert_values(cur, """
+        INSERT INTO raw.image_detection_arrays
+        (channel_name, message_date, message_id, image_hash, class_ids, confidences, boxes)
+        VALUES %s
+        RETURNING id
+    """, [(channel_name, message_date, int(message_id), image_hash, *to_arrays(detections, ids))],
+        template='(%s, %s, %s, %s, %s::smallint[], %s::real[], %s::real[])', fetch=True)
+    return [row[0] for row in rows]
@@ -0,0 +1,214 @@
+"""Long-lived detection service that keeps the YOLO model warm.
+
+Batch enrichment pays the model load on every run and scores one image at a
+time. This service loads the model once and serves POST /api/detect over
+local HTTP (or a Unix socket). Concurrent requests are queued and run through
+the detector together: a batch closes when it reaches DETECTION_MAX_BATCH
+images or when its oldest request has waited DETECTION_MAX_WAIT_MS.
+
+Results are written to raw.processed_images (and to raw.image_detections, or
+raw.image_detection_arrays with DETECTION_STORAGE=compact, when the request
+names the message), so a later batch enrichment run of the
+same partition reuses them instead of running YOLO again.
+
+Usage:
+    python -m src.detection_service --port 8002
+    python -m src.detection_service --uds /tmp/pharma-detect.sock
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException
+from loguru import logger
+from pydantic import BaseModel
+
+from src.db import connection, transaction
+from src.detection_arrays import DETECTION_STORAGE
+from src.image_store import detector_input, file_hash, scale_detections
+from src.metrics import DETECTION_BATCH_SIZE, DETECTION_QUEUE_SECONDS, IMAGES_PROCESSED
+from src.notifications import NEW_DETECTIONS_CHANNEL, notify_rows
+
+MAX_BATCH_SIZE = int(os.getenv('DETECTION_MAX_BATCH', '16'))
+MAX_WAIT_MS = float(os.getenv('DETECTION_MAX_WAIT_MS', '20'))
+
+class DetectionBatcher:
+    """Queue of images that a single worker drains in micro-batches.
+
+    detect_fn takes a list of image paths and returns one detection list per
+    path. It runs on a dedicated thread so inference never blocks the event
+    loop and the model is only ever used by one thread.
+    """
+
+    def __init__(self, detect_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.detect_fn = detect_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='detector')
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, image_path):
+        """Queue one image and wait for its detections."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image_path, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                DETECTION_QUEUE_SECONDS.observe(started - queued_at)
+            DETECTION_BATCH_SIZE.observe(len(batch))
+            paths = [image_path for image_path, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.detect_fn, paths)
+            except Exception as e:
+                logger.error(f"Detection batch of {len(batch)} failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), detections in zip(batch, results):
+                if not future.done():
+                    future.set_result(detections)
+
+class DetectRequest(BaseModel):
+    image_path: str
+    image_hash: Optional[str] = None
+    # When all three are given the detections are also stored for the message
+    message_id: Optional[str] = None
+    channel_name: Optional[str] = None
+    message_date: Optional[str] = None
+
+class Detection(BaseModel):
+    detected_object: str
+    confidence: float
+    bbox: List[float]
+
+class DetectResponse(BaseModel):
+    image_hash: str
+    cached: bool
+    detections: List[Detection]
+
+def yolo_detect_fn():
+    """Load the model now and return a batch detect function bound to it."""
+    from src.yolo_enrichment import detect_batch, get_model
+
+    model = get_model()
+    return lambda paths: detect_batch(model, paths)
+
+def lookup_detections(image_hash):
+    from src.yolo_enrichment import load_cached_detections
+
+    with connection() as conn, conn.cursor() as cur:
+        return load_cached_detections(cur, {image_hash}).get(image_hash)
+
+def save_detections(request, image_hash, detections, store_image):
+    from src.yolo_enrichment import delete_detections, store_processed_image, write_detections
+
+    with transaction() as cur:
+        if store_image:
+            store_processed_image(cur, image_hash, request.image_path, detections)
+        if request.message_id and request.channel_name and request.message_date:
+            delete_detections(cur, request.channel_name, request.message_date, request.message_id)
+            ids = write_detections(cur, request.message_id, request.image_path, image_hash, detections,
+                                   request.channel_name, request.message_date)
+            notify_rows(cur, NEW_DETECTIONS_CHANNEL, {request.channel_name: ids}, storage=DETECTION_STORAGE)
+
+def create_app(detect_fn_factory=yolo_detect_fn, persist=True, **batcher_options):
+    """Build the service app; the model is loaded once at startup."""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        detect_fn = await loop.run_in_executor(None, detect_fn_factory)
+        logger.info(f"Detection model ready in {time.perf_counter() - start:.1f}s")
+        app.state.batcher = DetectionBatcher(detect_fn, **batcher_options)
+        app.state.batcher.start()
+        yield
+        await app.state.batcher.stop()
+
+    app = FastAPI(title="PharmaTelemetry Detection Service", version="1.0.0", lifespan=lifespan)
+
+    @app.post("/api/detect", response_model=DetectResponse)
+    async def detect_image(request: DetectRequest):
+        """Detect objects in a local image, reusing stored results for known content."""
+        if not os.path.exists(request.image_path):
+            raise HTTPException(status_code=404, detail=f"Image not found: {request.image_path}")
+        loop = asyncio.get_running_loop()
+        image_hash = request.image_hash or await loop.run_in_executor(None, file_hash, request.image_path)
+
+        detections = await loop.run_in_executor(None, lookup_detections, image_hash) if persist else None
+        cached = detections is not None
+        if not cached:
+            input_path, scale = await loop.run_in_executor(None, detector_input, request.image_path)
+            detections = scale_detections(await app.state.batcher.submit(input_path), scale)
+            IMAGES_PROCESSED.labels(channel=request.channel_name or 'service').inc()
+        if persist:
+            await loop.run_in_executor(None, save_detections, request, image_hash, detections, not cached)
+
+        return DetectResponse(
+            image_hash=image_hash,
+            cached=cached,
+            detections=[
+                Detection(detected_object=d['class'], confidence=d['confidence'], bbox=d['bbox'])
+                for d in detections
+            ],
+        )
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "queued": app.state.batcher.queue.qsize()}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve YOLO detections from a warm model.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--uds', help="listen on this Unix socket instead of TCP")
+    args = parser.parse_args()
+    # Imported after parsing so --help doesn't pay for the server
+    import uvicorn
+
+    app = create_app()
+    if args.uds:
+        uvicorn.run(app, uds=args.uds)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
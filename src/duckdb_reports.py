@@ -0,0 +1,102 @@
+"""DuckDB over the Parquet snapshots written by src/parquet_export.py.
+
+Every exported mart is a view of the same name, so queries read like their
+Postgres counterparts without the analytics schema prefix:
+
+    from src.duckdb_reports import query
+    query("SELECT date_key, count(*) FROM fct_messages GROUP BY 1").df()
+
+DuckDB scans only the columns and date partitions a query touches and runs
+vectorised, so historical aggregations never reach Postgres. One engine is
+shared per process; each caller gets its own cursor, which is how DuckDB
+connections are used from several threads.
+
+A view reads its mart's files when it is queried, so new partitions show up
+by themselves. A mart exported for the first time after the engine started
+gets its view when the next cursor is handed out.
+"""
+import glob
+import os
+import threading
+
+from src.parquet_export import EXPORT_DIR, MART_EXPORTS
+
+class ParquetEngine:
+    """In-memory DuckDB database with a view per exported mart."""
+
+    def __init__(self, export_dir=EXPORT_DIR, threads=None):
+        import duckdb
+
+        self.export_dir = export_dir
+        self.con = duckdb.connect(config={'threads': threads} if threads else {})
+        self.views = []
+        self._views_lock = threading.Lock()
+        self.create_views()
+
+    def create_views(self):
+        """Create views for the exported marts that have none yet; returns every mart with a view."""
+        with self._views_lock:
+            for model in MART_EXPORTS:
+                if model not in self.views and self.create_view(model):
+                    self.views.append(model)
+            return list(self.views)
+
+    def create_view(self, model):
+        """View over a mart's Parquet files; False if it has not been exported yet."""
+        partition_column, _ = MART_EXPORTS[model]
+        model_dir = os.path.join(self.export_dir, model)
+        if partition_column is None:
+            pattern = os.path.join(model_dir, 'part.parquet')
+            source = f"read_parquet('{pattern}')"
+        else:
+            pattern = os.path.join(model_dir, f'{partition_column}=*', 'part.parquet')
+            source = (f"read_parquet('{pattern}', hive_partitioning = true, "
+                      f"hive_types = {{'{partition_column}': DATE}})")
+        if not glob.glob(pattern):
+            return False
+        self.con.execute(f"CREATE OR REPLACE VIEW {model} AS SELECT * FROM {source}")
+        return True
+
+    def cursor(self):
+        if len(self.views) < len(MART_EXPORTS):
+            self.create_views()
+        return self.con.cursor()
+
+    def close(self):
+        self.con.close()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine(export_dir=EXPORT_DIR):
+    """The process's engine, created on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ParquetEngine(export_dir)
+        return _engine
+
+def query(sql, params=None):
+    """Run SQL against the snapshots; returns a DuckDB relation (.fetchall(), .df())."""
+    return get_engine().cursor().execute(sql, params or [])
+
+def top_products(limit=10, distinct=False):
+    """Same report as /api/reports/top-products, as a list of dicts."""
+    key = 'COALESCE(fm.duplicate_cluster_id, fm.message_id)' if distinct else 'fm.message_id'
+    cur = get_engine().cursor()
+    try:
+        cur.execute(f"""
+            SELECT
+                tag as product_name,
+                COUNT({'DISTINCT ' if distinct else ''}{key}) as mention_count,
+                STRING_AGG(DISTINCT c.channel_name, ', ' ORDER BY c.channel_name) as channels
+            FROM (SELECT *, unnest(product_tags) as tag FROM fct_messages) fm
+            JOIN dim_channels c ON fm.channel_id = c.channel_id
+            GROUP BY tag
+            ORDER BY mention_count DESC, product_name
+            LIMIT ?
+        """, [limit])
+        names = [column[0] for column in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
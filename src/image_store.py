@@ -0,0 +1,260 @@
+"""Content-addressed image store shared by the scraper and the enricher.
+
+Images live at IMAGE_STORE_DIR/<sha256[:2]>/<sha256>.jpg, where the hash is
+that of the photo as Telegram served it, and messages refer to them by hash,
+so a photo reposted across days and channels is stored and run through the
+detector once. The store index remembers which Telegram
+photo ids (and, optionally, perceptual hashes) map to which content hash:
+reposts of the same Telegram photo are not downloaded again, and re-encoded
+near-duplicates resolve to the image already stored.
+
+YOLO only ever sees IMAGE_DETECTOR_SIZE pixels (640 by default), so the store
+can write a detector-sized copy at download time and enrichment reads that
+instead of decoding the full photo. IMAGE_DETECTOR_COPY sets the policy:
+
+    off      keep only what Telegram served (default)
+    beside   also write <sha256>_small.jpg next to the original
+    replace  store only the small copy, under the original's hash
+
+In replace mode, scrape_telegram.store_photo still downloads the full photo
+and hashes those bytes. The store's decode threads then write the downscaled
+JPEG to <sha256>.jpg, and the original is never kept. That file's bytes
+therefore do not hash to its name; file_hash() of it is not the content hash.
+A photo that already fits the detector is stored as served. A repost is
+still found by its photo id or hash and is not downloaded or written again.
+
+Detections are always reported in the pixel coordinates of the file at
+image_path(), whichever file the detector read.
+
+Lake maintenance may later replace an old photo that had no detections with a
+smaller <sha256>_tiered.jpg. The store still resolves the hash to that copy
+(existing_image_path); the tiered copy is never written under <sha256>.jpg.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', 'data/raw/images')
+INDEX_FILE = 'index.json'
+
+# Perceptual hashing is opt-in: it costs a decode per download
+PHASH_ENABLED = os.getenv('IMAGE_PHASH', '').lower() in ('1', 'true', 'yes')
+# Must stay below PHASH_BANDS so a match within the distance shares a band exactly
+PHASH_MAX_DISTANCE = int(os.getenv('IMAGE_PHASH_MAX_DISTANCE', '3'))
+PHASH_BANDS = 4
+
+DETECTOR_COPY_POLICIES = ('off', 'beside', 'replace')
+DETECTOR_COPY = os.getenv('IMAGE_DETECTOR_COPY', 'off').lower()
+DETECTOR_SIZE = int(os.getenv('IMAGE_DETECTOR_SIZE', '640'))
+DETECTOR_QUALITY = int(os.getenv('IMAGE_DETECTOR_QUALITY', '90'))
+# Threads decoding and writing downloads; Pillow releases the GIL while it decodes
+DECODE_WORKERS = int(os.getenv('IMAGE_DECODE_WORKERS', '4'))
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def image_path(image_hash, store_dir=IMAGE_STORE_DIR):
+    return os.path.join(store_dir, image_hash[:2], f'{image_hash}.jpg')
+
+def detector_image_path(image_hash, store_dir=IMAGE_STORE_DIR):
+    return os.path.join(store_dir, image_hash[:2], f'{image_hash}_small.jpg')
+
+def tiered_image_path(image_hash, store_dir=IMAGE_STORE_DIR):
+    return os.path.join(store_dir, image_hash[:2], f'{image_hash}_tiered.jpg')
+
+def existing_image_path(path):
+    """path, or the tiered copy that replaced it, or None when neither exists."""
+    if os.path.exists(path):
+        return path
+    if path.endswith('.jpg'):
+        tiered_path = path[:-len('.jpg')] + '_tiered.jpg'
+        if os.path.exists(tiered_path):
+            return tiered_path
+    return None
+
+def downscale(data, max_side=DETECTOR_SIZE, quality=DETECTOR_QUALITY):
+    """JPEG bytes of the image with its longest side at most max_side, or None if it already fits."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            return None
+        # draft() has the JPEG decoder produce a 1/2, 1/4 or 1/8 scale image directly
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+def detector_input(path):
+    """(file to run the detector on, factor mapping its pixels back to path's).
+
+    The small copy is used when one sits next to path; its factor comes from
+    the two files' headers, so it stays right if the original is re-encoded.
+    """
+    name = os.path.basename(path)
+    if not name.endswith('.jpg'):
+        return path, 1.0
+    small_path = os.path.join(os.path.dirname(path), name[:-len('.jpg')] + '_small.jpg')
+    if not os.path.exists(small_path):
+        return path, 1.0
+    from PIL import Image
+
+    with Image.open(path) as original, Image.open(small_path) as small:
+        return small_path, original.size[0] / small.size[0]
+
+def scale_detections(detections, scale):
+    """Map detector-copy boxes back to the stored image's pixel coordinates."""
+    if scale == 1.0:
+        return detections
+    return [{**detection, 'bbox': [value * scale for value in detection['bbox']]} for detection in detections]
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per thread, since the same image can be written from two threads at once
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def perceptual_hash(data):
+    """64-bit difference hash (dHash) of an encoded image."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('L', (64, 64))
+        pixels = image.convert('L').resize((9, 8)).tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+class ImageStore:
+    """Content-addressed image files plus the photo-id and perceptual-hash index."""
+
+    def __init__(self, store_dir=IMAGE_STORE_DIR, use_phash=PHASH_ENABLED, detector_copy=DETECTOR_COPY):
+        if detector_copy not in DETECTOR_COPY_POLICIES:
+            raise ValueError(f"detector_copy must be one of {DETECTOR_COPY_POLICIES}, not {detector_copy!r}")
+        self.store_dir = store_dir
+        self.use_phash = use_phash
+        self.detector_copy = detector_copy
+        self._lock = threading.Lock()
+        self._executor = None
+        self.photo_ids = {}
+        self.phashes = {}
+        self._bands = {}
+        self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.store_dir, INDEX_FILE)
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path()):
+            return
+        with open(self._index_path(), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.photo_ids = index.get('photo_ids', {})
+        for image_hash, phash in index.get('phashes', {}).items():
+            self._add_phash(image_hash, phash)
+
+    def save_index(self):
+        """Persist the index, swapping the file in atomically."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        with self._lock:
+            index = {'photo_ids': dict(self.photo_ids), 'phashes': dict(self.phashes)}
+        tmp_path = f'{self._index_path()}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _band_keys(self, phash):
+        width = 64 // PHASH_BANDS
+        mask = (1 << width) - 1
+        return [(band, (phash >> (band * width)) & mask) for band in range(PHASH_BANDS)]
+
+    def _add_phash(self, image_hash, phash):
+        self.phashes[image_hash] = phash
+        for key in self._band_keys(phash):
+            self._bands.setdefault(key, set()).add(image_hash)
+
+    def find_near_duplicate(self, phash):
+        """Return a stored image within PHASH_MAX_DISTANCE of phash, if any.
+
+        Candidates come from exact matches on one of the hash's bands, so the
+        lookup does not scan every stored image.
+        """
+        candidates = set()
+        for key in self._band_keys(phash):
+            candidates |= self._bands.get(key, set())
+        for image_hash in candidates:
+            if hamming(self.phashes[image_hash], phash) <= PHASH_MAX_DISTANCE:
+                return image_hash
+        return None
+
+    def lookup_photo(self, photo_id):
+        """Content hash of a Telegram photo already in the store, or None."""
+        image_hash = self.photo_ids.get(str(photo_id))
+        if image_hash and existing_image_path(image_path(image_hash, self.store_dir)):
+            return image_hash
+        return None
+
+    def put(self, data, photo_id=None):
+        """Store image bytes and return their content hash.
+
+        Exact duplicates share one file; with perceptual hashing enabled, a
+        near-duplicate returns the hash of the image already stored. The
+        detector copy is written according to the store's policy. Safe to
+        call from several threads.
+        """
+        image_hash = content_hash(data)
+        path = image_path(image_hash, self.store_dir)
+        if existing_image_path(path) is None:
+            phash = perceptual_hash(data) if self.use_phash else None
+            with self._lock:
+                near = self.find_near_duplicate(phash) if phash is not None else None
+            if near is not None:
+                image_hash = near
+            else:
+                small = downscale(data) if self.detector_copy != 'off' else None
+                if small is not None and self.detector_copy == 'beside':
+                    write_file(detector_image_path(image_hash, self.store_dir), small)
+                write_file(path, small if small is not None and self.detector_copy == 'replace' else data)
+                if phash is not None:
+                    with self._lock:
+                        self._add_phash(image_hash, phash)
+        if photo_id is not None:
+            with self._lock:
+                self.photo_ids[str(photo_id)] = image_hash
+        return image_hash
+
+    def put_async(self, data, photo_id=None):
+        """put() on the store's decode threads; returns a concurrent.futures.Future of the hash."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix='image-store')
+        return self._executor.submit(self.put, data, photo_id)
+
+    def close(self):
+        """Wait for pending put_async() calls and stop the decode threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def path(self, image_hash):
+        return image_path(image_hash, self.store_dir)
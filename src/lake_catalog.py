@@ -0,0 +1,209 @@
+"""Catalog of the data lake's channel-day partitions.
+
+The scraper registers every partition it writes, the loader and enricher
+look partitions up here instead of walking the lake, and the maintenance
+job (src/lake_maintenance.py) records where a partition went when it is
+compacted or expired. One row per channel-day holds:
+
+    path         current file (.json, or .json.gz once compacted); NULL once expired
+    tier         hot, compacted or expired
+    messages     message count
+    version      size and mtime of the file as scraped; compaction keeps it, so
+                 the enricher's checkpoints stay valid
+    loaded_at    last load into raw.telegram_messages
+    enriched_at  last YOLO enrichment
+
+The catalog is a SQLite file at <data_dir>/_catalog.sqlite, next to the
+files it describes, so scraper and loader runs in parallel Dagster
+processes can update it without losing each other's writes. A lake
+without a catalog is scanned once to create it.
+"""
+import glob
+import gzip
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+RAW_DATA_DIR = 'data/raw/telegram_messages'
+CATALOG_NAME = '_catalog.sqlite'
+PARTITION_SUFFIXES = ('.json', '.json.gz')
+
+class Partition(NamedTuple):
+    date: str
+    channel: str
+    path: Optional[str]
+    tier: str
+    messages: int
+    bytes: int
+    version: str
+    loaded_at: Optional[str]
+    enriched_at: Optional[str]
+
+def find_partition_files(data_dir, pattern, date_str=None, channels=None):
+    """Glob the data lake, optionally narrowed to one date partition and a set of channels.
+
+    Path format: data_dir/YYYY-MM-DD/<channel><suffix>, where pattern is the
+    per-channel glob suffix (e.g. '.json' or '_images'). Only used to
+    build the catalog; everything else asks the catalog.
+    """
+    date_glob = date_str or '*'
+    if channels:
+        paths = []
+        for channel_name in channels:
+            paths.extend(glob.glob(os.path.join(data_dir, date_glob, f'{channel_name}{pattern}')))
+        return sorted(paths)
+    return sorted(glob.glob(os.path.join(data_dir, date_glob, f'*{pattern}')))
+
+def split_partition_path(path):
+    """(date, channel) of data_dir/YYYY-MM-DD/<channel>.json[.gz]."""
+    name = os.path.basename(path)
+    for suffix in sorted(PARTITION_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return os.path.basename(os.path.dirname(path)), name
+
+def file_version(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+def describes(partition, path):
+    """Whether a catalog entry still describes the file at path.
+
+    A hot file must match the version it was scraped as; a compacted one,
+    whose version is the original's, the size it was compacted to.
+    """
+    if partition is None or partition.path != path:
+        return False
+    if partition.tier == 'compacted':
+        return partition.bytes == os.path.getsize(path)
+    return partition.version == file_version(path)
+
+def read_messages(path):
+    """Messages of a partition file, compacted or not."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+class PartitionCatalog:
+    """SQLite-backed index of the partitions under data_dir."""
+
+    def __init__(self, data_dir=RAW_DATA_DIR):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, CATALOG_NAME)
+        os.makedirs(data_dir, exist_ok=True)
+        is_new = not os.path.exists(self.path)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS partitions (
+                    date TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    path TEXT,
+                    tier TEXT NOT NULL DEFAULT 'hot',
+                    messages INTEGER NOT NULL DEFAULT 0,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    version TEXT NOT NULL,
+                    loaded_at TEXT,
+                    enriched_at TEXT,
+                    PRIMARY KEY (date, channel)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tiered_images (
+                    image_hash TEXT PRIMARY KEY,
+                    original_bytes INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    tiered_at TEXT NOT NULL
+                )
+            """)
+        if is_new:
+            self.rebuild()
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+
+    def rebuild(self):
+        """Register every partition file on disk; returns how many were found.
+
+        Files the catalog already describes keep their entry, with its
+        version and load and enrichment times; only new or changed files are
+        registered afresh.
+        """
+        paths = []
+        for suffix in PARTITION_SUFFIXES:
+            paths.extend(find_partition_files(self.data_dir, suffix))
+        for path in paths:
+            date, channel = split_partition_path(path)
+            if describes(self.get(date, channel), path):
+                continue
+            self.register(date, channel, path, messages=len(read_messages(path)),
+                          tier='compacted' if path.endswith('.gz') else 'hot')
+        return len(paths)
+
+    def register(self, date, channel, path, messages, tier='hot'):
+        """Record a newly written partition, replacing any earlier entry for the channel-day."""
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO partitions (date, channel, path, tier, messages, bytes, version)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (date, channel) DO UPDATE SET
+                    path = excluded.path, tier = excluded.tier, messages = excluded.messages,
+                    bytes = excluded.bytes, version = excluded.version,
+                    loaded_at = NULL, enriched_at = NULL
+            """, (date, channel, path, tier, messages, os.path.getsize(path), file_version(path)))
+
+    def partitions(self, date_str=None, channels=None, tiers=('hot', 'compacted')):
+        """Partitions in date and channel order, optionally narrowed like find_partition_files."""
+        query = "SELECT * FROM partitions WHERE tier IN ({})".format(', '.join('?' * len(tiers)))
+        params = list(tiers)
+        if date_str:
+            query += " AND date = ?"
+            params.append(date_str)
+        if channels:
+            query += " AND channel IN ({})".format(', '.join('?' * len(channels)))
+            params.extend(channels)
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY date, channel", params).fetchall()
+        return [Partition(*row) for row in rows]
+
+    def get(self, date, channel):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM partitions WHERE date = ? AND channel = ?", (date, channel)).fetchone()
+        return Partition(*row) if row else None
+
+    def mark_loaded(self, date, channel):
+        self._update(date, channel, loaded_at=now())
+
+    def mark_enriched(self, date, channel):
+        self._update(date, channel, enriched_at=now())
+
+    def move(self, date, channel, path, tier):
+        """Point a partition at its compacted file, or at nothing once expired."""
+        self._update(date, channel, path=path, tier=tier, bytes=os.path.getsize(path) if path else 0)
+
+    def _update(self, date, channel, **fields):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE partitions SET {assignments} WHERE date = ? AND channel = ?",
+                         (*fields.values(), date, channel))
+
+    def tiered_images(self):
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT image_hash FROM tiered_images")}
+
+    def record_tiered_image(self, image_hash, original_bytes, new_bytes):
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO tiered_images (image_hash, original_bytes, bytes, tiered_at)
+                VALUES (?, ?, ?, ?)
+            """, (image_hash, original_bytes, new_bytes, now()))
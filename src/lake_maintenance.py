@@ -0,0 +1,167 @@
+"""Retention, compaction and image tiering for the data lake.
+
+- Compaction: channel-days older than LAKE_COMPACT_AFTER_DAYS (default 7)
+  are rewritten from pretty-printed JSON to minified, gzip-compressed
+  <channel>.json.gz, usually around a tenth of the size. The loader,
+  enricher and scraper read either form through the lake catalog.
+- Retention: with LAKE_RETENTION_DAYS set, channel-days older than that
+  which have been both loaded and enriched are deleted. The catalog keeps
+  them as expired so they are never scraped again; their rows stay in
+  Postgres. Off by default.
+- Image tiering: store images older than LAKE_IMAGE_TIER_AFTER_DAYS
+  (default 30) that raw.processed_images records as having no detections
+  are re-encoded to at most LAKE_IMAGE_MAX_SIDE pixels (default 1024) at
+  JPEG quality LAKE_IMAGE_QUALITY (default 80). The copy is written to
+  <sha256>_tiered.jpg and replaces the original, so no file under a hash
+  holds other bytes, and the store resolves the hash to the copy.
+  Re-enrichment reuses the cached empty detections. Images with detections
+  are never tiered, since their stored boxes are in the original's pixels.
+
+Usage:
+    python -m src.lake_maintenance             # all three steps
+    python -m src.lake_maintenance --dry-run   # report what would change
+    python -m src.lake_maintenance --rebuild-catalog
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+from loguru import logger
+
+from src.image_store import IMAGE_STORE_DIR, image_path, tiered_image_path
+from src.lake_catalog import RAW_DATA_DIR, PartitionCatalog, read_messages
+
+COMPACT_AFTER_DAYS = int(os.getenv('LAKE_COMPACT_AFTER_DAYS', '7'))
+RETENTION_DAYS = int(os.getenv('LAKE_RETENTION_DAYS')) if os.getenv('LAKE_RETENTION_DAYS') else None
+IMAGE_TIER_AFTER_DAYS = int(os.getenv('LAKE_IMAGE_TIER_AFTER_DAYS', '30'))
+IMAGE_MAX_SIDE = int(os.getenv('LAKE_IMAGE_MAX_SIDE', '1024'))
+IMAGE_QUALITY = int(os.getenv('LAKE_IMAGE_QUALITY', '80'))
+
+def age_days(partition, today):
+    return (today - date.fromisoformat(partition.date)).days
+
+def compact_partition(catalog, partition):
+    """Rewrite a hot channel-day as gzipped JSON; returns the bytes saved."""
+    messages = read_messages(partition.path)
+    compacted_path = partition.path + '.gz'
+    tmp_path = compacted_path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=9) as f:
+        json.dump(messages, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, compacted_path)
+    # Point the catalog at the new file before the old one disappears
+    catalog.move(partition.date, partition.channel, compacted_path, 'compacted')
+    os.remove(partition.path)
+    return partition.bytes - os.path.getsize(compacted_path)
+
+def expire_partition(catalog, partition):
+    """Delete a channel-day's file, keeping its catalog entry; returns the bytes freed."""
+    catalog.move(partition.date, partition.channel, None, 'expired')
+    if os.path.exists(partition.path):
+        os.remove(partition.path)
+    return partition.bytes
+
+def downscale_image(path, tiered_path, max_side=IMAGE_MAX_SIDE, quality=IMAGE_QUALITY):
+    """Swap an image for a re-encoded copy at tiered_path if that is smaller; returns (bytes before, bytes after)."""
+    from PIL import Image
+
+    before = os.path.getsize(path)
+    tmp_path = tiered_path + '.tmp'
+    with Image.open(path) as image:
+        # draft() lets the JPEG decoder skip straight to a reduced scale
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side))
+        image.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+    after = os.path.getsize(tmp_path)
+    if after >= before:
+        os.remove(tmp_path)
+        return before, before
+    # The copy is in place before the original goes
+    os.replace(tmp_path, tiered_path)
+    os.remove(path)
+    return before, after
+
+def undetected_image_hashes():
+    """Content hashes that raw.processed_images records as having no detections."""
+    from src.db import fetch_batches
+
+    query = "SELECT image_hash FROM raw.processed_images WHERE detections = '[]'::jsonb"
+    return {row[0] for rows in fetch_batches(query) for row in rows}
+
+def tier_images(catalog, store_dir=IMAGE_STORE_DIR, older_than_days=IMAGE_TIER_AFTER_DAYS, dry_run=False,
+                image_hashes=None):
+    """Downscale old store images without detections once each; returns (images, bytes saved)."""
+    cutoff = datetime.now().timestamp() - older_than_days * 86400
+    done = catalog.tiered_images()
+    images = saved = 0
+    candidates = undetected_image_hashes() if image_hashes is None else set(image_hashes)
+    for image_hash in sorted(candidates - done):
+        path = image_path(image_hash, store_dir)
+        if not os.path.exists(path) or os.path.getmtime(path) > cutoff:
+            continue
+        images += 1
+        if dry_run:
+            continue
+        try:
+            before, after = downscale_image(path, tiered_image_path(image_hash, store_dir))
+        except Exception as e:
+            logger.error(f"Could not re-encode {path}: {e}")
+            continue
+        catalog.record_tiered_image(image_hash, before, after)
+        saved += before - after
+    return images, saved
+
+def run_maintenance(data_dir=RAW_DATA_DIR, store_dir=IMAGE_STORE_DIR, today=None,
+                    compact_after_days=COMPACT_AFTER_DAYS, retention_days=RETENTION_DAYS,
+                    image_tier_after_days=IMAGE_TIER_AFTER_DAYS, tier_images_enabled=True, dry_run=False):
+    """Apply retention, compaction and image tiering; returns a summary of what changed."""
+    catalog = PartitionCatalog(data_dir)
+    today = today or date.today()
+    summary = {'expired': 0, 'compacted': 0, 'images_tiered': 0, 'bytes_saved': 0}
+
+    for partition in catalog.partitions():
+        age = age_days(partition, today)
+        expire = (retention_days is not None and age >= retention_days
+                  and partition.loaded_at and partition.enriched_at)
+        compact = not expire and partition.tier == 'hot' and age >= compact_after_days
+        if not (expire or compact):
+            continue
+        if dry_run:
+            summary['expired' if expire else 'compacted'] += 1
+            continue
+        try:
+            if expire:
+                summary['bytes_saved'] += expire_partition(catalog, partition)
+                summary['expired'] += 1
+            else:
+                summary['bytes_saved'] += compact_partition(catalog, partition)
+                summary['compacted'] += 1
+        except Exception as e:
+            logger.error(f"Maintenance of {partition.channel} on {partition.date} failed: {e}")
+
+    if tier_images_enabled:
+        images, saved = tier_images(catalog, store_dir, image_tier_after_days, dry_run=dry_run)
+        summary['images_tiered'] = images
+        summary['bytes_saved'] += saved
+
+    logger.info(
+        f"Lake maintenance{' (dry run)' if dry_run else ''}: {summary['compacted']} compacted, "
+        f"{summary['expired']} expired, {summary['images_tiered']} images re-encoded, "
+        f"{summary['bytes_saved'] / 1e6:.1f} MB saved"
+    )
+    return summary
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact, expire and tier the data lake.")
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without changing it")
+    parser.add_argument('--no-images', action='store_true', help="skip image tiering (needs Postgres)")
+    parser.add_argument('--rebuild-catalog', action='store_true', help="re-register every partition file on disk")
+    args = parser.parse_args()
+
+    if args.rebuild_catalog:
+        print(f"Registered {PartitionCatalog().rebuild()} partitions")
+    else:
+        print(run_maintenance(tier_images_enabled=not args.no_images, dry_run=args.dry_run))
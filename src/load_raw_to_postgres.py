@@ -1,84 +1,117 @@
-import os
 import json
-import glob
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
+import time
 from loguru import logger
 
-load_dotenv()
+from src.data_quality import clear_quarantine, create_quality_tables, quarantine, record_batch_stats, validate_messages
+from src.db import connection, copy_rows, transaction
+from src.lake_catalog import PartitionCatalog, read_messages
+from src.metrics import DB_WRITE_SECONDS, LOADER_ROWS_PER_SECOND, ROWS_LOADED, export_metrics, span, timed
+from src.message_dedup import assign_clusters, create_dedup_table
+from src.product_tagger import tag_message
+from src.trends import create_trend_tables, record_mentions
 
-# Database connection
-DB_CONFIG = {
-    'host': 'localhost',
-    'port': 5433,
-    'database': os.getenv('POSTGRES_DB', 'pharmadb'),
-    'user': os.getenv('POSTGRES_USER', 'pharmauser'),
-    'password': os.getenv('POSTGRES_PASSWORD', 'pharmapass')
-}
+RAW_DATA_DIR = 'data/raw/telegram_messages'
+RAW_MESSAGE_COLUMNS = ('channel_name', 'date_scraped', 'message_data', 'product_tags', 'duplicate_cluster_id')
 
 def create_raw_schema():
     """Create raw schema and tables for storing raw data."""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    # Create raw schema
-    cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
-    
-    # Create raw_telegram_messages table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS raw.telegram_messages (
-            id SERIAL PRIMARY KEY,
-            channel_name VARCHAR(255),
-            date_scraped DATE,
-            message_data JSONB,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
+    with transaction() as cur:
+        # Create raw schema
+        cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+        
+        # Create raw_telegram_messages table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS raw.telegram_messages (
+                id SERIAL PRIMARY KEY,
+                channel_name VARCHAR(255),
+                date_scraped DATE,
+                message_data JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Products mentioned in the message text, filled in by the product tagger at load time
+        cur.execute("ALTER TABLE raw.telegram_messages ADD COLUMN IF NOT EXISTS product_tags TEXT[]")
+        # Near-duplicate cluster of the message text, see src/message_dedup.py
+        cur.execute("ALTER TABLE raw.telegram_messages ADD COLUMN IF NOT EXISTS duplicate_cluster_id BIGINT")
+        create_dedup_table(cur)
+        create_trend_tables(cur)
+        create_quality_tables(cur)
     
-    conn.commit()
-    cur.close()
-    conn.close()
     logger.info("Raw schema and tables created successfully.")
 
-def load_raw_data():
-    """Load raw JSON files into PostgreSQL."""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    # Find all JSON files in the data lake
-    data_dir = 'data/raw/telegram_messages'
-    json_files = glob.glob(f'{data_dir}/**/*.json', recursive=True)
+def load_raw_data(date_str=None, channels=None, data_dir=RAW_DATA_DIR):
+    """Load raw JSON files into PostgreSQL.
+
+    date_str and channels restrict the load to those lake partitions. Each
+    channel-day file replaces whatever was previously loaded for it, so
+    re-running a partition is idempotent. Partitions come from the lake
+    catalog, compacted ones included. Messages failing the data-quality
+    checks in src/data_quality.py are quarantined instead of loaded.
+    """
+    catalog = PartitionCatalog(data_dir)
+    total_loaded = 0
     
-    for json_file in json_files:
-        # Extract channel name and date from file path
-        # Path format: data/raw/telegram_messages/YYYY-MM-DD/channel_name.json
-        path_parts = json_file.split(os.sep)
-        date_str = path_parts[-2]  # YYYY-MM-DD
-        channel_name = path_parts[-1].replace('.json', '')
-        
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-            
-            # Insert each message
-            for message in messages:
-                cur.execute("""
-                    INSERT INTO raw.telegram_messages (channel_name, date_scraped, message_data)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (channel_name, date_str, json.dumps(message)))
-            
-            logger.info(f"Loaded {len(messages)} messages from {channel_name} for {date_str}")
+    with connection() as conn, conn.cursor() as cur:
+        for partition in catalog.partitions(date_str=date_str, channels=channels):
+            date_str, channel_name = partition.date, partition.channel
             
-        except Exception as e:
-            logger.error(f"Error loading {json_file}: {e}")
+            try:
+                file_start = time.perf_counter()
+                messages = read_messages(partition.path)
+                
+                with span('load_file', channel=channel_name, date=date_str), timed(DB_WRITE_SECONDS, stage='load'):
+                    cur.execute("""
+                        DELETE FROM raw.telegram_messages
+                        WHERE channel_name = %s AND date_scraped = %s
+                    """, (channel_name, date_str))
+                    clear_quarantine(cur, channel_name, date_str)
+                    
+                    payloads = [json.dumps(message) for message in messages]
+                    report = validate_messages(messages, payloads)
+                    quarantine(cur, [
+                        (channel_name, date_str, payloads[index], reasons)
+                        for index, reasons in report.rejected.items()
+                    ])
+                    record_batch_stats(cur, 'batch', report.stats, channel_name, date_str)
+                    if report.rejected:
+                        logger.warning(
+                            f"Quarantined {len(report.rejected)} of {len(messages)} messages from "
+                            f"{channel_name} for {date_str}: {report.stats['rule_failures']}"
+                        )
+                    messages = [messages[index] for index in report.valid]
+                    payloads = [payloads[index] for index in report.valid]
+                    
+                    texts = [message.get('message') for message in messages]
+                    tags = [tag_message(message) for message in messages]
+                    cluster_ids = assign_clusters(cur, texts)
+                    
+                    # COPY the channel-day with the products each message mentions and its duplicate cluster
+                    copy_rows(cur, 'raw.telegram_messages', RAW_MESSAGE_COLUMNS, [
+                        (channel_name, date_str, payload, message_tags, cluster_id)
+                        for payload, message_tags, cluster_id in zip(payloads, tags, cluster_ids)
+                    ])
+                    
+                    # The file is the whole channel-day, so its counters are replaced
+                    record_mentions(cur, channel_name, date_str, list(zip(texts, tags)), replace=True)
+                    
+                    conn.commit()
+                catalog.mark_loaded(date_str, channel_name)
+                
+                elapsed = time.perf_counter() - file_start
+                total_loaded += len(messages)
+                ROWS_LOADED.labels(channel=channel_name).inc(len(messages))
+                if elapsed > 0:
+                    LOADER_ROWS_PER_SECOND.labels(channel=channel_name).set(len(messages) / elapsed)
+                logger.info(f"Loaded {len(messages)} messages from {channel_name} for {date_str} in {elapsed:.2f}s")
+                
+            except Exception as e:
+                logger.error(f"Error loading {partition.path}: {e}")
+                conn.rollback()
     
-    conn.commit()
-    cur.close()
-    conn.close()
     logger.info("Raw data loading completed.")
+    return total_loaded
 
 if __name__ == '__main__':
     create_raw_schema()
-    load_raw_data() 
\ No newline at end of file
+    load_raw_data()
+    export_metrics('load') 
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Near-duplicate clustering of message text with 64-bit SimHash.
+
+Channels repost and forward the same advertisement with small edits (a new
+phone number, price or emoji), which inflates message and product counts.
+At load time every message gets a SimHash of its normalised words and word
+pairs; messages within SIMHASH_MAX_DISTANCE bits of an earlier message join
+that message's cluster, and duplicate_cluster_id records it.
+
+Signatures are kept in raw.message_simhashes, split into SIMHASH_BANDS
+indexed bands. By the pigeonhole principle two hashes within the distance
+share at least one band exactly, so a batch only compares against the rows
+matching one of its bands instead of every message ever loaded. A cluster's
+id is the SimHash of its first message.
+
+Usage:
+    python -m src.message_dedup --backfill   # cluster raw rows loaded before clustering existed
+"""
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+from src.image_store import hamming
+from src.product_tagger import normalize
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+# Must stay below SIMHASH_BANDS so a match within the distance shares a band exactly
+SIMHASH_MAX_DISTANCE = 3
+BAND_WIDTH = SIMHASH_BITS // SIMHASH_BANDS
+BAND_MASK = (1 << BAND_WIDTH) - 1
+
+@lru_cache(maxsize=1 << 18)
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def features(text):
+    """Words and adjacent word pairs of the normalised text."""
+    words = normalize(text).split()
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+def simhashes(texts):
+    """SimHash of each text as an unsigned 64-bit int, or None for texts without words.
+
+    The whole batch is hashed with one vectorised bit count rather than a
+    Python loop over 64 bits per feature.
+    """
+    feature_hashes = []
+    lengths = []
+    for text in texts:
+        hashed = [feature_hash(feature) for feature in features(text or '')]
+        feature_hashes.extend(hashed)
+        lengths.append(len(hashed))
+    results = [None] * len(lengths)
+    if not feature_hashes:
+        return results
+
+    bits = np.unpackbits(
+        np.array(feature_hashes, dtype='<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little'
+    )
+    votes = bits.astype(np.int32) * 2 - 1
+    lengths = np.array(lengths)
+    nonempty = np.flatnonzero(lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[nonempty]
+    sums = np.add.reduceat(votes, starts, axis=0)
+    packed = np.packbits(sums > 0, axis=1, bitorder='little').view('<u8').ravel()
+    for index, value in zip(nonempty, packed):
+        results[index] = int(value)
+    return results
+
+def bands(simhash):
+    return [(simhash >> (band * BAND_WIDTH)) & BAND_MASK for band in range(SIMHASH_BANDS)]
+
+def to_signed(value):
+    """Store unsigned 64-bit hashes in Postgres BIGINT columns."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+class ClusterIndex:
+    """Banded lookup from SimHash to cluster id for one batch of messages.
+
+    Hashes are unsigned; cluster ids are kept in their signed BIGINT form.
+    """
+
+    def __init__(self):
+        self.clusters = {}
+        self._bands = {}
+
+    def add(self, simhash, cluster_id):
+        if simhash in self.clusters:
+            return
+        self.clusters[simhash] = cluster_id
+        for key in enumerate(bands(simhash)):
+            self._bands.setdefault(key, []).append(simhash)
+
+    def find(self, simhash):
+        """Cluster of a stored hash within SIMHASH_MAX_DISTANCE, or None."""
+        if simhash in self.clusters:
+            return self.clusters[simhash]
+        for key in enumerate(bands(simhash)):
+            for candidate in self._bands.get(key, ()):
+                if hamming(candidate, simhash) <= SIMHASH_MAX_DISTANCE:
+                    return self.clusters[candidate]
+        return None
+
+    def assign(self, simhash):
+        """Cluster id for a new message's hash, starting a new cluster if nothing is close."""
+        cluster_id = self.find(simhash)
+        if cluster_id is None:
+            cluster_id = to_signed(simhash)
+        self.add(simhash, cluster_id)
+        return cluster_id
+
+def create_dedup_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.message_simhashes (
+            simhash BIGINT PRIMARY KEY,
+            cluster_id BIGINT NOT NULL,
+            band0 INTEGER NOT NULL,
+            band1 INTEGER NOT NULL,
+            band2 INTEGER NOT NULL,
+            band3 INTEGER NOT NULL
+        );
+    """)
+    for band in range(SIMHASH_BANDS):
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS message_simhashes_band{band}_idx ON raw.message_simhashes (band{band})"
+        )
+
+def assign_clusters(cur, texts):
+    """duplicate_cluster_id for each text (None for empty ones), recording new signatures.
+
+    Runs in the caller's transaction so the signatures commit with the rows
+    that use them.
+    """
+    from src.db import insert_values
+
+    hashes = simhashes(texts)
+    present = [simhash for simhash in hashes if simhash is not None]
+    if not present:
+        return [None] * len(hashes)
+
+    band_values = list(zip(*(bands(simhash) for simhash in present)))
+    cur.execute("""
+        SELECT simhash, cluster_id
+        FROM raw.message_simhashes
+        WHERE band0 = ANY(%s) OR band1 = ANY(%s) OR band2 = ANY(%s) OR band3 = ANY(%s)
+    """, [list(set(values)) for values in band_values])
+    index = ClusterIndex()
+    for simhash, cluster_id in cur.fetchall():
+        index.add(to_unsigned(simhash), cluster_id)
+    known = set(index.clusters)
+
+    cluster_ids = [None if simhash is None else index.assign(simhash) for simhash in hashes]
+    new_rows = [
+        (to_signed(simhash), index.clusters[simhash], *bands(simhash))
+        for simhash in set(present) - known
+    ]
+    insert_values(cur, """
+        INSERT INTO raw.message_simhashes (simhash, cluster_id, band0, band1, band2, band3)
+        VALUES %s
+        ON CONFLICT (simhash) DO NOTHING
+    """, new_rows)
+    return cluster_ids
+
+def backfill_clusters(batch_size=10000):
+    """Cluster raw.telegram_messages rows that have no duplicate_cluster_id yet, oldest first."""
+    from loguru import logger
+
+    from src.db import fetch_batches, insert_values, transaction
+
+    with transaction() as cur:
+        create_dedup_table(cur)
+    total = 0
+    # Read from a server-side cursor and commit each batch, so later batches see earlier signatures
+    for rows in fetch_batches("""
+        SELECT id, message_data->>'message'
+        FROM raw.telegram_messages
+        WHERE duplicate_cluster_id IS NULL
+        ORDER BY id
+    """, batch_size=batch_size):
+        with transaction() as cur:
+            cluster_ids = assign_clusters(cur, [text for _, text in rows])
+            insert_values(cur, """
+                UPDATE raw.telegram_messages AS m
+                SET duplicate_cluster_id = v.cluster_id
+                FROM (VALUES %s) AS v (id, cluster_id)
+                WHERE m.id = v.id
+            """, [
+                (row_id, cluster_id) for (row_id, _), cluster_id in zip(rows, cluster_ids)
+                if cluster_id is not None
+            ], template='(%s, %s::bigint)')
+        total += len(rows)
+        logger.info(f"Clustered {total} raw messages")
+    return total
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Assign near-duplicate clusters to message text.")
+    parser.add_argument('--backfill', action='store_true', help="cluster raw rows loaded without a cluster id")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill_clusters()
+    else:
+        parser.print_help()
@@ -0,0 +1,142 @@
+"""Shared stage instrumentation: Prometheus counters/histograms and optional OpenTelemetry spans.
+
+Long-running processes (the API) expose REGISTRY through /metrics; batch
+stages call export_metrics() at the end of a run to write the same data in
+Prometheus text format, e.g. for node_exporter's textfile collector.
+"""
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, write_to_textfile
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer('pharmatelemetry')
+except ImportError:  # tracing is optional
+    _tracer = None
+
+METRICS_DIR = os.getenv('METRICS_DIR', 'data/metrics')
+
+REGISTRY = CollectorRegistry()
+
+# Latency buckets shared by DB and HTTP timings, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Scraping
+MESSAGES_SCRAPED = Counter(
+    'pharma_messages_scraped_total', 'Messages scraped from Telegram', ['channel'],
+    registry=REGISTRY,
+)
+MEDIA_DOWNLOAD_BYTES = Counter(
+    'pharma_media_download_bytes_total', 'Bytes of media downloaded from Telegram', ['channel'],
+    registry=REGISTRY,
+)
+MEDIA_DOWNLOADS_SKIPPED = Counter(
+    'pharma_media_downloads_skipped_total', 'Photos already in the image store, not downloaded again',
+    ['channel'], registry=REGISTRY,
+)
+TELEGRAM_ENTITY_LOOKUPS = Counter(
+    'pharma_telegram_entity_lookups_total', 'Channel entities looked up, from the cache or from Telegram',
+    ['source'], registry=REGISTRY,
+)
+MEDIA_DOWNLOAD_SECONDS = Histogram(
+    'pharma_media_download_seconds', 'Latency of a single media download', ['channel'],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+
+# Loading
+ROWS_LOADED = Counter(
+    'pharma_loader_rows_total', 'Rows written to raw.telegram_messages', ['channel'],
+    registry=REGISTRY,
+)
+ROWS_QUARANTINED = Counter(
+    'pharma_rows_quarantined_total', 'Messages kept out of raw by a load-time data-quality rule', ['rule'],
+    registry=REGISTRY,
+)
+LOADER_ROWS_PER_SECOND = Gauge(
+    'pharma_loader_rows_per_second', 'Row throughput of the most recent loader file', ['channel'],
+    registry=REGISTRY,
+)
+
+# Streaming ingestion
+STREAM_LATENCY_SECONDS = Histogram(
+    'pharma_stream_latency_seconds', 'Time from a message being posted to it reaching a layer',
+    ['layer'], buckets=LATENCY_BUCKETS + (60, 120, 300, 600), registry=REGISTRY,
+)
+STREAM_BATCH_ROWS = Histogram(
+    'pharma_stream_batch_rows', 'Messages written per streaming micro-batch',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000), registry=REGISTRY,
+)
+
+# Enrichment
+IMAGES_PROCESSED = Counter(
+    'pharma_images_processed_total', 'Images run through the detector', ['channel'],
+    registry=REGISTRY,
+)
+IMAGES_DEDUPLICATED = Counter(
+    'pharma_images_deduplicated_total', 'Image references served from detections of an identical image',
+    ['channel'], registry=REGISTRY,
+)
+INFERENCE_SECONDS = Histogram(
+    'pharma_inference_seconds', 'Per-image detector time by phase', ['phase'],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+DETECTION_BATCH_SIZE = Histogram(
+    'pharma_detection_batch_size', 'Images per detector batch in the detection service',
+    buckets=(1, 2, 4, 8, 16, 32, 64), registry=REGISTRY,
+)
+DETECTION_QUEUE_SECONDS = Histogram(
+    'pharma_detection_queue_seconds', 'Time an image waited in the detection service queue',
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+
+# Database
+DB_WRITE_SECONDS = Histogram(
+    'pharma_db_write_seconds', 'Latency of a batch of database writes', ['stage'],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+
+# API
+API_REQUEST_SECONDS = Histogram(
+    'pharma_api_request_seconds', 'API request latency', ['method', 'endpoint', 'status'],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+API_QUERY_SECONDS = Histogram(
+    'pharma_api_query_seconds', 'Latency of the SQL behind an API endpoint', ['endpoint'],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+API_REQUESTS_SHED = Counter(
+    'pharma_api_requests_shed_total', 'API requests refused with 503 or cancelled by statement_timeout',
+    ['endpoint', 'reason'], registry=REGISTRY,
+)
+LIVE_FEED_CLIENTS = Gauge(
+    'pharma_live_feed_clients', 'Clients connected to the live feed', registry=REGISTRY,
+)
+LIVE_FEED_DROPPED_EVENTS = Counter(
+    'pharma_live_feed_dropped_events_total', 'Live feed events dropped for clients that fell behind',
+    registry=REGISTRY,
+)
+
+def span(name, **attributes):
+    """Start an OpenTelemetry span, or do nothing when tracing isn't installed."""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+@contextmanager
+def timed(histogram, span_name=None, **labels):
+    """Observe the duration of the block in histogram (and a span, if span_name is given)."""
+    start = time.perf_counter()
+    with span(span_name, **labels) if span_name else nullcontext():
+        try:
+            yield
+        finally:
+            histogram.labels(**labels).observe(time.perf_counter() - start)
+
+def export_metrics(job_name, metrics_dir=METRICS_DIR):
+    """Write the registry to <metrics_dir>/<job_name>.prom for batch jobs."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f'{job_name}.prom')
+    write_to_textfile(path, REGISTRY)
+    return path
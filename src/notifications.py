@@ -0,0 +1,28 @@
+"""Postgres LISTEN/NOTIFY channels announcing new raw data.
+
+    pharma_new_messages      {"channel", "first_id", "last_id", "count"} raw.telegram_messages ids
+    pharma_new_detections    {"channel", "first_id", "last_id", "count", "storage"} ids in the
+                             writer's layout: raw.image_detections for "rows",
+                             raw.image_detection_arrays for "compact"
+    pharma_marts_refreshed   {"new_messages", "refreshed_at"} after a streaming mart build
+
+NOTIFY payloads are capped at 8000 bytes, so row notifications carry an id
+range and listeners fetch the rows themselves.
+"""
+import json
+
+NEW_MESSAGES_CHANNEL = 'pharma_new_messages'
+NEW_DETECTIONS_CHANNEL = 'pharma_new_detections'
+MARTS_REFRESHED_CHANNEL = 'pharma_marts_refreshed'
+
+def notify(cur, channel, payload):
+    """Queue a NOTIFY; Postgres delivers it when the transaction commits."""
+    cur.execute("SELECT pg_notify(%s, %s)", (channel, json.dumps(payload)))
+
+def notify_rows(cur, channel, ids_by_channel, **fields):
+    """Announce inserted row ids, one notification per Telegram channel; fields are added to each payload."""
+    for channel_name, ids in ids_by_channel.items():
+        if ids:
+            notify(cur, channel, {
+                'channel': channel_name, 'first_id': min(ids), 'last_id': max(ids), 'count': len(ids), **fields,
+            })
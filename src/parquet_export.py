@@ -0,0 +1,201 @@
+"""Snapshot the analytics marts to date-partitioned Parquet for DuckDB.
+
+Heavy historical scans (notebooks, ad-hoc analysis, the optional DuckDB
+report path in the API) read these files through src/duckdb_reports.py
+instead of competing with API traffic on Postgres.
+
+Layout, hive-partitioned so DuckDB prunes dates from the path alone:
+
+    data/marts/fct_messages/date_key=2025-01-31/part.parquet
+    data/marts/fct_image_detections/message_date=2025-01-31/part.parquet
+    data/marts/dim_channels/part.parquet
+    data/marts/_manifest.json
+
+A fact partition is rewritten only when its row count or latest load time
+differs from the manifest. Dimensions are small and always rewritten.
+Every file is written under a temporary name and renamed into place, so
+readers never see half-written files. Rows without a date (outside the
+dim_dates spine) have no partition and are not exported.
+
+Usage:
+    python -m src.parquet_export          # changed partitions only
+    python -m src.parquet_export --full   # every partition
+"""
+import json
+import os
+import shutil
+
+from loguru import logger
+
+from src.db import connection, fetch_batches
+from src.metrics import DB_WRITE_SECONDS, timed
+
+EXPORT_DIR = os.getenv('PARQUET_EXPORT_DIR', os.path.join('data', 'marts'))
+MANIFEST_NAME = '_manifest.json'
+
+# model: (partition column, column whose max tells whether a partition changed)
+MART_EXPORTS = {
+    'fct_messages': ('date_key', 'created_at'),
+    'fct_image_detections': ('message_date', 'detection_timestamp'),
+    'dim_channels': (None, None),
+    'dim_dates': (None, None),
+}
+
+# information_schema data_type to DuckDB type; anything else is exported as VARCHAR
+DUCKDB_TYPES = {
+    'smallint': 'SMALLINT',
+    'integer': 'INTEGER',
+    'bigint': 'BIGINT',
+    'numeric': 'DOUBLE',
+    'real': 'FLOAT',
+    'double precision': 'DOUBLE',
+    'boolean': 'BOOLEAN',
+    'date': 'DATE',
+    'timestamp without time zone': 'TIMESTAMP',
+    'timestamp with time zone': 'TIMESTAMPTZ',
+}
+
+def duckdb_type(data_type, udt_name):
+    if data_type == 'ARRAY':
+        element_type = DUCKDB_TYPES.get({'_int4': 'integer', '_int8': 'bigint'}.get(udt_name), 'VARCHAR')
+        return f'{element_type}[]'
+    return DUCKDB_TYPES.get(data_type, 'VARCHAR')
+
+def column_types(cur, model, schema='analytics'):
+    """[(column, DuckDB type)] of a mart, in table order."""
+    cur.execute("""
+        SELECT column_name, data_type, udt_name
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY ordinal_position
+    """, (schema, model))
+    return [(name, duckdb_type(data_type, udt_name)) for name, data_type, udt_name in cur.fetchall()]
+
+def write_parquet(path, columns, rows):
+    """Write rows to one Parquet file with the given (column, DuckDB type) schema.
+
+    Casting every column to its declared type keeps the schema identical
+    across partitions, whatever pandas would have inferred from the values.
+    """
+    import duckdb
+    import pandas as pd
+
+    frame = pd.DataFrame(rows, columns=[name for name, _ in columns])
+    casts = ', '.join(f'CAST("{name}" AS {column_type}) AS "{name}"' for name, column_type in columns)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    con = duckdb.connect()
+    try:
+        con.register('frame', frame)
+        con.execute(f"COPY (SELECT {casts} FROM frame) TO '{tmp_path}' (FORMAT parquet, COMPRESSION zstd)")
+    finally:
+        con.close()
+    os.replace(tmp_path, path)
+
+def partition_path(export_dir, model, partition_column=None, value=None):
+    if partition_column is None:
+        return os.path.join(export_dir, model, 'part.parquet')
+    return os.path.join(export_dir, model, f'{partition_column}={value}', 'part.parquet')
+
+def load_manifest(export_dir):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    os.makedirs(export_dir, exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+def partition_fingerprints(cur, model, partition_column, change_column):
+    """{partition value: 'rows/latest change'} for every dated partition of a fact."""
+    cur.execute(f"""
+        SELECT {partition_column}::text, count(*), max({change_column})::text
+        FROM analytics.{model}
+        WHERE {partition_column} IS NOT NULL
+        GROUP BY 1
+    """)
+    return {value: f'{count}/{latest}' for value, count, latest in cur.fetchall()}
+
+def changed_partitions(current, exported):
+    """Partitions to (re)write and partitions that disappeared from the mart."""
+    changed = sorted(value for value, fingerprint in current.items() if exported.get(value) != fingerprint)
+    removed = sorted(set(exported) - set(current))
+    return changed, removed
+
+def export_model(model, manifest, export_dir=EXPORT_DIR, full=False):
+    """Export one mart; returns the number of rows written."""
+    partition_column, change_column = MART_EXPORTS[model]
+    with connection() as conn, conn.cursor() as cur:
+        columns = column_types(cur, model)
+        if not columns:
+            logger.warning(f"analytics.{model} does not exist yet, skipping")
+            return 0
+        current = partition_fingerprints(cur, model, partition_column, change_column) if partition_column else {}
+
+    column_list = ', '.join(f'"{name}"' for name, _ in columns)
+    if partition_column is None:
+        rows = [row for batch in fetch_batches(f"SELECT {column_list} FROM analytics.{model}") for row in batch]
+        write_parquet(partition_path(export_dir, model), columns, rows)
+        return len(rows)
+
+    exported = {} if full else manifest.get(model, {})
+    changed, removed = changed_partitions(current, exported)
+    for value in removed:
+        shutil.rmtree(os.path.dirname(partition_path(export_dir, model, partition_column, value)), ignore_errors=True)
+    if not changed:
+        manifest[model] = current
+        return 0
+
+    # One ordered scan of the changed partitions, written out a partition at a time
+    partition_index = [name for name, _ in columns].index(partition_column)
+    written = 0
+    pending_value, pending_rows = None, []
+
+    def flush():
+        write_parquet(partition_path(export_dir, model, partition_column, pending_value), columns, pending_rows)
+
+    for batch in fetch_batches(f"""
+        SELECT {column_list} FROM analytics.{model}
+        WHERE {partition_column}::text = ANY(%s)
+        ORDER BY {partition_column}
+    """, (changed,)):
+        for row in batch:
+            value = str(row[partition_index])
+            if value != pending_value and pending_rows:
+                flush()
+                pending_rows = []
+            pending_value = value
+            pending_rows.append(row)
+            written += 1
+    if pending_rows:
+        flush()
+    manifest[model] = current
+    logger.info(f"Exported {written} {model} rows in {len(changed)} partitions")
+    return written
+
+def export_marts(models=None, export_dir=EXPORT_DIR, full=False):
+    """Export the marts to Parquet; returns {model: rows written}."""
+    manifest = load_manifest(export_dir)
+    written = {}
+    with timed(DB_WRITE_SECONDS, stage='parquet_export'):
+        for model in models or MART_EXPORTS:
+            written[model] = export_model(model, manifest, export_dir, full=full)
+            # Saved after every model so an interrupted export keeps what it finished
+            save_manifest(export_dir, manifest)
+    return written
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the analytics marts to date-partitioned Parquet.")
+    parser.add_argument('--full', action='store_true', help="rewrite every partition")
+    parser.add_argument('--model', action='append', dest='models', choices=list(MART_EXPORTS),
+                        help="only this mart (repeatable)")
+    args = parser.parse_args()
+
+    print(export_marts(models=args.models, full=args.full))
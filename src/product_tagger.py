@@ -0,0 +1,124 @@
+"""Single-pass product tagging of message text with an Aho-Corasick automaton.
+
+Product names and their synonyms come from the dbt seed
+pharma_dbt/seeds/product_synonyms.csv. Text and synonyms go through the
+same normalisation: casefolding, punctuation to spaces, and folding of the
+Ge'ez letters that Amharic writers use interchangeably (ሐ/ኀ → ሀ, ሠ → ሰ,
+ዐ → አ, ፀ → ጸ, ሃ → ሀ, ኣ → አ). Synonyms only match whole words, so one scan
+of a message finds every product it mentions however large the dictionary.
+
+Usage:
+    python -m src.product_tagger --backfill   # tag raw rows loaded before tagging existed
+"""
+import csv
+import os
+import string
+from functools import lru_cache
+
+import ahocorasick
+
+SYNONYMS_PATH = os.getenv(
+    'PRODUCT_SYNONYMS_PATH',
+    os.path.join(os.getenv('DBT_PROJECT_DIR', 'pharma_dbt'), 'seeds', 'product_synonyms.csv'),
+)
+
+# First code point of each Ge'ez syllable series and the series it is folded into
+GEEZ_SERIES_FOLDS = {
+    0x1210: 0x1200,  # ሐ → ሀ
+    0x1280: 0x1200,  # ኀ → ሀ
+    0x1220: 0x1230,  # ሠ → ሰ
+    0x12D0: 0x12A0,  # ዐ → አ
+    0x1340: 0x1338,  # ፀ → ጸ
+}
+# Series whose fourth order (ሃ, ኣ) is written for the first
+GEEZ_FOURTH_ORDER_FOLDS = (0x1200, 0x12A0)
+GEEZ_PUNCTUATION = '፠፡።፣፤፥፦፧፨'
+
+def build_translation():
+    table = {ord(char): ' ' for char in string.punctuation + string.whitespace + GEEZ_PUNCTUATION}
+    for source, target in GEEZ_SERIES_FOLDS.items():
+        for order in range(8):
+            table[source + order] = target + order
+    for series in GEEZ_FOURTH_ORDER_FOLDS:
+        table[series + 3] = series
+    # Fourth orders of the folded series land on their target's first order too
+    for source, target in GEEZ_SERIES_FOLDS.items():
+        if target in GEEZ_FOURTH_ORDER_FOLDS:
+            table[source + 3] = target
+    return table
+
+TRANSLATION = build_translation()
+
+def normalize(text):
+    """Casefold, fold Ge'ez variants and pad with spaces so every word is space-delimited."""
+    return f' {text.casefold().translate(TRANSLATION)} '
+
+def load_synonyms(path=SYNONYMS_PATH):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [(row['product_name'], row['synonym']) for row in csv.DictReader(f)]
+
+class ProductTagger:
+    """Aho-Corasick automaton over normalised synonyms, each mapping to its product."""
+
+    def __init__(self, synonyms):
+        self.automaton = ahocorasick.Automaton()
+        for product_name, synonym in synonyms:
+            words = normalize(synonym).split()
+            if words:
+                # Padding with spaces restricts matches to whole words
+                self.automaton.add_word(f" {' '.join(words)} ", product_name)
+        self.automaton.make_automaton()
+        self.products = sorted({product_name for product_name, _ in synonyms})
+
+    def tag(self, text):
+        """Sorted product names mentioned in text."""
+        if not text:
+            return []
+        return sorted({product for _, product in self.automaton.iter(normalize(text))})
+
+@lru_cache(maxsize=None)
+def get_tagger(path=SYNONYMS_PATH):
+    """Build the tagger for a dictionary once per process."""
+    return ProductTagger(load_synonyms(path))
+
+def tag_message(message):
+    """Product tags for a Message.to_dict() payload."""
+    return get_tagger().tag(message.get('message'))
+
+def backfill_tags(batch_size=10000):
+    """Tag raw.telegram_messages rows that have no product_tags yet; returns rows tagged."""
+    from loguru import logger
+
+    from src.db import fetch_batches, insert_values, transaction
+
+    tagger = get_tagger()
+    total = 0
+    for rows in fetch_batches("""
+        SELECT id, message_data->>'message'
+        FROM raw.telegram_messages
+        WHERE product_tags IS NULL
+        ORDER BY id
+    """, batch_size=batch_size):
+        with transaction() as cur:
+            insert_values(cur, """
+                UPDATE raw.telegram_messages AS m
+                SET product_tags = v.tags
+                FROM (VALUES %s) AS v (id, tags)
+                WHERE m.id = v.id
+            """, [(row_id, tagger.tag(text)) for row_id, text in rows], template='(%s, %s::text[])')
+        total += len(rows)
+        logger.info(f"Tagged {total} raw messages")
+    return total
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tag messages with the products they mention.")
+    parser.add_argument('--backfill', action='store_true', help="tag raw rows loaded without product_tags")
+    parser.add_argument('text', nargs='*', help="text to tag")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill_tags()
+    else:
+        print(get_tagger().tag(' '.join(args.text)))
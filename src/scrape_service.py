@@ -0,0 +1,114 @@
+"""Long-lived scraper that keeps one Telegram client connected.
+
+Every Dagster run of telegram_raw_files otherwise starts a process that opens
+the session file, connects and authorises before fetching a single message.
+This service does that once at startup and serves POST /api/scrape over local
+HTTP (or a Unix socket). The asset hands its channel-day to the service when
+SCRAPER_SERVICE_URL or SCRAPER_SERVICE_SOCKET is set. The channel entity
+cache, image store index and lake catalog also stay loaded between runs.
+
+Scrapes run one at a time on the shared client, and a dropped connection is
+re-established before the next one.
+
+Usage:
+    python -m src.scrape_service --port 8003
+    python -m src.scrape_service --uds /tmp/pharma-scrape.sock
+"""
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI
+from loguru import logger
+from pydantic import BaseModel
+
+from src.image_store import ImageStore
+from src.lake_catalog import PartitionCatalog
+from src.scrape_telegram import (
+    API_HASH,
+    API_ID,
+    RAW_DATA_DIR,
+    SESSION_NAME,
+    EntityCache,
+    detection_service_client,
+    scrape_with_client,
+    summarize,
+)
+
+class ScrapeRequest(BaseModel):
+    channels: List[str]
+    date: Optional[str] = None
+    # None fetches every message (of the day, with restrict_to_date)
+    limit: Optional[int] = 100
+    restrict_to_date: bool = False
+
+class ChannelSummary(BaseModel):
+    messages: int
+    images: int
+
+def telegram_client():
+    from telethon import TelegramClient
+
+    return TelegramClient(SESSION_NAME, API_ID, API_HASH)
+
+def create_app(client_factory=telegram_client, scrape_fn=scrape_with_client):
+    """Build the service app; the client connects once at startup."""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.client = client_factory()
+        await app.state.client.start()
+        logger.info("Telegram client connected")
+        app.state.image_store = ImageStore()
+        app.state.catalog = PartitionCatalog(RAW_DATA_DIR)
+        app.state.entity_cache = EntityCache()
+        app.state.detection_client = detection_service_client()
+        app.state.lock = asyncio.Lock()
+        yield
+        if app.state.detection_client is not None:
+            await app.state.detection_client.aclose()
+        app.state.image_store.close()
+        await app.state.client.disconnect()
+
+    app = FastAPI(title="PharmaTelemetry Scraper Service", version="1.0.0", lifespan=lifespan)
+
+    @app.post("/api/scrape", response_model=Dict[str, ChannelSummary])
+    async def scrape(request: ScrapeRequest):
+        """Scrape channels into the lake with the connected client; channels that failed are left out."""
+        async with app.state.lock:
+            client = app.state.client
+            if not client.is_connected():
+                logger.warning("Telegram client disconnected, reconnecting")
+                await client.connect()
+            results = await scrape_fn(
+                client, request.channels, date_str=request.date, limit=request.limit,
+                restrict_to_date=request.restrict_to_date, image_store=app.state.image_store,
+                catalog=app.state.catalog, entity_cache=app.state.entity_cache,
+                detection_client=app.state.detection_client,
+            )
+        return summarize(results)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "connected": app.state.client.is_connected()}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape Telegram with one long-lived client.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8003)
+    parser.add_argument('--uds', help="listen on this Unix socket instead of TCP")
+    args = parser.parse_args()
+    # Imported after parsing so --help doesn't pay for the server
+    import uvicorn
+
+    app = create_app()
+    if args.uds:
+        uvicorn.run(app, uds=args.uds)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,23 @@
 import os
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
-from telethon.tl.types import MessageMediaPhoto
 from loguru import logger
 import time
 import asyncio
 
+from src.image_store import ImageStore
+from src.lake_catalog import PartitionCatalog, read_messages
+from src.metrics import (
+    MEDIA_DOWNLOAD_BYTES,
+    MEDIA_DOWNLOAD_SECONDS,
+    MEDIA_DOWNLOADS_SKIPPED,
+    MESSAGES_SCRAPED,
+    TELEGRAM_ENTITY_LOOKUPS,
+    export_metrics,
+    span,
+)
+
 # Custom JSON encoder to handle datetime objects and bytes
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -27,8 +36,24 @@ API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 SESSION_NAME = os.getenv('TELEGRAM_SESSION', 'pharmatelemetry')
 
+# Optional detection service (src/detection_service.py) to hand images to as they download
+DETECTION_SERVICE_URL = os.getenv('DETECTION_SERVICE_URL')
+DETECTION_SERVICE_SOCKET = os.getenv('DETECTION_SERVICE_SOCKET')
+
+# Optional scraper service (src/scrape_service.py) that keeps one client connected across runs
+SCRAPER_SERVICE_URL = os.getenv('SCRAPER_SERVICE_URL')
+SCRAPER_SERVICE_SOCKET = os.getenv('SCRAPER_SERVICE_SOCKET')
+SCRAPER_SERVICE_TIMEOUT = float(os.getenv('SCRAPER_SERVICE_TIMEOUT', '3600'))
+
 RAW_DATA_DIR = 'data/raw/telegram_messages'
 SCRAPE_LOG_PATH = 'data/raw/scrape_log.json'
+ENTITY_CACHE_PATH = os.getenv('TELEGRAM_ENTITY_CACHE', 'data/raw/channel_entities.json')
+
+CHANNELS = [
+    'https://t.me/lobelia4cosmetics',
+    'https://t.me/tikvahpharma',
+    # Add more channels as needed
+]
 
 # Utility to load and update scrape log
 def load_scrape_log():
@@ -42,8 +67,75 @@ def update_scrape_log(channel, date_str, status, error=None):
     if channel not in log:
         log[channel] = {}
     log[channel][date_str] = {'status': status, 'error': error, 'timestamp': datetime.now().isoformat()}
-    with open(SCRAPE_LOG_PATH, 'w', encoding='utf-8') as f:
+    # Write to a temp file and swap it in so concurrent partition runs never
+    # leave a half-written log behind
+    tmp_path = f'{SCRAPE_LOG_PATH}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(log, f, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
+    os.replace(tmp_path, SCRAPE_LOG_PATH)
+
+class EntityCache:
+    """Channel name to (id, access hash), so each username is resolved once rather than on every run.
+
+    Access hashes belong to the account, not the session, so entries stay
+    valid across sessions and processes until Telegram rejects one.
+    """
+
+    def __init__(self, path=ENTITY_CACHE_PATH):
+        self.path = path
+        self.entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, removed=()):
+        # Merge with what other processes saved since this cache was loaded
+        entries = self._load()
+        entries.update(self.entries)
+        for channel_name in removed:
+            entries.pop(channel_name, None)
+        self.entries = entries
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, channel_name):
+        from telethon.tl.types import InputPeerChannel
+
+        entry = self.entries.get(channel_name)
+        return InputPeerChannel(entry['id'], entry['access_hash']) if entry else None
+
+    def put(self, channel_name, peer):
+        self.entries[channel_name] = {
+            'id': peer.channel_id,
+            'access_hash': peer.access_hash,
+            'resolved_at': datetime.now().isoformat(),
+        }
+        self._save()
+
+    def forget(self, channel_name):
+        self.entries.pop(channel_name, None)
+        self._save(removed=[channel_name])
+
+async def resolve_channel(client, channel_url, entity_cache):
+    """Input peer for a channel URL, asking Telegram only when the cache has no entry."""
+    from telethon.tl.types import InputPeerChannel
+
+    channel_name = channel_url.split('/')[-1]
+    peer = entity_cache.get(channel_name)
+    if peer is not None:
+        TELEGRAM_ENTITY_LOOKUPS.labels(source='cache').inc()
+        return peer
+    peer = await client.get_input_entity(channel_url)
+    TELEGRAM_ENTITY_LOOKUPS.labels(source='telegram').inc()
+    if isinstance(peer, InputPeerChannel):
+        entity_cache.put(channel_name, peer)
+    return peer
 
 def clean_message_data(msg_dict):
     """Clean message data to remove problematic characters"""
@@ -59,63 +151,173 @@ def clean_message_data(msg_dict):
             return value
     return clean_value(msg_dict)
 
-async def scrape_channel(client, channel_url, date_str=None, limit=100, max_retries=3):
+def detection_service_client():
+    """HTTP client for the detection service, or None when none is configured."""
+    if not (DETECTION_SERVICE_URL or DETECTION_SERVICE_SOCKET):
+        return None
+    import httpx
+
+    transport = httpx.AsyncHTTPTransport(uds=DETECTION_SERVICE_SOCKET) if DETECTION_SERVICE_SOCKET else None
+    return httpx.AsyncClient(
+        base_url=DETECTION_SERVICE_URL or 'http://detection-service', transport=transport, timeout=60
+    )
+
+async def request_detection(detection_client, image_path, image_hash, message_id, channel_name, date_str):
+    """Queue an image on the detection service; failures leave it to batch enrichment."""
+    try:
+        response = await detection_client.post('/api/detect', json={
+            'image_path': image_path,
+            'image_hash': image_hash,
+            'message_id': str(message_id),
+            'channel_name': channel_name,
+            'message_date': date_str,
+        })
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Detection service request failed for message {message_id}: {e}")
+
+async def store_photo(client, message, image_store, channel_name):
+    """Put a message's photo in the image store, downloading it only if it isn't there yet.
+
+    Returns a future of the content hash. Only the download is awaited here;
+    decoding, downscaling and writing run on the store's threads, so the next
+    message is fetched meanwhile.
+    """
+    photo_id = getattr(message.media.photo, 'id', None)
+    image_hash = image_store.lookup_photo(photo_id) if photo_id else None
+    if image_hash is None:
+        download_start = time.perf_counter()
+        data = await client.download_media(message, file=bytes)
+        MEDIA_DOWNLOAD_SECONDS.labels(channel=channel_name).observe(time.perf_counter() - download_start)
+        MEDIA_DOWNLOAD_BYTES.labels(channel=channel_name).inc(len(data))
+        return asyncio.wrap_future(image_store.put_async(data, photo_id=photo_id))
+    MEDIA_DOWNLOADS_SKIPPED.labels(channel=channel_name).inc()
+    stored = asyncio.get_running_loop().create_future()
+    stored.set_result(image_hash)
+    return stored
+
+async def attach_photo(stored, msg_dict, image_store, on_stored=None):
+    """Record a stored photo's hash and path on its message once the store has written it."""
+    try:
+        image_hash = await stored
+    except Exception as e:
+        logger.error(f"Failed to store image for message {msg_dict.get('id')}: {e}")
+        return
+    msg_dict['downloaded_image'] = image_store.path(image_hash)
+    msg_dict['image_hash'] = image_hash
+    if on_stored is not None:
+        on_stored(msg_dict)
+
+async def scrape_channel(client, channel_url, date_str=None, limit=100, max_retries=3, restrict_to_date=False,
+                         image_store=None, detection_client=None, catalog=None, entity_cache=None):
+    """Scrape one channel into the data lake partition for date_str.
+
+    With restrict_to_date=True only messages posted on date_str (UTC) are
+    fetched, which is what partitioned runs and backfills use. Photos go to
+    the content-addressed image_store; each message records the image's
+    hash and store path, and photos already in the store are not downloaded
+    again. With a detection_client, each photo is also queued on the
+    detection service while scraping continues. Channel-days already in the
+    lake catalog, compacted or expired ones included, are not scraped again.
+    The channel is addressed through entity_cache, so its username is only
+    resolved the first time.
+    """
+    from telethon.errors import ChannelInvalidError, ChannelPrivateError, FloodWaitError
+    from telethon.tl.types import MessageMediaPhoto
+
     channel_name = channel_url.split('/')[-1]
+    if image_store is None:
+        image_store = ImageStore()
+    if catalog is None:
+        catalog = PartitionCatalog(RAW_DATA_DIR)
+    if entity_cache is None:
+        entity_cache = EntityCache()
     if date_str is None:
         date_str = datetime.now().strftime('%Y-%m-%d')
+    iter_kwargs = {'limit': limit}
+    if restrict_to_date:
+        day_start = datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        # iter_messages walks backwards from offset_date
+        iter_kwargs['offset_date'] = day_start + timedelta(days=1)
     out_dir = os.path.join(RAW_DATA_DIR, date_str)
     os.makedirs(out_dir, exist_ok=True)
     out_path = os.path.join(out_dir, f'{channel_name}.json')
-    images_dir = os.path.join(out_dir, f'{channel_name}_images')
-    os.makedirs(images_dir, exist_ok=True)
 
     # Incremental scraping: skip if already scraped
-    if os.path.exists(out_path):
+    existing = catalog.get(date_str, channel_name)
+    if existing is not None:
         logger.info(f"Skipping {channel_name} for {date_str}: already scraped.")
         update_scrape_log(channel_name, date_str, status='skipped')
+        if existing.path is None:
+            # Expired by the lake retention policy; its rows stay in Postgres
+            return {'messages': [], 'images': []}
         # Load existing data
         try:
-            with open(out_path, 'r', encoding='utf-8') as f:
-                messages_data = json.load(f)
+            messages_data = read_messages(existing.path)
             return {
                 'messages': messages_data,
-                'images': [f for f in os.listdir(images_dir) if f.endswith('.jpg')]
+                'images': sorted({m['image_hash'] for m in messages_data if m.get('image_hash')})
             }
         except Exception as e:
             logger.error(f"Error loading existing data for {channel_name}: {e}")
             return None
 
     messages_data = []
-    downloaded_images = []
+    pending_detections = []
+
+    def queue_detection(msg_dict):
+        pending_detections.append(asyncio.create_task(request_detection(
+            detection_client, msg_dict['downloaded_image'], msg_dict['image_hash'],
+            msg_dict['id'], channel_name, date_str,
+        )))
+
     attempt = 0
     while attempt < max_retries:
         try:
-            async for message in client.iter_messages(channel_url, limit=limit):
+            messages_data = []
+            pending_photos = []
+            pending_detections = []
+            peer = await resolve_channel(client, channel_url, entity_cache)
+            async for message in client.iter_messages(peer, **iter_kwargs):
+                if restrict_to_date and message.date < day_start:
+                    break
                 msg_dict = message.to_dict()
                 # Clean the message data
                 msg_dict = clean_message_data(msg_dict)
                 # Download images if present
                 if message.media and isinstance(message.media, MessageMediaPhoto):
-                    image_path = os.path.join(images_dir, f'{message.id}.jpg')
                     try:
-                        await client.download_media(message, file=image_path)
-                        msg_dict['downloaded_image'] = image_path
-                        downloaded_images.append(f'{message.id}.jpg')
+                        stored = await store_photo(client, message, image_store, channel_name)
+                        pending_photos.append(asyncio.create_task(attach_photo(
+                            stored, msg_dict, image_store,
+                            on_stored=queue_detection if detection_client is not None else None,
+                        )))
                     except Exception as e:
                         logger.error(f"Failed to download image for message {message.id}: {e}")
                 messages_data.append(msg_dict)
+                MESSAGES_SCRAPED.labels(channel=channel_name).inc()
+            await asyncio.gather(*pending_photos)
+            image_store.save_index()
             # Save messages as JSON
             with open(out_path, 'w', encoding='utf-8') as f:
                 json.dump(messages_data, f, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
+            catalog.register(date_str, channel_name, out_path, messages=len(messages_data))
             logger.info(f"Saved {len(messages_data)} messages from {channel_name} to {out_path}")
             update_scrape_log(channel_name, date_str, status='success')
+            await asyncio.gather(*pending_detections)
             return {
                 'messages': messages_data,
-                'images': downloaded_images
+                'images': list(dict.fromkeys(m['image_hash'] for m in messages_data if m.get('image_hash')))
             }
         except Exception as e:
             attempt += 1
-            wait_time = 2 ** attempt
+            # The retry scrapes the same photos and queues their detections again
+            for task in pending_photos + pending_detections:
+                task.cancel()
+            wait_time = e.seconds if isinstance(e, FloodWaitError) else 2 ** attempt
+            if isinstance(e, (ChannelInvalidError, ChannelPrivateError)):
+                # The cached access hash may be stale; resolve the username again on retry
+                entity_cache.forget(channel_name)
             logger.error(f"Error scraping {channel_url} (attempt {attempt}/{max_retries}): {e}")
             if attempt < max_retries:
                 logger.info(f"Retrying in {wait_time} seconds...")
@@ -125,8 +327,30 @@ async def scrape_channel(client, channel_url, date_str=None, limit=100, max_retr
                 update_scrape_log(channel_name, date_str, status='error', error=str(e))
                 return None
 
-async def scrape_telegram_channels(channels, date_str=None, limit=100):
+async def scrape_with_client(client, channels, date_str=None, limit=100, restrict_to_date=False,
+                             image_store=None, catalog=None, entity_cache=None, detection_client=None):
+    """Scrape channels with a client that is already connected and authorised."""
     results = {}
+    for channel_url in channels:
+        logger.info(f"Scraping channel: {channel_url}")
+        channel_name = channel_url.split('/')[-1]
+        with span('scrape_channel', channel=channel_name):
+            result = await scrape_channel(
+                client, channel_url, date_str=date_str, limit=limit, restrict_to_date=restrict_to_date,
+                image_store=image_store, detection_client=detection_client, catalog=catalog,
+                entity_cache=entity_cache,
+            )
+        if result:
+            results[channel_name] = result
+    return results
+
+async def scrape_telegram_channels(channels, date_str=None, limit=100, restrict_to_date=False):
+    from telethon import TelegramClient
+    from telethon.errors import SessionPasswordNeededError
+
+    results = {}
+    image_store = ImageStore()
+    catalog = PartitionCatalog(RAW_DATA_DIR)
     async with TelegramClient(SESSION_NAME, API_ID, API_HASH) as client:
         try:
             await client.start()
@@ -134,21 +358,51 @@ async def scrape_telegram_channels(channels, date_str=None, limit=100):
             logger.error("2FA is enabled. Please disable it or handle password input.")
             return results
         
-        for channel_url in channels:
-            logger.info(f"Scraping channel: {channel_url}")
-            channel_name = channel_url.split('/')[-1]
-            result = await scrape_channel(client, channel_url, date_str=date_str, limit=limit)
-            if result:
-                results[channel_name] = result
+        detection_client = detection_service_client()
+        results = await scrape_with_client(
+            client, channels, date_str=date_str, limit=limit, restrict_to_date=restrict_to_date,
+            image_store=image_store, catalog=catalog, entity_cache=EntityCache(),
+            detection_client=detection_client,
+        )
     
+    if detection_client is not None:
+        await detection_client.aclose()
+    image_store.close()
     return results
 
+def summarize(results):
+    """{channel: {'messages': n, 'images': n}} for scrape results."""
+    return {
+        channel_name: {'messages': len(result['messages']), 'images': len(result['images'])}
+        for channel_name, result in results.items()
+    }
+
+async def scrape_via_service(channels, date_str=None, limit=100, restrict_to_date=False):
+    """Hand the scrape to the scraper service's connected client; returns summarize() output."""
+    import httpx
+
+    transport = httpx.AsyncHTTPTransport(uds=SCRAPER_SERVICE_SOCKET) if SCRAPER_SERVICE_SOCKET else None
+    async with httpx.AsyncClient(
+        base_url=SCRAPER_SERVICE_URL or 'http://scrape-service', transport=transport, timeout=SCRAPER_SERVICE_TIMEOUT
+    ) as client:
+        response = await client.post('/api/scrape', json={
+            'channels': list(channels),
+            'date': date_str,
+            'limit': limit,
+            'restrict_to_date': restrict_to_date,
+        })
+        response.raise_for_status()
+        return response.json()
+
+async def scrape_summary(channels, date_str=None, limit=100, restrict_to_date=False):
+    """Scrape through the scraper service when one is configured, else with a client of our own."""
+    if SCRAPER_SERVICE_URL or SCRAPER_SERVICE_SOCKET:
+        return await scrape_via_service(channels, date_str=date_str, limit=limit, restrict_to_date=restrict_to_date)
+    return summarize(await scrape_telegram_channels(
+        channels, date_str=date_str, limit=limit, restrict_to_date=restrict_to_date
+    ))
+
 # CLI entrypoint
 if __name__ == '__main__':
-    import asyncio
-    CHANNELS = [
-        'https://t.me/lobelia4cosmetics',
-        'https://t.me/tikvahpharma',
-        # Add more channels as needed
-    ]
-    asyncio.run(scrape_telegram_channels(CHANNELS)) 
\ No newline at end of file
+    asyncio.run(scrape_telegram_channels(CHANNELS))
+    export_metrics('scrape') 
\ No newline at end of file
@@ -0,0 +1,281 @@
+"""Near-real-time ingestion: new Telegram messages straight into raw and the marts.
+
+The batch pipeline only publishes a channel-day after it is scraped, loaded
+and transformed, so the API lags by up to a day. This process subscribes to
+Telethon's NewMessage events instead and writes messages to
+raw.telegram_messages in micro-batches (every STREAM_FLUSH_SIZE messages or
+STREAM_FLUSH_SECONDS). Every STREAM_MART_REFRESH_SECONDS the message marts
+are rebuilt incrementally if anything new arrived.
+
+Consumers are told about new data through Postgres LISTEN/NOTIFY on the
+channels in src/notifications.py: pharma_new_messages for every written
+batch and pharma_marts_refreshed after each mart build.
+
+Streamed rows use the message's UTC day as date_scraped, so a later batch
+load of the same channel-day replaces them.
+
+Usage:
+    python -m src.stream_ingest
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+
+from loguru import logger
+
+from src.data_quality import quarantine, record_batch_stats, validate_messages
+from src.db import insert_values, transaction
+from src.load_raw_to_postgres import create_raw_schema
+from src.metrics import (
+    DB_WRITE_SECONDS,
+    ROWS_LOADED,
+    STREAM_BATCH_ROWS,
+    STREAM_LATENCY_SECONDS,
+    timed,
+)
+from src.message_dedup import assign_clusters
+from src.notifications import MARTS_REFRESHED_CHANNEL, NEW_MESSAGES_CHANNEL, notify, notify_rows
+from src.product_tagger import tag_message
+from src.trends import record_mentions
+
+FLUSH_SIZE = int(os.getenv('STREAM_FLUSH_SIZE', '200'))
+FLUSH_SECONDS = float(os.getenv('STREAM_FLUSH_SECONDS', '2'))
+MART_REFRESH_SECONDS = float(os.getenv('STREAM_MART_REFRESH_SECONDS', '60'))
+
+def write_messages(rows):
+    """Insert (channel_name, date_scraped, message_data) rows and announce them on pharma_new_messages.
+
+    Rows failing the data-quality checks are quarantined instead.
+    """
+    from src.scrape_telegram import DateTimeEncoder
+
+    payloads = [json.dumps(message, cls=DateTimeEncoder) for _, _, message in rows]
+    report = validate_messages([message for _, _, message in rows], payloads,
+                               channels=[channel_name for channel_name, _, _ in rows])
+    with transaction() as cur, timed(DB_WRITE_SECONDS, stage='stream'):
+        quarantine(cur, [
+            (*rows[index][:2], payloads[index], reasons) for index, reasons in report.rejected.items()
+        ])
+        record_batch_stats(cur, 'stream', report.stats)
+        rows = [rows[index] for index in report.valid]
+        payloads = [payloads[index] for index in report.valid]
+        texts = [message.get('message') for _, _, message in rows]
+        tags = [tag_message(message) for _, _, message in rows]
+        cluster_ids = assign_clusters(cur, texts)
+        inserted = insert_values(cur, """
+            INSERT INTO raw.telegram_messages
+            (channel_name, date_scraped, message_data, product_tags, duplicate_cluster_id)
+            VALUES %s
+            RETURNING id, channel_name
+        """, [
+            (channel_name, date_scraped, payload, message_tags, cluster_id)
+            for (channel_name, date_scraped, _), payload, message_tags, cluster_id
+            in zip(rows, payloads, tags, cluster_ids)
+        ], template='(%s, %s, %s, %s::text[], %s)', fetch=True)
+        partitions = {}
+        for (channel_name, date_scraped, _), text, message_tags in zip(rows, texts, tags):
+            partitions.setdefault((channel_name, date_scraped), []).append((text, message_tags))
+        for (channel_name, date_scraped), counted in partitions.items():
+            record_mentions(cur, channel_name, date_scraped, counted)
+        ids_by_channel = {}
+        for row_id, channel_name in inserted:
+            ids_by_channel.setdefault(channel_name, []).append(row_id)
+        notify_rows(cur, NEW_MESSAGES_CHANNEL, ids_by_channel)
+    return ids_by_channel
+
+def refresh_marts(new_messages):
+    """Incrementally rebuild the message marts and tell listeners they changed."""
+    from src.dbt_transform import DETECTION_MODELS, build_models
+
+    build_models(exclude=DETECTION_MODELS, state_name='stream')
+    with transaction() as cur:
+        notify(cur, MARTS_REFRESHED_CHANNEL, {
+            'new_messages': new_messages,
+            'refreshed_at': datetime.now(timezone.utc).isoformat(),
+        })
+
+class MessageBuffer:
+    """Collects streamed messages and writes them to raw in micro-batches.
+
+    A batch is written as soon as it holds flush_size messages, and run()
+    writes whatever is pending every flush_seconds. A failed write keeps its
+    rows for the next attempt.
+    """
+
+    def __init__(self, write_fn=write_messages, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.write_fn = write_fn
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.posted = []
+        # Post times of messages written to raw but not yet built into the marts
+        self.unbuilt = []
+        self._lock = asyncio.Lock()
+
+    async def add(self, channel_name, message, posted_at):
+        date_scraped = posted_at.astimezone(timezone.utc).strftime('%Y-%m-%d')
+        self.rows.append((channel_name, date_scraped, message))
+        self.posted.append(posted_at)
+        if len(self.rows) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        """Write the pending rows; returns how many were written."""
+        async with self._lock:
+            if not self.rows:
+                return 0
+            rows, posted = self.rows, self.posted
+            self.rows, self.posted = [], []
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.write_fn, rows)
+            except Exception as e:
+                logger.error(f"Writing {len(rows)} streamed messages failed, will retry: {e}")
+                self.rows, self.posted = rows + self.rows, posted + self.posted
+                return 0
+
+            now = datetime.now(timezone.utc)
+            for posted_at in posted:
+                STREAM_LATENCY_SECONDS.labels(layer='raw').observe((now - posted_at).total_seconds())
+            STREAM_BATCH_ROWS.observe(len(rows))
+            for channel_name, _, _ in rows:
+                ROWS_LOADED.labels(channel=channel_name).inc()
+            self.unbuilt.extend(posted)
+            logger.info(f"Streamed {len(rows)} messages to raw.telegram_messages")
+            return len(rows)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+class MartRefresher:
+    """Rebuilds the marts on a fixed cadence whenever the buffer wrote new messages."""
+
+    def __init__(self, buffer, refresh_fn=refresh_marts, interval=MART_REFRESH_SECONDS):
+        self.buffer = buffer
+        self.refresh_fn = refresh_fn
+        self.interval = interval
+
+    async def refresh(self):
+        """Build the marts if there is anything new; returns whether a build ran."""
+        posted, self.buffer.unbuilt = self.buffer.unbuilt, []
+        if not posted:
+            return False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.refresh_fn, len(posted))
+        except Exception as e:
+            logger.error(f"Mart refresh failed, will retry: {e}")
+            self.buffer.unbuilt = posted + self.buffer.unbuilt
+            return False
+
+        now = datetime.now(timezone.utc)
+        for posted_at in posted:
+            STREAM_LATENCY_SECONDS.labels(layer='marts').observe((now - posted_at).total_seconds())
+        logger.info(f"Refreshed marts with {len(posted)} new messages")
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+def new_message_handler(client, channel_names, image_store, buffer, detection_client=None, detections=None):
+    """NewMessage handler: stores the message's photo, queues its detection and buffers the message.
+
+    channel_names maps channel ids to names; other chats are ignored. The
+    photo is stored through scrape_telegram's store_photo/attach_photo, as in
+    batch scraping, before the message is buffered, so written rows always
+    carry their image hash. Detection tasks are added to detections.
+    """
+    from telethon.tl.types import MessageMediaPhoto
+
+    from src.scrape_telegram import attach_photo, clean_message_data, request_detection, store_photo
+
+    if detections is None:
+        detections = set()
+
+    async def on_new_message(event):
+        message = event.message
+        channel_name = channel_names.get(getattr(message.peer_id, 'channel_id', None))
+        if channel_name is None:
+            return
+        msg_dict = clean_message_data(message.to_dict())
+
+        def queue_detection(msg_dict):
+            task = asyncio.create_task(request_detection(
+                detection_client, msg_dict['downloaded_image'], msg_dict['image_hash'], message.id,
+                channel_name, message.date.astimezone(timezone.utc).strftime('%Y-%m-%d'),
+            ))
+            detections.add(task)
+            task.add_done_callback(detections.discard)
+
+        if message.media and isinstance(message.media, MessageMediaPhoto):
+            try:
+                stored = await store_photo(client, message, image_store, channel_name)
+                await attach_photo(stored, msg_dict, image_store,
+                                   on_stored=queue_detection if detection_client is not None else None)
+            except Exception as e:
+                logger.error(f"Failed to download image for message {message.id}: {e}")
+        await buffer.add(channel_name, msg_dict, message.date)
+
+    return on_new_message
+
+async def resolve_channels(client, channels, entity_cache):
+    """Input peers of the channel URLs and a {channel id: name} map, resolved through the entity cache."""
+    from src.scrape_telegram import resolve_channel
+
+    peers = []
+    channel_names = {}
+    for channel_url in channels:
+        peer = await resolve_channel(client, channel_url, entity_cache)
+        peers.append(peer)
+        channel_names[peer.channel_id] = channel_url.split('/')[-1]
+    return peers, channel_names
+
+async def stream_channels(channels):
+    """Stream new messages from channels until the client disconnects."""
+    from telethon import TelegramClient, events
+
+    from src.image_store import ImageStore
+    from src.scrape_telegram import API_HASH, API_ID, SESSION_NAME, EntityCache, detection_service_client
+
+    create_raw_schema()
+    image_store = ImageStore()
+
+    def write_batch(rows):
+        # Persist the photo index before rows referring to new images are visible
+        image_store.save_index()
+        return write_messages(rows)
+
+    buffer = MessageBuffer(write_fn=write_batch)
+    refresher = MartRefresher(buffer)
+    detections = set()
+
+    async with TelegramClient(SESSION_NAME, API_ID, API_HASH) as client:
+        await client.start()
+        peers, channel_names = await resolve_channels(client, channels, EntityCache())
+        detection_client = detection_service_client()
+
+        client.add_event_handler(
+            new_message_handler(client, channel_names, image_store, buffer, detection_client, detections),
+            events.NewMessage(chats=peers),
+        )
+
+        logger.info(f"Streaming new messages from {', '.join(channel_names.values())}")
+        workers = [asyncio.create_task(buffer.run()), asyncio.create_task(refresher.run())]
+        try:
+            await client.run_until_disconnected()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await buffer.flush()
+            await asyncio.gather(*detections, return_exceptions=True)
+            if detection_client is not None:
+                await detection_client.aclose()
+            image_store.close()
+
+if __name__ == '__main__':
+    from src.scrape_telegram import CHANNELS
+
+    asyncio.run(stream_channels(CHANNELS))
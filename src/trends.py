@@ -0,0 +1,206 @@
+"""Mention counters kept up to date during ingestion, for trending reports.
+
+Two kinds of counter per channel and day:
+
+- raw.product_mention_counts: exact counts per tagged product. The product
+  dictionary is small, so these stay small too.
+- raw.term_sketches: a Count-Min Sketch of every word in the day's messages,
+  plus that day's most frequent words as trend candidates. A sketch is a
+  fixed SKETCH_DEPTH x SKETCH_WIDTH array however many distinct words
+  appear, and sketches of several channel-days merge by addition.
+
+The batch loader replaces a channel-day's counters when it reloads the
+partition; the streaming ingester adds to them. trending() compares the
+last window_days with the window before it, reading only those days'
+counters rather than scanning fct_messages.
+"""
+import hashlib
+import math
+from collections import Counter
+from datetime import date, timedelta
+from functools import lru_cache
+
+from src.product_tagger import normalize
+
+SKETCH_WIDTH = 4096
+SKETCH_DEPTH = 4
+# Most frequent words kept per channel-day as candidates for trending terms
+HEAVY_HITTERS = 100
+MIN_TERM_LENGTH = 3
+
+@lru_cache(maxsize=1 << 18)
+def sketch_columns(term, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+    digest = hashlib.blake2b(term.encode('utf-8'), digest_size=4 * depth).digest()
+    return tuple(int.from_bytes(digest[4 * row:4 * row + 4], 'little') % width for row in range(depth))
+
+class CountMinSketch:
+    """Approximate counts in fixed memory; estimates never undercount."""
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, counts=None):
+        import numpy as np
+
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else np.zeros((depth, width), dtype=np.int64)
+
+    def add(self, term_counts):
+        """Add a {term: count} mapping."""
+        import numpy as np
+
+        if not term_counts:
+            return
+        columns = np.array([sketch_columns(term, self.width, self.depth) for term in term_counts])
+        values = np.fromiter(term_counts.values(), dtype=np.int64, count=len(term_counts))
+        for row in range(self.depth):
+            np.add.at(self.counts[row], columns[:, row], values)
+
+    def estimate(self, term):
+        columns = sketch_columns(term, self.width, self.depth)
+        return int(min(self.counts[row, column] for row, column in enumerate(columns)))
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def to_bytes(self):
+        return self.counts.astype('<i4').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        import numpy as np
+
+        counts = np.frombuffer(bytes(data), dtype='<i4').reshape(depth, width).astype(np.int64)
+        return cls(width, depth, counts)
+
+def terms(text):
+    """Words worth trending: long enough and not numbers, prices or phone numbers."""
+    return [
+        word for word in normalize(text or '').split()
+        if len(word) >= MIN_TERM_LENGTH and not any(char.isdigit() for char in word)
+    ]
+
+def create_trend_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.product_mention_counts (
+            product_name VARCHAR(100),
+            channel_name VARCHAR(255),
+            day DATE,
+            mentions INTEGER NOT NULL,
+            PRIMARY KEY (day, product_name, channel_name)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.term_sketches (
+            channel_name VARCHAR(255),
+            day DATE,
+            sketch BYTEA NOT NULL,
+            heavy_hitters JSONB NOT NULL,
+            PRIMARY KEY (day, channel_name)
+        );
+    """)
+
+def record_mentions(cur, channel_name, day, messages, replace=False):
+    """Count a batch of (text, product_tags) messages into the channel-day's counters.
+
+    With replace=True the batch is the channel-day's complete set of
+    messages (a partition reload); otherwise it is added to what is there.
+    Runs in the caller's transaction.
+    """
+    from psycopg2.extras import Json
+
+    from src.db import insert_values
+
+    products = Counter(tag for _, tags in messages for tag in tags or ())
+    words = Counter(word for text, _ in messages for word in terms(text))
+
+    if replace:
+        cur.execute("DELETE FROM raw.product_mention_counts WHERE channel_name = %s AND day = %s",
+                    (channel_name, day))
+        cur.execute("DELETE FROM raw.term_sketches WHERE channel_name = %s AND day = %s",
+                    (channel_name, day))
+    if products:
+        insert_values(cur, """
+            INSERT INTO raw.product_mention_counts (product_name, channel_name, day, mentions)
+            VALUES %s
+            ON CONFLICT (day, product_name, channel_name)
+            DO UPDATE SET mentions = raw.product_mention_counts.mentions + EXCLUDED.mentions
+        """, [(product, channel_name, day, count) for product, count in products.items()])
+    if not words:
+        return
+
+    sketch = CountMinSketch()
+    heavy_hitters = Counter()
+    cur.execute("""
+        SELECT sketch, heavy_hitters FROM raw.term_sketches
+        WHERE channel_name = %s AND day = %s
+        FOR UPDATE
+    """, (channel_name, day))
+    row = cur.fetchone()
+    if row:
+        sketch = CountMinSketch.from_bytes(row[0])
+        heavy_hitters.update(row[1])
+    sketch.add(words)
+    heavy_hitters.update(words)
+    top = dict(heavy_hitters.most_common(HEAVY_HITTERS))
+    cur.execute("""
+        INSERT INTO raw.term_sketches (channel_name, day, sketch, heavy_hitters)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (day, channel_name)
+        DO UPDATE SET sketch = EXCLUDED.sketch, heavy_hitters = EXCLUDED.heavy_hitters
+    """, (channel_name, day, sketch.to_bytes(), Json(top)))
+
+def growth_score(current, previous):
+    """Increase over the previous window in Poisson standard deviations, so small counts don't dominate."""
+    return (current - previous) / math.sqrt(previous + 1)
+
+def rank(counts, limit):
+    """Top `limit` of {name: (current, previous)} by growth score."""
+    ranked = [
+        {'name': name, 'current_mentions': current, 'previous_mentions': previous,
+         'growth': round(growth_score(current, previous), 3)}
+        for name, (current, previous) in counts.items()
+        if current > 0
+    ]
+    ranked.sort(key=lambda item: (item['growth'], item['current_mentions']), reverse=True)
+    return ranked[:limit]
+
+def trending(cur, window_days=7, as_of=None, channel_name=None, limit=10):
+    """Products and terms growing fastest in the window ending as_of vs the window before it."""
+    as_of = as_of or date.today()
+    current_start = as_of - timedelta(days=window_days - 1)
+    previous_start = current_start - timedelta(days=window_days)
+    channel_filter = "AND channel_name = %s" if channel_name else ""
+    channel_params = (channel_name,) if channel_name else ()
+
+    cur.execute(f"""
+        SELECT product_name,
+               SUM(mentions) FILTER (WHERE day >= %s) as current_mentions,
+               SUM(mentions) FILTER (WHERE day < %s) as previous_mentions
+        FROM raw.product_mention_counts
+        WHERE day BETWEEN %s AND %s {channel_filter}
+        GROUP BY product_name
+    """, (current_start, current_start, previous_start, as_of, *channel_params))
+    products = {
+        product: (int(current or 0), int(previous or 0))
+        for product, current, previous in cur.fetchall()
+    }
+
+    cur.execute(f"""
+        SELECT day >= %s as is_current, sketch, heavy_hitters
+        FROM raw.term_sketches
+        WHERE day BETWEEN %s AND %s {channel_filter}
+    """, (current_start, previous_start, as_of, *channel_params))
+    windows = {True: CountMinSketch(), False: CountMinSketch()}
+    words = set()
+    for is_current, sketch, heavy_hitters in cur.fetchall():
+        windows[is_current].merge(CountMinSketch.from_bytes(sketch))
+        if is_current:
+            words.update(heavy_hitters)
+    term_counts = {word: (windows[True].estimate(word), windows[False].estimate(word)) for word in words}
+
+    return {
+        'window_days': window_days,
+        'as_of': as_of.isoformat(),
+        'products': rank(products, limit),
+        'terms': rank(term_counts, limit),
+    }
@@ -1,131 +1,383 @@
 import os
-import glob
-import psycopg2
+import time
+from psycopg2.extras import Json
 from loguru import logger
-from ultralytics import YOLO
-from dotenv import load_dotenv
 
-load_dotenv()
+from src.db import connection, insert_values, transaction
+from src.detection_arrays import (
+    DETECTION_STORAGE,
+    DETECTION_TABLES,
+    check_storage,
+    create_detection_array_tables,
+    insert_detection_arrays,
+)
+from src.image_store import detector_input, existing_image_path, file_hash, scale_detections
+from src.lake_catalog import PartitionCatalog, read_messages
+from src.metrics import (
+    DB_WRITE_SECONDS,
+    IMAGES_DEDUPLICATED,
+    IMAGES_PROCESSED,
+    INFERENCE_SECONDS,
+    export_metrics,
+    span,
+    timed,
+)
+from src.notifications import NEW_DETECTIONS_CHANNEL, notify_rows
 
-DB_CONFIG = {
-    'host': 'localhost',
-    'port': 5433,
-    'database': os.getenv('POSTGRES_DB', 'pharmadb'),
-    'user': os.getenv('POSTGRES_USER', 'pharmauser'),
-    'password': os.getenv('POSTGRES_PASSWORD', 'pharmapass')
-}
+RAW_DATA_DIR = 'data/raw/telegram_messages'
+# New detections are committed every this many YOLO inferences
+CHECKPOINT_IMAGES = int(os.getenv('ENRICH_CHECKPOINT_IMAGES', '50'))
 
 def create_image_detections_table():
     """Create raw table for storing YOLO detection results."""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    # Create raw schema if it doesn't exist
-    cur.execute("CREATE SCHEMA IF NOT EXISTS raw")
-    
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS raw.image_detections (
-            id SERIAL PRIMARY KEY,
-            message_id VARCHAR(50),
-            image_path VARCHAR(500),
-            detected_object_class VARCHAR(100),
-            confidence_score DECIMAL(5,4),
-            bbox_x1 DECIMAL(10,4),
-            bbox_y1 DECIMAL(10,4),
-            bbox_x2 DECIMAL(10,4),
-            bbox_y2 DECIMAL(10,4),
-            channel_name VARCHAR(100),
-            message_date DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
+    with transaction() as cur:
+        # Create raw schema if it doesn't exist
+        cur.execute("CREATE SCHEMA IF NOT EXISTS raw")
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS raw.image_detections (
+                id SERIAL PRIMARY KEY,
+                message_id VARCHAR(50),
+                image_path VARCHAR(500),
+                detected_object_class VARCHAR(100),
+                confidence_score DECIMAL(5,4),
+                bbox_x1 DECIMAL(10,4),
+                bbox_y1 DECIMAL(10,4),
+                bbox_x2 DECIMAL(10,4),
+                bbox_y2 DECIMAL(10,4),
+                channel_name VARCHAR(100),
+                message_date DATE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("ALTER TABLE raw.image_detections ADD COLUMN IF NOT EXISTS image_hash VARCHAR(64)")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS image_detections_channel_date_idx
+            ON raw.image_detections (channel_name, message_date)
+        """)
+        
+        create_detection_array_tables(cur)
+        
+        # One row per unique image content: detections are computed once and
+        # copied to every message that references the same image
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS raw.processed_images (
+                image_hash VARCHAR(64) PRIMARY KEY,
+                image_path VARCHAR(500),
+                detections JSONB,
+                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        
+        # Channel-days whose detections are complete, and the version of the file they came from
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS raw.enrichment_checkpoints (
+                channel_name VARCHAR(100),
+                message_date DATE,
+                source_fingerprint VARCHAR(64) NOT NULL,
+                images INTEGER NOT NULL,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (channel_name, message_date)
+            );
+        """)
     
-    conn.commit()
-    cur.close()
-    conn.close()
     logger.info("Raw image detections table created successfully.")
 
-def get_message_id_from_image_path(image_path):
-    """Extract message ID from image path to link with fact table."""
-    # Path format: data/raw/telegram_messages/YYYY-MM-DD/channel_images/message_id.jpg
-    filename = os.path.basename(image_path)
-    message_id = filename.replace('.jpg', '')
-    return message_id
-
-def extract_channel_and_date_from_path(image_path):
-    """Extract channel name and date from image path."""
-    # Path format: data/raw/telegram_messages/YYYY-MM-DD/channel_images/message_id.jpg
-    parts = image_path.split(os.sep)
-    if len(parts) >= 4:
-        date_str = parts[-3]  # YYYY-MM-DD
-        channel_name = parts[-2].replace('_images', '')
-        return channel_name, date_str
-    return None, None
-
-def process_images_with_yolo():
-    """Process all scraped images with YOLO and store results in raw table."""
+_model = None
+
+def get_model():
+    """Load the YOLO model once per process and reuse it across runs."""
+    global _model
+    if _model is None:
+        # ultralytics pulls in torch, so only processes that run the model import it
+        from ultralytics import YOLO
+
+        _model = YOLO('yolov8n.pt')  # Use nano model for speed
+    return _model
+
+def image_refs(json_file):
+    """Return (message_id, image_path, image_hash) for each downloaded photo in a channel-day file."""
+    messages = read_messages(json_file)
+    refs = []
+    for message in messages:
+        image_path = message.get('downloaded_image')
+        # A tiered photo had no detections, which stay cached under its hash
+        if not image_path or existing_image_path(image_path) is None:
+            continue
+        # Files scraped before the content-addressed store carry no hash yet
+        image_hash = message.get('image_hash') or file_hash(image_path)
+        refs.append((str(message['id']), image_path, image_hash))
+    return refs
+
+def load_cached_detections(cur, image_hashes):
+    """Detections of images already processed in earlier runs, keyed by content hash."""
+    if not image_hashes:
+        return {}
+    cur.execute("""
+        SELECT image_hash, detections FROM raw.processed_images
+        WHERE image_hash = ANY(%s)
+    """, (list(image_hashes),))
+    return dict(cur.fetchall())
+
+def parse_result(model, result):
+    """Convert one ultralytics result into plain detection dicts, recording phase timings."""
+    # Ultralytics reports per-phase times in milliseconds
+    for phase, ms in result.speed.items():
+        INFERENCE_SECONDS.labels(phase=phase).observe(ms / 1000)
+    detections = []
+    boxes = result.boxes
+    if boxes is not None:
+        for box in boxes:
+            class_id = int(box.cls[0])
+            detections.append({
+                'class': model.names[class_id],
+                'confidence': float(box.conf[0]),
+                'bbox': box.xyxy[0].tolist(),  # [x1, y1, x2, y2]
+            })
+    return detections
+
+def detect(model, image_path):
+    """Run YOLO on one image and return its detections as plain dicts.
+
+    Reads the image's detector-sized copy when the store kept one; boxes
+    are mapped back to image_path's coordinates either way.
+    """
+    input_path, scale = detector_input(image_path)
+    with span('detect_image', image_path=image_path):
+        results = model(input_path, verbose=False)
+    detections = []
+    for result in results:
+        detections.extend(parse_result(model, result))
+    return scale_detections(detections, scale)
+
+def detect_batch(model, image_paths):
+    """Run YOLO on several images in one forward pass; returns one detection list per image."""
+    with span('detect_batch', batch_size=len(image_paths)):
+        results = model(list(image_paths), verbose=False)
+    return [parse_result(model, result) for result in results]
+
+def store_processed_image(cur, image_hash, image_path, detections):
+    """Remember an image's detections so identical images are never run through YOLO again."""
+    cur.execute("""
+        INSERT INTO raw.processed_images (image_hash, image_path, detections)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (image_hash) DO UPDATE SET detections = EXCLUDED.detections
+    """, (image_hash, image_path, Json(detections)))
+
+def insert_detections(cur, message_id, image_path, image_hash, detections, channel_name, message_date):
+    """Write one message's detections to raw.image_detections and return the new row ids."""
+    with timed(DB_WRITE_SECONDS, stage='enrich'):
+        rows = insert_values(cur, """
+            INSERT INTO raw.image_detections 
+            (message_id, image_path, image_hash, detected_object_class, confidence_score, 
+             bbox_x1, bbox_y1, bbox_x2, bbox_y2, channel_name, message_date)
+            VALUES %s
+            RETURNING id
+        """, [
+            (message_id, image_path, image_hash, detection['class'], detection['confidence'],
+             *detection['bbox'], channel_name, message_date)
+            for detection in detections
+        ], fetch=True)
+    return [row[0] for row in rows]
+
+def write_detections(cur, message_id, image_path, image_hash, detections, channel_name, message_date,
+                     storage=DETECTION_STORAGE):
+    """Write one message image's detections in the storage layout and return the new row ids."""
+    check_storage(storage)
+    if storage == 'compact':
+        with timed(DB_WRITE_SECONDS, stage='enrich'):
+            return insert_detection_arrays(cur, message_id, image_hash, detections, channel_name, message_date)
+    return insert_detections(cur, message_id, image_path, image_hash, detections, channel_name, message_date)
+
+def delete_detections(cur, channel_name, message_date, message_id=None):
+    """Remove a channel-day's (or one message's) detections from every layout."""
+    for table in DETECTION_TABLES.values():
+        if message_id is None:
+            cur.execute(f"DELETE FROM {table} WHERE channel_name = %s AND message_date = %s",
+                        (channel_name, message_date))
+        else:
+            cur.execute(f"DELETE FROM {table} WHERE channel_name = %s AND message_date = %s AND message_id = %s",
+                        (channel_name, message_date, message_id))
+
+class RunBudget:
+    """Stops an enrichment run after max_images YOLO inferences or max_seconds, whichever comes first."""
+
+    def __init__(self, max_images=None, max_seconds=None, clock=time.monotonic):
+        self.max_images = max_images
+        self.clock = clock
+        self.deadline = clock() + max_seconds if max_seconds else None
+        self.images = 0
+
+    def spend(self):
+        self.images += 1
+
+    @property
+    def exhausted(self):
+        if self.max_images is not None and self.images >= self.max_images:
+            return True
+        return self.deadline is not None and self.clock() >= self.deadline
+
+def load_checkpoints(cur):
+    cur.execute("SELECT channel_name, message_date::text, source_fingerprint FROM raw.enrichment_checkpoints")
+    return {(channel_name, message_date): fingerprint for channel_name, message_date, fingerprint in cur.fetchall()}
+
+def pending_partitions(partitions, checkpoints):
+    """Catalog partitions not yet enriched, or rescraped since their checkpoint."""
+    return [
+        partition for partition in partitions
+        if checkpoints.get((partition.channel, partition.date)) != partition.version
+    ]
+
+def save_checkpoint(cur, channel_name, message_date, fingerprint, images):
+    cur.execute("""
+        INSERT INTO raw.enrichment_checkpoints (channel_name, message_date, source_fingerprint, images)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (channel_name, message_date) DO UPDATE
+        SET source_fingerprint = EXCLUDED.source_fingerprint,
+            images = EXCLUDED.images,
+            completed_at = CURRENT_TIMESTAMP
+    """, (channel_name, message_date, fingerprint, images))
+
+def process_images_with_yolo(date_str=None, channels=None, data_dir=RAW_DATA_DIR,
+                             max_images=None, max_seconds=None, resume=True, storage=DETECTION_STORAGE):
+    """Process scraped images with YOLO and store results in raw table.
+
+    date_str and channels restrict the run to those lake partitions. Each
+    channel-day replaces its previous detections, so re-running a partition
+    is idempotent. YOLO runs once per unique image content; reposts reuse
+    the stored detections. Returns the number of images run through YOLO.
+
+    Progress is checkpointed at two levels. New detections are committed to
+    raw.processed_images every CHECKPOINT_IMAGES images, so a crash loses at
+    most one batch of inference. A channel-day's detections are written
+    together with its row in raw.enrichment_checkpoints, and with resume the
+    next run skips channel-days the lake catalog says were not rescraped
+    since then (compaction does not count). A channel-day with images YOLO
+    failed on is written but not checkpointed, so those images are retried.
+    max_images and max_seconds bound the run: it stops cleanly before the
+    next inference once either is spent, and a later run continues from there.
+    storage picks the layout detections are written in, see src/detection_arrays.py.
+    """
+    check_storage(storage)
     # First, ensure the table exists
     create_image_detections_table()
     
-    # Load pre-trained YOLO model
-    model = YOLO('yolov8n.pt')  # Use nano model for speed
-    
-    # Find all image directories
-    data_dir = 'data/raw/telegram_messages'
-    image_dirs = glob.glob(f'{data_dir}/**/*_images', recursive=True)
-    
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    total_processed = 0
+    model = get_model()
+    budget = RunBudget(max_images, max_seconds)
+    catalog = PartitionCatalog(data_dir)
     
-    for img_dir in image_dirs:
-        image_files = glob.glob(f'{img_dir}/*.jpg')
+    with connection() as conn, conn.cursor() as cur:
+        partitions = catalog.partitions(date_str=date_str, channels=channels)
+        pending = pending_partitions(partitions, load_checkpoints(cur)) if resume else partitions
+        if len(pending) < len(partitions):
+            logger.info(f"Skipping {len(partitions) - len(pending)} channel-days already enriched")
         
-        for image_path in image_files:
-            try:
-                # Run YOLO detection
-                results = model(image_path)
-                
-                # Extract metadata from path
-                message_id = get_message_id_from_image_path(image_path)
-                channel_name, date_str = extract_channel_and_date_from_path(image_path)
-                
-                # Process results
-                for result in results:
-                    boxes = result.boxes
-                    if boxes is not None:
-                        for box in boxes:
-                            # Get detection info
-                            class_id = int(box.cls[0])
-                            class_name = model.names[class_id]
-                            confidence = float(box.conf[0])
-                            bbox = box.xyxy[0].tolist()  # [x1, y1, x2, y2]
-                            
-                            # Insert detection result into raw table
-                            cur.execute("""
-                                INSERT INTO raw.image_detections 
-                                (message_id, image_path, detected_object_class, confidence_score, 
-                                 bbox_x1, bbox_y1, bbox_x2, bbox_y2, channel_name, message_date)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                ON CONFLICT DO NOTHING
-                            """, (message_id, image_path, class_name, confidence, 
-                                  bbox[0], bbox[1], bbox[2], bbox[3], channel_name, date_str))
-                
+        total_processed = 0
+        total_seen = 0
+        completed = 0
+        
+        for partition in pending:
+            if budget.exhausted:
+                break
+            channel_name, message_date = partition.channel, partition.date
+            refs = image_refs(partition.path)
+            cached = load_cached_detections(cur, {image_hash for _, _, image_hash in refs})
+            
+            # Run YOLO on the channel-day's new images, committing each batch as a checkpoint
+            uncached = {image_hash: image_path for _, image_path, image_hash in refs if image_hash not in cached}
+            failed = set()
+            since_checkpoint = 0
+            for image_hash, image_path in uncached.items():
+                if budget.exhausted:
+                    break
+                try:
+                    detections = detect(model, image_path)
+                except Exception as e:
+                    logger.error(f"Error processing {image_path}: {e}")
+                    failed.add(image_hash)
+                    continue
+                store_processed_image(cur, image_hash, image_path, detections)
+                cached[image_hash] = detections
+                budget.spend()
                 total_processed += 1
-                logger.info(f"Processed {image_path} image {total_processed}/{len(image_files)}")
-                
-            except Exception as e:
-                logger.error(f"Error processing {image_path}: {e}")
-                # Rollback the transaction on error to prevent "current transaction is aborted"
-                conn.rollback()
+                IMAGES_PROCESSED.labels(channel=channel_name).inc()
+                since_checkpoint += 1
+                if since_checkpoint >= CHECKPOINT_IMAGES:
+                    conn.commit()
+                    since_checkpoint = 0
+            
+            if any(image_hash not in cached and image_hash not in failed for image_hash in uncached):
+                conn.commit()
+                logger.info(f"Budget spent partway through {channel_name} on {message_date}; a later run resumes it")
+                break
+            
+            # Replace the channel-day's detections and mark it done in one transaction
+            delete_detections(cur, channel_name, message_date)
+            
+            inserted_ids = []
+            written = 0
+            for message_id, image_path, image_hash in refs:
+                detections = cached.get(image_hash)
+                if detections is None:
+                    continue
+                cur.execute("SAVEPOINT image")
+                try:
+                    ids = write_detections(cur, message_id, image_path, image_hash, detections, channel_name,
+                                           message_date, storage)
+                    cur.execute("RELEASE SAVEPOINT image")
+                    inserted_ids.extend(ids)
+                    written += 1
+                except Exception as e:
+                    logger.error(f"Error storing detections for {image_path}: {e}")
+                    # Undo only this image so the partition's other rows survive
+                    cur.execute("ROLLBACK TO SAVEPOINT image")
+            # References beyond the first of each newly detected image reused stored detections
+            IMAGES_DEDUPLICATED.labels(channel=channel_name).inc(max(written - (len(uncached) - len(failed)), 0))
+            total_seen += written
+            
+            # Without a checkpoint the next run comes back for the images YOLO failed on
+            if not failed:
+                save_checkpoint(cur, channel_name, message_date, partition.version, len(refs))
+            notify_rows(cur, NEW_DETECTIONS_CHANNEL, {channel_name: inserted_ids}, storage=storage)
+            with timed(DB_WRITE_SECONDS, stage='enrich'):
+                conn.commit()
+            completed += 1
+            if failed:
+                logger.warning(
+                    f"{len(failed)} images of {channel_name} on {message_date} failed; "
+                    f"the channel-day stays pending for the next run"
+                )
                 continue
+            catalog.mark_enriched(message_date, channel_name)
+            logger.info(
+                f"Enriched {channel_name} on {message_date}: {len(refs)} images, "
+                f"{completed}/{len(pending)} channel-days"
+            )
     
-    conn.commit()
-    cur.close()
-    conn.close()
-    logger.info(f"YOLO processing completed. Total images processed: {total_processed}")
+    if completed < len(pending):
+        logger.info(f"Stopped with {len(pending) - completed} channel-days left for the next run")
+    logger.info(
+        f"YOLO processing completed. {total_processed} unique images run through YOLO, "
+        f"{total_seen} image references written from {completed} channel-days."
+    )
+    return total_processed
 
 if __name__ == '__main__':
-    create_image_detections_table()
-    process_images_with_yolo() 
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run YOLO over downloaded images, resuming from the last checkpoint.")
+    parser.add_argument('--date', help="only this date partition (YYYY-MM-DD)")
+    parser.add_argument('--channel', action='append', dest='channels', help="only this channel (repeatable)")
+    parser.add_argument('--max-images', type=int, help="stop after this many YOLO inferences")
+    parser.add_argument('--max-seconds', type=float, help="stop before the next inference after this many seconds")
+    parser.add_argument('--restart', action='store_true', help="ignore checkpoints and re-enrich every channel-day")
+    args = parser.parse_args()
+
+    process_images_with_yolo(
+        date_str=args.date,
+        channels=args.channels,
+        max_images=args.max_images,
+        max_seconds=args.max_seconds,
+        resume=not args.restart,
+    )
+    export_metrics('enrich')
@@ -4,12 +4,13 @@ Test script to verify the fixed pipeline components
 """
 
 import requests
-import psycopg2
 import os
 from dotenv import load_dotenv
 from psycopg2.extras import RealDictCursor
 import time
 
+from src.db import connect
+
 # Load environment variables
 load_dotenv()
 
@@ -73,13 +74,7 @@ def test_fixed_queries():
     print("\n📊 Testing fixed database queries...")
     
     # Connect to database
-    conn = psycopg2.connect(
-        host="localhost",
-        port=5433,
-        database=os.getenv('POSTGRES_DB'),
-        user=os.getenv('POSTGRES_USER'),
-        password=os.getenv('POSTGRES_PASSWORD')
-    )
+    conn = connect()
     
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         try:
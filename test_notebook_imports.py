@@ -62,16 +62,9 @@ def test_database_connection():
     print("\n🔍 Testing database connection...")
     
     try:
-        import psycopg2
-        import os
+        from src.db import connect
         
-        conn = psycopg2.connect(
-            host="localhost",
-            port=5433,
-            database=os.getenv('POSTGRES_DB'),
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD')
-        )
+        conn = connect()
         print("  ✅ Database connection successful")
         conn.close()
         return True
@@ -85,17 +78,10 @@ def test_fixed_queries():
     print("\n🔍 Testing fixed SQL queries...")
     
     try:
-        import psycopg2
-        import os
         from psycopg2.extras import RealDictCursor
+        from src.db import connect
         
-        conn = psycopg2.connect(
-            host="localhost",
-            port=5433,
-            database=os.getenv('POSTGRES_DB'),
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD')
-        )
+        conn = connect()
         
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             # Test channel activity query
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from decimal import Decimal
+
+from fastapi.testclient import TestClient
+
+import src.api.main as api
+from src.api.fast_json import dumps_rows
+
+COLUMNS = ('date', 'message_count', 'image_count', 'avg_message_length')
+ROWS = [
+    ('2024-01-02', 12, 3, Decimal('84.5000000000000000')),
+    ('2024-01-01', 7, 0, Decimal('120.1428571428571429')),
+]
+
+
+class FakeCursor:
+    description = [(name,) for name in COLUMNS]
+
+    def __init__(self, as_dicts):
+        self.as_dicts = as_dicts
+
+    def execute(self, query, params):
+        pass
+
+    def fetchall(self):
+        if self.as_dicts:
+            return [dict(zip(COLUMNS, row)) for row in ROWS]
+        return list(ROWS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeConnection:
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(as_dicts=cursor_factory is not None)
+
+
+@contextmanager
+def fake_read_connection(timeout=None, replica=True):
+    yield FakeConnection()
+
+
+def get_activity(monkeypatch, fast):
+    monkeypatch.setattr(api, 'FAST_JSON', fast)
+    monkeypatch.setattr(api, 'read_connection', fake_read_connection)
+    response = TestClient(api.app).get('/api/channels/chan_a/activity')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/json'
+    return response.json()
+
+
+def test_fast_json_matches_the_response_models(monkeypatch):
+    assert get_activity(monkeypatch, fast=True) == get_activity(monkeypatch, fast=False)
+
+
+def test_dumps_rows_converts_decimals_to_floats():
+    assert dumps_rows(['name', 'score'], [('x', Decimal('0.5'))]) == b'[{"name":"x","score":0.5}]'
@@ -0,0 +1,172 @@
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import pytest
+from fastapi.testclient import TestClient
+
+import src.api.main as api
+import src.db as db
+from src.api.main import EndpointLimit, parse_endpoint_limits
+from src.db import PoolTimeout
+
+
+class SlowCursor:
+    description = [('message_id',)]
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query, params):
+        self.statements.append(query % params if params else query)
+        if 'fct_messages' in query:
+            raise psycopg2.errors.QueryCanceled("canceling statement due to statement timeout")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class Connection:
+    def __init__(self, cursor):
+        self.closed = 0
+        self._cursor = cursor
+
+    def cursor(self, cursor_factory=None):
+        return self._cursor
+
+
+class Pool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned = []
+
+    def getconn(self, timeout=None):
+        return self.conn
+
+    def putconn(self, conn):
+        self.returned.append(conn)
+
+
+class DeadCursor(SlowCursor):
+    def __init__(self):
+        super().__init__()
+        self.connection = None
+
+    def execute(self, query, params):
+        self.connection.closed = 2
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class RowsCursor(SlowCursor):
+    def execute(self, query, params):
+        self.statements.append(query)
+
+    def fetchall(self):
+        return [(1, 'chan_a', 'paracetamol 500mg', '2024-01-01', False)]
+
+
+def test_endpoint_limits_can_be_overridden():
+    limits = parse_endpoint_limits('search_messages=500,new_endpoint=100:2, top_products=:1')
+
+    assert limits['search_messages'] == EndpointLimit(500, api.ENDPOINT_LIMITS['search_messages'].max_concurrent)
+    assert limits['new_endpoint'] == EndpointLimit(100, 2)
+    assert limits['top_products'] == EndpointLimit(api.ENDPOINT_LIMITS['top_products'].statement_timeout_ms, 1)
+
+
+def test_saturated_pool_sheds_with_retry_after(monkeypatch):
+    @contextmanager
+    def saturated(timeout=None, replica=True):
+        raise PoolTimeout("No database connection free after 0.1s")
+        yield
+
+    monkeypatch.setattr(api, 'read_connection', saturated)
+    response = TestClient(api.app).get('/api/search/messages', params={'query': 'paracetamol'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == api.RETRY_AFTER_SECONDS
+
+
+def test_requests_over_the_concurrency_limit_are_shed():
+    slots = api.endpoint_slots('search_messages')
+    held = api.ENDPOINT_LIMITS['search_messages'].max_concurrent
+    for _ in range(held):
+        slots.acquire()
+    try:
+        response = TestClient(api.app).get('/api/search/messages', params={'query': 'paracetamol'})
+    finally:
+        for _ in range(held):
+            slots.release()
+
+    assert response.status_code == 503
+
+
+def test_statement_timeout_is_set_and_cancellation_returns_504(monkeypatch):
+    cursor = SlowCursor()
+
+    class Connection:
+        def cursor(self, cursor_factory=None):
+            return cursor
+
+    @contextmanager
+    def read_connection(timeout=None, replica=True):
+        yield Connection()
+
+    monkeypatch.setattr(api, 'read_connection', read_connection)
+    response = TestClient(api.app).get('/api/search/messages', params={'query': 'paracetamol'})
+
+    assert response.status_code == 504
+    timeout_ms = api.ENDPOINT_LIMITS['search_messages'].statement_timeout_ms
+    assert cursor.statements[0] == f"SET LOCAL statement_timeout = {timeout_ms}"
+
+
+def test_health_check_does_not_wait_out_a_saturated_pool(monkeypatch):
+    waits = []
+
+    class SaturatedPool:
+        def getconn(self, timeout=None):
+            waits.append(timeout)
+            raise PoolTimeout(f"No database connection free after {timeout}s")
+
+    monkeypatch.setattr(api, 'get_pool', lambda: SaturatedPool())
+    response = TestClient(api.app).get('/api/health')
+
+    assert response.json()['status'] == 'unhealthy'
+    assert waits == [api.POOL_WAIT_SECONDS]
+
+
+def test_dead_replica_connection_falls_back_to_the_primary(monkeypatch):
+    dead = DeadCursor()
+    replica = Pool(Connection(dead))
+    dead.connection = replica.conn
+    primary_cursor = RowsCursor()
+    primary_cursor.description = [(name,) for name in api.MessageSearch.model_fields]
+    primary = Pool(Connection(primary_cursor))
+    monkeypatch.setattr(api, 'FAST_JSON', True)
+    monkeypatch.setattr(db, '_replica_down_until', 0.0)
+    monkeypatch.setattr(db, 'get_replica_pool', lambda: replica)
+    monkeypatch.setattr(db, 'get_pool', lambda: primary)
+
+    response = TestClient(api.app).get('/api/search/messages', params={'query': 'paracetamol'})
+
+    assert response.status_code == 200
+    assert response.json()[0]['channel_name'] == 'chan_a'
+    assert replica.returned == [replica.conn] and primary.returned == [primary.conn]
+    assert db._replica_down_until > 0
+
+
+def test_non_database_errors_are_not_reported_as_database_errors(monkeypatch):
+    @contextmanager
+    def read_connection(timeout=None, replica=True):
+        yield Connection(RowsCursor())
+
+    def broken_serializer(cur, rows, model):
+        raise KeyError('message_text')
+
+    monkeypatch.setattr(api, 'read_connection', read_connection)
+    monkeypatch.setattr(api, 'serialize_rows', broken_serializer)
+
+    with pytest.raises(KeyError):
+        TestClient(api.app).get('/api/search/messages', params={'query': 'paracetamol'})
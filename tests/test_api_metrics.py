@@ -0,0 +1,13 @@
+from fastapi.testclient import TestClient
+
+from src.api.main import app
+
+
+def test_metrics_endpoint_reports_request_latency_by_route():
+    client = TestClient(app)
+    assert client.get('/').status_code == 200
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert 'pharma_api_request_seconds_count{endpoint="/",method="GET",status="200"}' in response.text
@@ -0,0 +1,106 @@
+import time
+from contextlib import contextmanager
+
+import psycopg2.errors
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import src.api.main as api
+import src.api.profiling as profiling
+from src.api.profiling import QueryProfilingMiddleware, RequestProfile, phase, record_query
+
+
+class ExplainCursor:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, query, params):
+        self.statements.append(query % params if params else query)
+
+    def fetchall(self):
+        return [('Result  (cost=0.00..0.01 rows=1 width=4)',)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def make_app(sample_rate, slow_request_ms=10_000, borrow=None, max_explains=1):
+    app = FastAPI()
+    app.add_middleware(
+        QueryProfilingMiddleware, borrow=borrow, sample_rate=sample_rate, slow_request_ms=slow_request_ms,
+        explain_timeout_ms=250, max_explains=max_explains,
+    )
+
+    @app.get('/items')
+    async def items():
+        record_query('SELECT 1', ())
+        with phase('sql_exec'):
+            pass
+        with phase('serialize'):
+            return [{'id': 1}]
+
+    return app
+
+
+def test_profiled_requests_get_server_timing_breakdown():
+    response = TestClient(make_app(sample_rate=1.0)).get('/items')
+
+    phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert phases == ['sql_exec', 'serialize', 'app', 'total']
+
+
+def test_unsampled_requests_are_not_profiled():
+    response = TestClient(make_app(sample_rate=0.0)).get('/items')
+
+    assert 'Server-Timing' not in response.headers
+
+
+def explaining_app(statements, max_explains):
+    class Connection:
+        def cursor(self):
+            return ExplainCursor(statements)
+
+    @contextmanager
+    def borrow():
+        yield Connection()
+
+    return make_app(sample_rate=1.0, slow_request_ms=0, borrow=borrow, max_explains=max_explains)
+
+
+def test_slow_requests_are_explained_under_a_statement_timeout():
+    statements = []
+    TestClient(explaining_app(statements, max_explains=1)).get('/items')
+
+    deadline = time.monotonic() + 5
+    while len(statements) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert statements == ['SET LOCAL statement_timeout = 250', 'EXPLAIN (ANALYZE, BUFFERS) SELECT 1']
+
+
+def test_explains_beyond_the_limit_are_skipped():
+    statements = []
+    response = TestClient(explaining_app(statements, max_explains=0)).get('/items')
+
+    assert response.status_code == 200
+    time.sleep(0.05)
+    assert statements == []
+
+
+def test_failed_queries_are_not_recorded_for_explain():
+    class CancelledCursor:
+        def execute(self, query, params):
+            raise psycopg2.errors.QueryCanceled("canceling statement due to statement timeout")
+
+    profile = RequestProfile()
+    token = profiling._current_profile.set(profile)
+    try:
+        with pytest.raises(psycopg2.errors.QueryCanceled):
+            api.fetch_all(CancelledCursor(), 'search_messages', 'SELECT pg_sleep(10)', None)
+    finally:
+        profiling._current_profile.reset(token)
+
+    assert profile.queries == []
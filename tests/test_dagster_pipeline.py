@@ -0,0 +1,32 @@
+from dagster import MultiPartitionKey, materialize
+
+import src.load_raw_to_postgres as loader
+import src.scrape_telegram as scraper
+from src import dagster_pipeline
+
+
+def test_partitioned_assets_run_in_process(monkeypatch):
+    calls = []
+
+    async def fake_scrape(channels, date_str=None, limit=100, restrict_to_date=False):
+        calls.append(('scrape', channels, date_str, restrict_to_date))
+        return {'tikvahpharma': {'messages': [{'id': 1}], 'images': []}}
+
+    def fake_load(date_str=None, channels=None):
+        calls.append(('load', channels, date_str))
+        return 1
+
+    monkeypatch.setattr(scraper, 'scrape_telegram_channels', fake_scrape)
+    monkeypatch.setattr(loader, 'create_raw_schema', lambda: None)
+    monkeypatch.setattr(loader, 'load_raw_data', fake_load)
+
+    result = materialize(
+        [dagster_pipeline.telegram_raw_files, dagster_pipeline.raw_telegram_messages],
+        partition_key=MultiPartitionKey({'date': '2024-03-05', 'channel': 'tikvahpharma'}),
+    )
+
+    assert result.success
+    assert calls == [
+        ('scrape', ['https://t.me/tikvahpharma'], '2024-03-05', True),
+        ('load', ['tikvahpharma'], '2024-03-05'),
+    ]
@@ -0,0 +1,55 @@
+import json
+from datetime import datetime, timezone
+
+from src.data_quality import validate_messages
+
+NOW = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def validate(messages, **kwargs):
+    return validate_messages(messages, [json.dumps(message, default=str) for message in messages], now=NOW, **kwargs)
+
+
+def test_bad_rows_are_rejected_with_their_rules():
+    messages = [
+        {'id': 1, 'date': '2024-01-01T10:00:00+00:00', 'message': 'Amoxicillin 500mg'},
+        {'id': None, 'date': '2024-01-01T11:00:00+00:00', 'message': 'no id'},
+        {'id': 3, 'date': '2025-06-01T00:00:00+00:00', 'message': 'from the future'},
+        {'id': 4, 'date': '2024-01-01T12:00:00+00:00', 'message': 'nul\x00byte'},
+        {'id': 5, 'date': 'yesterday', 'message': 'unparseable date'},
+        {'id': 1, 'date': datetime(2024, 1, 1, 13, tzinfo=timezone.utc), 'message': None},
+    ]
+
+    report = validate(messages)
+
+    assert report.valid == [0]
+    assert report.rejected == {
+        1: ['id_missing'],
+        2: ['date_in_future'],
+        3: ['message_control_chars', 'null_bytes'],
+        4: ['date_unparseable'],
+        5: ['duplicate_id'],
+    }
+    assert report.stats['rows'] == 6
+    assert report.stats['valid_rows'] == 1
+    assert report.stats['quarantined_rows'] == 5
+    assert report.stats['rule_failures']['null_bytes'] == 1
+    assert report.stats['min_message_at'] == report.stats['max_message_at'] == '2024-01-01T10:00:00+00:00'
+    assert report.stats['avg_text_length'] == len('Amoxicillin 500mg')
+
+
+def test_ids_only_need_to_be_unique_within_a_channel():
+    messages = [
+        {'id': 7, 'date': datetime(2024, 1, 1, tzinfo=timezone.utc), 'message': 'a'},
+        {'id': 7, 'date': datetime(2024, 1, 1, tzinfo=timezone.utc), 'message': 'b'},
+    ]
+
+    assert validate(messages, channels=['chan_a', 'chan_b']).valid == [0, 1]
+    assert validate(messages, channels=['chan_a', 'chan_a']).rejected == {1: ['duplicate_id']}
+
+
+def test_empty_batch():
+    report = validate([])
+
+    assert report.valid == [] and report.rejected == {}
+    assert report.stats['rows'] == 0 and report.stats['avg_text_length'] is None
@@ -0,0 +1,24 @@
+import csv
+
+from src.db import copy_buffer, copy_field, db_config
+
+
+def test_config_comes_from_the_environment():
+    config = db_config({'POSTGRES_HOST': 'db', 'POSTGRES_PORT': '5432', 'POSTGRES_DB': 'scratch'})
+
+    assert config['host'] == 'db' and config['port'] == 5432 and config['database'] == 'scratch'
+    assert db_config({})['port'] == 5433
+
+
+def test_copy_buffer_keeps_nulls_empty_strings_and_arrays_apart():
+    text = copy_buffer([
+        ('channel', None, '', ['paracetamol', 'say "hi"'], 42),
+        ('other', '2025-01-01', '{"a": 1}', [], -7),
+    ]).getvalue()
+
+    first, second = text.splitlines()
+    assert first == '"channel",,"","{""paracetamol"",""say \\""hi\\""""}",42'
+    assert second == '"other","2025-01-01","{""a"": 1}","{}",-7'
+    assert next(csv.reader([first]))[3] == '{"paracetamol","say \\"hi\\""}'
+    assert copy_field(['a', None]) == '"{""a"",NULL}"'
+    assert copy_field(True) == '"True"' and copy_field(1.5) == '1.5'
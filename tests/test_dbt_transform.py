@@ -0,0 +1,80 @@
+import os
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import src.db as db
+import src.dbt_transform as transform
+from src.dbt_transform import state_selection
+
+
+def test_state_selection_always_extends_the_date_spine():
+    assert state_selection() == 'state:modified+ source_status:fresher+ dim_dates'
+    assert state_selection('tag:detections') == (
+        'state:modified+,tag:detections source_status:fresher+,tag:detections dim_dates,tag:detections'
+    )
+
+
+def test_builds_hold_the_lock_and_save_their_own_artifacts(tmp_path, monkeypatch):
+    project_dir = str(tmp_path)
+    invocations = []
+    locked = []
+
+    class Runner:
+        def invoke(self, args):
+            invocations.append((args, bool(locked)))
+            target = os.path.join(project_dir, args[args.index('--target-path') + 1])
+            os.makedirs(target, exist_ok=True)
+            for name in ('manifest.json', 'sources.json'):
+                with open(os.path.join(target, name), 'w') as f:
+                    f.write(args[0])
+            return SimpleNamespace(success=True)
+
+    @contextmanager
+    def build_lock():
+        locked.append(True)
+        yield
+        locked.pop()
+
+    monkeypatch.setattr(transform, 'DBT_PROJECT_DIR', project_dir)
+    monkeypatch.setattr(transform, 'DBT_STATE_DIR', os.path.join(project_dir, 'target', 'last_build_state'))
+    monkeypatch.setattr(transform, 'get_runner', lambda: Runner())
+    monkeypatch.setattr(transform, 'build_lock', build_lock)
+    monkeypatch.setattr(transform, 'build_started_at', lambda: '2024-01-01T00:00:00')
+
+    transform.build_models(exclude=transform.DETECTION_MODELS, state_name='stream')
+
+    assert [args[:2] for args, _ in invocations] == [['source', 'freshness'], ['build', '--target-path']]
+    assert all(held for _, held in invocations)
+    assert {args[args.index('--target-path') + 1] for args, _ in invocations} == {
+        os.path.join('target', 'builds', 'stream')
+    }
+    assert transform.has_previous_state('stream') and not transform.has_previous_state('messages')
+    with open(os.path.join(transform.state_dir('stream'), 'manifest.json')) as f:
+        assert f.read() == 'build'
+
+
+def test_build_lock_waits_for_the_advisory_lock_and_releases_it(monkeypatch):
+    statements = []
+
+    class Cursor:
+        def execute(self, query, params):
+            statements.append(query.split('(')[0])
+
+        def fetchone(self):
+            # Another process holds the lock
+            return (False,)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+    conn = SimpleNamespace(autocommit=False, closed=False, cursor=Cursor)
+    conn.close = lambda: setattr(conn, 'closed', True)
+    monkeypatch.setattr(db, 'connect', lambda: conn)
+
+    with transform.build_lock():
+        assert statements == ['SELECT pg_try_advisory_lock', 'SELECT pg_advisory_lock']
+        assert conn.autocommit and not conn.closed
+    assert conn.closed
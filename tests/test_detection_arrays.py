@@ -0,0 +1,25 @@
+import pytest
+
+from src.api.live_feed import DETECTION_QUERIES
+from src.detection_arrays import DETECTION_STORAGE_LAYOUTS, DETECTION_TABLES, check_storage, to_arrays
+
+
+def test_detections_become_parallel_arrays():
+    detections = [
+        {'class': 'bottle', 'confidence': 0.91, 'bbox': [1.0, 2.0, 30.0, 40.0]},
+        {'class': 'person', 'confidence': 0.55, 'bbox': [5.0, 6.0, 70.0, 80.0]},
+    ]
+
+    class_ids, confidences, boxes = to_arrays(detections, {'bottle': 3, 'person': 1})
+
+    assert class_ids == [3, 1]
+    assert confidences == [0.91, 0.55]
+    assert boxes == [1.0, 2.0, 30.0, 40.0, 5.0, 6.0, 70.0, 80.0]
+    assert to_arrays([], {}) == ([], [], [])
+
+
+def test_every_layout_has_a_table_and_live_feed_query():
+    assert set(DETECTION_TABLES) == set(DETECTION_QUERIES) == set(DETECTION_STORAGE_LAYOUTS)
+    check_storage('compact')
+    with pytest.raises(ValueError):
+        check_storage('columnar')
@@ -0,0 +1,47 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from src.detection_service import DetectionBatcher, create_app
+
+
+def test_concurrent_requests_share_a_batch():
+    batches = []
+
+    def fake_detect(paths):
+        batches.append(list(paths))
+        return [[{'class': 'bottle', 'confidence': 0.9, 'bbox': [0, 0, 1, 1]}] for _ in paths]
+
+    async def run():
+        batcher = DetectionBatcher(fake_detect, max_batch_size=4, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(f'img{i}.jpg') for i in range(6)))
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(run())
+
+    assert len(results) == 6
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert sorted(path for batch in batches for path in batch) == [f'img{i}.jpg' for i in range(6)]
+
+
+def test_detect_endpoint_returns_detections(tmp_path):
+    image = tmp_path / 'photo.jpg'
+    image.write_bytes(b'not really a jpeg')
+
+    def factory():
+        return lambda paths: [[{'class': 'person', 'confidence': 0.75, 'bbox': [1, 2, 3, 4]}] for _ in paths]
+
+    app = create_app(detect_fn_factory=factory, persist=False, max_wait_ms=1)
+    with TestClient(app) as client:
+        response = client.post('/api/detect', json={'image_path': str(image)})
+        missing = client.post('/api/detect', json={'image_path': str(tmp_path / 'missing.jpg')})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body['cached'] is False
+    assert len(body['image_hash']) == 64
+    assert body['detections'] == [{'detected_object': 'person', 'confidence': 0.75, 'bbox': [1, 2, 3, 4]}]
+    assert missing.status_code == 404
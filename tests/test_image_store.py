@@ -0,0 +1,80 @@
+import io
+import os
+
+from PIL import Image, ImageDraw
+
+from src.image_store import (
+    ImageStore,
+    content_hash,
+    detector_image_path,
+    detector_input,
+    downscale,
+    scale_detections,
+)
+
+
+def jpeg_bytes(quality=90, size=128):
+    image = Image.new('RGB', (size, size), (240, 240, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([10, 10, 60, 100], fill=(200, 30, 30))
+    draw.ellipse([70, 20, 120, 70], fill=(30, 30, 200))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def test_identical_images_are_stored_once_and_photo_ids_are_remembered(tmp_path):
+    store = ImageStore(store_dir=str(tmp_path), use_phash=False)
+    data = jpeg_bytes()
+
+    first = store.put(data, photo_id=111)
+    second = store.put(data, photo_id=222)
+    store.save_index()
+
+    assert first == second
+    assert os.path.exists(store.path(first))
+    reloaded = ImageStore(store_dir=str(tmp_path), use_phash=False)
+    assert reloaded.lookup_photo(222) == first
+    assert reloaded.lookup_photo(333) is None
+
+
+def test_reencoded_near_duplicates_resolve_to_the_stored_image(tmp_path):
+    store = ImageStore(store_dir=str(tmp_path), use_phash=True)
+
+    original = store.put(jpeg_bytes(quality=90))
+    reencoded = store.put(jpeg_bytes(quality=60))
+
+    assert reencoded == original
+    stored = [name for _, _, files in os.walk(tmp_path) for name in files]
+    assert len(stored) == 1
+
+
+def test_detector_copy_beside_the_original_maps_boxes_back(tmp_path):
+    store = ImageStore(store_dir=str(tmp_path), use_phash=False, detector_copy='beside')
+    data = jpeg_bytes(size=1280)
+
+    image_hash = store.put_async(data).result()
+    store.close()
+
+    assert open(store.path(image_hash), 'rb').read() == data
+    input_path, scale = detector_input(store.path(image_hash))
+    assert input_path == detector_image_path(image_hash, str(tmp_path))
+    with Image.open(input_path) as small:
+        assert max(small.size) == 640
+    assert scale == 2.0
+    detections = [{'class': 'bottle', 'confidence': 0.9, 'bbox': [10.0, 20.0, 30.0, 40.0]}]
+    assert scale_detections(detections, scale)[0]['bbox'] == [20.0, 40.0, 60.0, 80.0]
+
+
+def test_detector_copy_can_replace_the_original(tmp_path):
+    store = ImageStore(store_dir=str(tmp_path), use_phash=False, detector_copy='replace')
+    data = jpeg_bytes(size=1280)
+
+    image_hash = store.put(data)
+
+    assert image_hash == content_hash(data)
+    with Image.open(store.path(image_hash)) as stored:
+        assert max(stored.size) == 640
+    assert detector_input(store.path(image_hash)) == (store.path(image_hash), 1.0)
+    # Images already at detector size are kept as served
+    assert downscale(jpeg_bytes(size=128)) is None
@@ -0,0 +1,129 @@
+import json
+import os
+from datetime import date
+
+from src.image_store import ImageStore, existing_image_path, file_hash, image_path, tiered_image_path
+from src.lake_catalog import PartitionCatalog, read_messages
+from src.lake_maintenance import run_maintenance, tier_images
+from tests.test_image_store import jpeg_bytes
+
+
+def write_partition(data_dir, day, channel, messages):
+    path = os.path.join(data_dir, day, f'{channel}.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(messages, f, indent=2)
+    return path
+
+
+def test_catalog_is_built_from_existing_lake(tmp_path):
+    data_dir = str(tmp_path)
+    write_partition(data_dir, '2024-01-01', 'chan_a', [{'id': 1}, {'id': 2}])
+    write_partition(data_dir, '2024-01-02', 'chan_b', [{'id': 3}])
+
+    catalog = PartitionCatalog(data_dir)
+    partitions = catalog.partitions()
+    assert [(p.date, p.channel, p.messages, p.tier) for p in partitions] == [
+        ('2024-01-01', 'chan_a', 2, 'hot'),
+        ('2024-01-02', 'chan_b', 1, 'hot'),
+    ]
+    assert [p.channel for p in catalog.partitions(date_str='2024-01-02')] == ['chan_b']
+    assert catalog.partitions(channels=['missing']) == []
+
+
+def test_compaction_keeps_messages_and_version(tmp_path):
+    data_dir = str(tmp_path)
+    messages = [{'id': i, 'text': 'Paracetamol 500mg ' * 5} for i in range(50)]
+    old_path = write_partition(data_dir, '2024-01-01', 'chan_a', messages)
+    write_partition(data_dir, '2024-01-09', 'chan_a', [{'id': 99}])
+    catalog = PartitionCatalog(data_dir)
+    before = catalog.get('2024-01-01', 'chan_a')
+
+    summary = run_maintenance(data_dir, today=date(2024, 1, 10), compact_after_days=7,
+                              retention_days=None, tier_images_enabled=False)
+
+    after = catalog.get('2024-01-01', 'chan_a')
+    assert summary['compacted'] == 1
+    assert summary['bytes_saved'] > 0
+    assert after.tier == 'compacted'
+    assert after.path.endswith('.json.gz')
+    assert after.version == before.version
+    assert not os.path.exists(old_path)
+    assert read_messages(after.path) == messages
+    assert catalog.get('2024-01-09', 'chan_a').tier == 'hot'
+
+
+def test_retention_only_expires_loaded_and_enriched_partitions(tmp_path):
+    data_dir = str(tmp_path)
+    done = write_partition(data_dir, '2024-01-01', 'chan_a', [{'id': 1}])
+    pending = write_partition(data_dir, '2024-01-01', 'chan_b', [{'id': 2}])
+    catalog = PartitionCatalog(data_dir)
+    catalog.mark_loaded('2024-01-01', 'chan_a')
+    catalog.mark_enriched('2024-01-01', 'chan_a')
+    catalog.mark_loaded('2024-01-01', 'chan_b')
+
+    summary = run_maintenance(data_dir, today=date(2024, 3, 1), compact_after_days=7,
+                              retention_days=30, tier_images_enabled=False)
+
+    assert summary['expired'] == 1
+    assert not os.path.exists(done)
+    expired = catalog.get('2024-01-01', 'chan_a')
+    assert expired.tier == 'expired' and expired.path is None
+    assert [p.channel for p in catalog.partitions()] == ['chan_b']
+    assert catalog.get('2024-01-01', 'chan_b').tier == 'compacted'
+    assert not os.path.exists(pending)
+
+
+def test_dry_run_changes_nothing(tmp_path):
+    data_dir = str(tmp_path)
+    path = write_partition(data_dir, '2024-01-01', 'chan_a', [{'id': 1}])
+
+    summary = run_maintenance(data_dir, today=date(2024, 2, 1), compact_after_days=7,
+                              retention_days=None, tier_images_enabled=False, dry_run=True)
+
+    assert summary['compacted'] == 1
+    assert os.path.exists(path)
+    assert PartitionCatalog(data_dir).get('2024-01-01', 'chan_a').tier == 'hot'
+
+
+def test_rebuild_keeps_entries_of_unchanged_files(tmp_path):
+    data_dir = str(tmp_path)
+    write_partition(data_dir, '2024-01-01', 'chan_a', [{'id': 1}])
+    write_partition(data_dir, '2024-01-02', 'chan_a', [{'id': 2}])
+    changed = write_partition(data_dir, '2024-01-03', 'chan_a', [{'id': 3}])
+    catalog = PartitionCatalog(data_dir)
+    for day in ('2024-01-01', '2024-01-02', '2024-01-03'):
+        catalog.mark_loaded(day, 'chan_a')
+        catalog.mark_enriched(day, 'chan_a')
+    run_maintenance(data_dir, today=date(2024, 1, 10), compact_after_days=8,
+                    retention_days=None, tier_images_enabled=False)
+    compacted = catalog.get('2024-01-01', 'chan_a')
+    hot = catalog.get('2024-01-02', 'chan_a')
+    write_partition(data_dir, '2024-01-03', 'chan_a', [{'id': 3}, {'id': 4}])
+
+    assert catalog.rebuild() == 3
+
+    assert compacted.tier == 'compacted' and catalog.get('2024-01-01', 'chan_a') == compacted
+    assert catalog.get('2024-01-02', 'chan_a') == hot
+    rescraped = catalog.get('2024-01-03', 'chan_a')
+    assert rescraped.path == changed and rescraped.messages == 2
+    assert rescraped.loaded_at is None and rescraped.enriched_at is None
+
+
+def test_only_images_without_detections_are_tiered_under_their_own_key(tmp_path):
+    store_dir = str(tmp_path / 'images')
+    store = ImageStore(store_dir=store_dir, use_phash=False)
+    empty = store.put(jpeg_bytes(quality=100, size=2048), photo_id=1)
+    detected = store.put(jpeg_bytes(quality=99, size=2048), photo_id=2)
+    for image_hash in (empty, detected):
+        os.utime(image_path(image_hash, store_dir), (0, 0))
+    catalog = PartitionCatalog(str(tmp_path / 'lake'))
+
+    images, saved = tier_images(catalog, store_dir, older_than_days=30, image_hashes=[empty])
+
+    assert images == 1 and saved > 0
+    assert not os.path.exists(image_path(empty, store_dir))
+    assert existing_image_path(image_path(empty, store_dir)) == tiered_image_path(empty, store_dir)
+    assert store.lookup_photo(1) == empty
+    assert file_hash(image_path(detected, store_dir)) == detected
+    assert tier_images(catalog, store_dir, older_than_days=30, image_hashes=[empty]) == (0, 0)
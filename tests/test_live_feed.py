@@ -0,0 +1,161 @@
+import asyncio
+import json
+import socket
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import psycopg2
+
+import src.api.live_feed as live_feed
+from src.api.live_feed import LiveFeed, fetch_events, format_sse, message_events
+from src.notifications import NEW_DETECTIONS_CHANNEL, NEW_MESSAGES_CHANNEL
+
+
+def unreachable_database():
+    raise ConnectionError('no database in tests')
+
+
+def test_message_rows_become_message_and_product_events():
+    events = message_events((7, 'tikvahpharma', '512', '2024-01-02T08:00:00+00:00',
+                             'Paracetamol and Vitamin C in stock', True, ['paracetamol', 'vitamin']))
+
+    assert [event_type for event_type, _ in events] == ['message', 'product_mention', 'product_mention']
+    assert events[0][1]['products'] == ['paracetamol', 'vitamin']
+    assert {data['product_name'] for _, data in events[1:]} == {'paracetamol', 'vitamin'}
+
+
+def test_events_fan_out_to_matching_subscribers_only():
+    async def run():
+        feed = LiveFeed(connect=unreachable_database, reconnect_seconds=60)
+        everything = feed.subscribe()
+        one_channel = feed.subscribe(channels=['lobelia4cosmetics'])
+        one_product = feed.subscribe(products=['amoxicillin'], event_types=['product_mention'])
+
+        row = (1, 'tikvahpharma', '1', None, 'amoxicillin 500mg', False, ['amoxicillin'])
+        for event_type, data in message_events(row):
+            feed.publish(event_type, data)
+        feed.publish('detection', {'channel_name': 'lobelia4cosmetics', 'detected_object': 'bottle'})
+        await feed.close()
+        return [[subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+                for subscription in (everything, one_channel, one_product)]
+
+    everything, one_channel, one_product = asyncio.run(run())
+
+    assert [event_type for _, event_type, _ in everything] == ['message', 'product_mention', 'detection']
+    assert [event_type for _, event_type, _ in one_channel] == ['detection']
+    assert [(event_type, data['product_name']) for _, event_type, data in one_product] == [
+        ('product_mention', 'amoxicillin')
+    ]
+    event_id, event_type, data = everything[2]
+    assert format_sse(event_id, event_type, data).startswith('id: 3\nevent: detection\ndata: {')
+
+
+def test_detections_are_fetched_from_the_announced_layout():
+    queries = []
+
+    class Cursor:
+        def execute(self, query, params):
+            queries.append(query)
+
+        def fetchall(self):
+            return [(5, 'tikvahpharma', '512', 'bottle', 0.9, 'data/raw/images/ab/ab.jpg')]
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+    class Connection:
+        def cursor(self):
+            return Cursor()
+
+    @contextmanager
+    def borrow():
+        yield Connection()
+
+    payload = {'channel': 'tikvahpharma', 'first_id': 5, 'last_id': 5, 'count': 1}
+    rows_events = fetch_events(borrow, NEW_DETECTIONS_CHANNEL, payload)
+    compact_events = fetch_events(borrow, NEW_DETECTIONS_CHANNEL, {**payload, 'storage': 'compact'})
+
+    assert 'FROM raw.image_detections' in queries[0]
+    assert 'FROM raw.image_detection_arrays' in queries[1]
+    assert rows_events == compact_events
+    assert rows_events[0][1]['detected_object'] == 'bottle'
+
+
+class ListenCursor:
+    def execute(self, query):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class ListenConnection:
+    """LISTEN connection over a socket pair; the first one is lost on its first poll, like a server restart."""
+
+    def __init__(self, lose):
+        self.sock, self.peer = socket.socketpair()
+        self.lose = lose
+        self.closed = 0
+        self.notifies = []
+        self.peer.send(b'x')
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        return ListenCursor()
+
+    def fileno(self):
+        if self.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+        return self.sock.fileno()
+
+    def poll(self):
+        self.sock.recv(1)
+        if self.lose:
+            # libpq closes the socket, freeing its fd number for the next connection
+            self.closed = 2
+            self.sock.close()
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        payload = {'channel': 'tikvahpharma', 'first_id': 1, 'last_id': 1, 'count': 1}
+        self.notifies.append(SimpleNamespace(channel=NEW_MESSAGES_CHANNEL, payload=json.dumps(payload)))
+
+    def close(self):
+        self.closed = 1
+        self.sock.close()
+
+
+def test_listener_reconnects_after_losing_its_connection(monkeypatch):
+    connections = []
+
+    def connect():
+        connections.append(ListenConnection(lose=not connections))
+        return connections[-1]
+
+    monkeypatch.setattr(live_feed, 'fetch_events', lambda borrow, channel, payload: [
+        ('message', {'channel_name': payload['channel'], 'products': []})
+    ])
+
+    async def run():
+        feed = LiveFeed(connect=connect, reconnect_seconds=0)
+        subscription = feed.subscribe()
+        try:
+            return await asyncio.wait_for(subscription.queue.get(), timeout=5)
+        finally:
+            await feed.close()
+
+    try:
+        _, event_type, data = asyncio.run(run())
+    finally:
+        for conn in connections:
+            conn.sock.close()
+            conn.peer.close()
+
+    assert len(connections) == 2
+    assert (event_type, data['channel_name']) == ('message', 'tikvahpharma')
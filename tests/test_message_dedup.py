@@ -0,0 +1,25 @@
+from src.message_dedup import ClusterIndex, hamming, simhashes, to_signed, to_unsigned
+
+AD = "Paracetamol available now, price 120 birr. Call 0911223344 delivery in Addis Ababa today only"
+REPOST = "Paracetamol available now, price 125 birr. Call 0911223344 delivery in Addis Ababa today only"
+OTHER = "Amoxicillin 500mg new stock imported, ask for wholesale prices"
+
+
+def test_simhash_is_close_for_reposts_and_far_for_different_text():
+    ad, repost, other, empty, missing = simhashes([AD, REPOST, OTHER, '', None])
+
+    assert hamming(ad, repost) <= 3
+    assert hamming(ad, other) > 10
+    assert empty is None and missing is None
+    assert simhashes([AD]) == [ad]
+
+
+def test_reposts_join_the_first_messages_cluster():
+    index = ClusterIndex()
+    ad, repost, other = simhashes([AD, REPOST, OTHER])
+
+    first = index.assign(ad)
+    assert first == to_signed(ad)
+    assert index.assign(repost) == first
+    assert index.assign(other) != first
+    assert to_unsigned(to_signed(ad)) == ad
@@ -0,0 +1,54 @@
+from datetime import date
+
+import src.duckdb_reports as reports
+from src.parquet_export import changed_partitions, duckdb_type, partition_path, write_parquet
+
+MESSAGE_COLUMNS = [
+    ('message_id', 'INTEGER'),
+    ('channel_id', 'BIGINT'),
+    ('date_key', 'DATE'),
+    ('product_tags', 'VARCHAR[]'),
+    ('duplicate_cluster_id', 'BIGINT'),
+]
+
+
+def test_only_changed_partitions_are_rewritten():
+    current = {'2025-01-01': '10/a', '2025-01-02': '4/b', '2025-01-03': '1/c'}
+    exported = {'2025-01-01': '10/a', '2025-01-02': '3/a', '2024-12-31': '2/a'}
+
+    assert changed_partitions(current, exported) == (['2025-01-02', '2025-01-03'], ['2024-12-31'])
+    assert duckdb_type('ARRAY', '_text') == 'VARCHAR[]'
+    assert duckdb_type('numeric', 'numeric') == 'DOUBLE'
+    assert duckdb_type('jsonb', 'jsonb') == 'VARCHAR'
+
+
+def test_engine_serves_top_products_from_snapshots(tmp_path, monkeypatch):
+    write_parquet(partition_path(tmp_path, 'fct_messages', 'date_key', '2025-01-01'), MESSAGE_COLUMNS, [
+        (1, 7, date(2025, 1, 1), ['paracetamol'], None),
+        (2, 7, date(2025, 1, 1), ['paracetamol', 'vitamin'], 5),
+    ])
+    write_parquet(partition_path(tmp_path, 'fct_messages', 'date_key', '2025-01-02'), MESSAGE_COLUMNS, [
+        (3, 8, date(2025, 1, 2), ['vitamin'], 5),
+        (4, 8, date(2025, 1, 2), [], None),
+    ])
+    write_parquet(partition_path(tmp_path, 'dim_channels'), [('channel_id', 'BIGINT'), ('channel_name', 'VARCHAR')],
+                  [(7, 'lobelia'), (8, 'tikvahpharma')])
+    monkeypatch.setattr(reports, '_engine', reports.ParquetEngine(str(tmp_path)))
+
+    assert reports.top_products() == [
+        {'product_name': 'paracetamol', 'mention_count': 2, 'channels': 'lobelia'},
+        {'product_name': 'vitamin', 'mention_count': 2, 'channels': 'lobelia, tikvahpharma'},
+    ]
+    assert reports.top_products(distinct=True)[1]['mention_count'] == 1
+    assert reports.query("SELECT count(*) FROM fct_messages WHERE date_key = '2025-01-02'").fetchall() == [(2,)]
+
+
+def test_marts_exported_after_startup_get_views(tmp_path, monkeypatch):
+    monkeypatch.setattr(reports, '_engine', reports.ParquetEngine(str(tmp_path)))
+    assert reports.get_engine().views == []
+
+    write_parquet(partition_path(tmp_path, 'dim_channels'), [('channel_id', 'BIGINT'), ('channel_name', 'VARCHAR')],
+                  [(7, 'lobelia')])
+
+    assert reports.query("SELECT channel_name FROM dim_channels").fetchall() == [('lobelia',)]
+    assert reports.get_engine().views == ['dim_channels']
@@ -0,0 +1,31 @@
+from src.product_tagger import ProductTagger, get_tagger, normalize
+
+
+def test_normalize_folds_interchangeable_geez_letters():
+    # ሐ/ኀ/ሃ spell the same "ha", ሠ the same "se" as ሰ
+    assert normalize('ሐኪም') == normalize('ሀኪም') == normalize('ኀኪም')
+    assert normalize('ሠላም') == normalize('ሰላም')
+    assert normalize('ዐይን') == normalize('አይን')
+    assert normalize('ሃሳብ') == normalize('ሀሳብ')
+
+
+def test_tagger_matches_synonyms_across_scripts_as_whole_words():
+    tagger = ProductTagger([
+        ('paracetamol', 'paracetamol'),
+        ('paracetamol', 'Panadol'),
+        ('paracetamol', 'ፓራሲታሞል'),
+        ('vitamin', 'vitamin c'),
+        ('sunscreen', 'ጸሐይ መከላከያ'),
+    ])
+
+    assert tagger.tag('PANADOL, Vitamin-C! ፓራሲታሞል።') == ['paracetamol', 'vitamin']
+    assert tagger.tag('ፀሃይ መከላከያ ክሬም') == ['sunscreen']
+    assert tagger.tag('paracetamolx vitamins') == []
+    assert tagger.tag(None) == []
+
+
+def test_seed_dictionary_loads():
+    tagger = get_tagger()
+
+    assert 'paracetamol' in tagger.products
+    assert tagger.tag('New stock: አሞክሲሲሊን 500mg') == ['amoxicillin']
@@ -0,0 +1,48 @@
+from fastapi.testclient import TestClient
+
+from src.scrape_service import create_app
+
+
+class FakeTelegramClient:
+    def __init__(self):
+        self.connected = False
+        self.starts = 0
+        self.connects = 0
+
+    async def start(self):
+        self.starts += 1
+        self.connected = True
+
+    async def connect(self):
+        self.connects += 1
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+
+def test_one_client_serves_every_scrape_and_reconnects(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    telegram = FakeTelegramClient()
+    clients_used = []
+
+    async def fake_scrape(client, channels, date_str=None, **kwargs):
+        clients_used.append(client)
+        return {url.split('/')[-1]: {'messages': [{'id': 1}, {'id': 2}], 'images': ['abc']} for url in channels}
+
+    app = create_app(client_factory=lambda: telegram, scrape_fn=fake_scrape)
+    with TestClient(app) as client:
+        first = client.post('/api/scrape', json={'channels': ['https://t.me/tikvahpharma'], 'date': '2024-03-05'})
+        telegram.connected = False
+        second = client.post('/api/scrape', json={'channels': ['https://t.me/lobelia4cosmetics']})
+        health = client.get('/health').json()
+
+    assert first.json() == {'tikvahpharma': {'messages': 2, 'images': 1}}
+    assert second.json() == {'lobelia4cosmetics': {'messages': 2, 'images': 1}}
+    assert clients_used == [telegram, telegram]
+    assert (telegram.starts, telegram.connects) == (1, 1)
+    assert health['connected'] is True
+    assert not telegram.connected
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import InputPeerChannel, MessageMediaPhoto
+
+import src.scrape_telegram as scraper
+from src.image_store import ImageStore
+from src.lake_catalog import PartitionCatalog
+from src.scrape_telegram import EntityCache, resolve_channel
+from tests.test_image_store import jpeg_bytes
+
+
+class FakeClient:
+    def __init__(self):
+        self.lookups = []
+
+    async def get_input_entity(self, channel_url):
+        self.lookups.append(channel_url)
+        return InputPeerChannel(channel_id=1001, access_hash=-42)
+
+
+def test_channels_are_resolved_once_across_processes(tmp_path):
+    path = str(tmp_path / 'entities.json')
+    client = FakeClient()
+
+    first = asyncio.run(resolve_channel(client, 'https://t.me/tikvahpharma', EntityCache(path)))
+    # A later run starts with a fresh cache object loaded from disk
+    second = asyncio.run(resolve_channel(client, 'https://t.me/tikvahpharma', EntityCache(path)))
+
+    assert client.lookups == ['https://t.me/tikvahpharma']
+    assert (second.channel_id, second.access_hash) == (first.channel_id, first.access_hash) == (1001, -42)
+
+
+def test_forgotten_entries_are_resolved_again_and_saves_merge(tmp_path):
+    path = str(tmp_path / 'entities.json')
+    one, other = EntityCache(path), EntityCache(path)
+    one.put('lobelia4cosmetics', InputPeerChannel(channel_id=7, access_hash=70))
+    other.put('tikvahpharma', InputPeerChannel(channel_id=8, access_hash=80))
+
+    assert sorted(EntityCache(path).entries) == ['lobelia4cosmetics', 'tikvahpharma']
+
+    other.forget('lobelia4cosmetics')
+    client = FakeClient()
+    asyncio.run(resolve_channel(client, 'https://t.me/lobelia4cosmetics', EntityCache(path)))
+
+    assert client.lookups == ['https://t.me/lobelia4cosmetics']
+
+
+def test_a_retried_scrape_queues_each_detection_once(tmp_path, monkeypatch):
+    posted_at = datetime(2024, 1, 2, 10, tzinfo=timezone.utc)
+    message = SimpleNamespace(
+        id=42, date=posted_at, media=MessageMediaPhoto(),
+        to_dict=lambda: {'id': 42, 'date': posted_at, 'message': 'Amoxicillin in stock'},
+    )
+    detections_requested = []
+
+    class FlakyClient:
+        attempts = 0
+
+        async def iter_messages(self, peer, **kwargs):
+            self.attempts += 1
+            yield message
+            if self.attempts == 1:
+                raise FloodWaitError(request=None, capture=0)
+
+        async def download_media(self, message, file=None):
+            return jpeg_bytes()
+
+    async def fake_request_detection(detection_client, image_path, image_hash, message_id, channel_name, date_str):
+        detections_requested.append(message_id)
+
+    monkeypatch.setattr(scraper, 'request_detection', fake_request_detection)
+    monkeypatch.setattr(scraper, 'RAW_DATA_DIR', str(tmp_path / 'lake'))
+    monkeypatch.setattr(scraper, 'SCRAPE_LOG_PATH', str(tmp_path / 'scrape_log.json'))
+    entity_cache = EntityCache(str(tmp_path / 'entities.json'))
+    entity_cache.put('tikvahpharma', InputPeerChannel(channel_id=1001, access_hash=-42))
+    image_store = ImageStore(store_dir=str(tmp_path / 'images'), use_phash=False)
+
+    result = asyncio.run(scraper.scrape_channel(
+        FlakyClient(), 'https://t.me/tikvahpharma', date_str='2024-01-02', image_store=image_store,
+        detection_client=object(), catalog=PartitionCatalog(str(tmp_path / 'lake')), entity_cache=entity_cache,
+    ))
+    image_store.close()
+
+    assert len(result['messages']) == 1
+    assert detections_requested == [42]
@@ -0,0 +1,8 @@
+from benchmarks.run_benchmarks import STARTUP_TARGETS, startup_profile
+
+
+def test_entry_points_start_without_heavy_dependencies():
+    for name, argv in STARTUP_TARGETS.items():
+        profile = startup_profile(argv)
+        assert profile['returncode'] == 0, name
+        assert profile['heavy_modules'] == [], name
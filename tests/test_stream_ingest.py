@@ -0,0 +1,110 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon.tl.types import InputPeerChannel, MessageMediaPhoto, PeerChannel
+
+import src.scrape_telegram as scraper
+from src.image_store import ImageStore
+from src.stream_ingest import MartRefresher, MessageBuffer, new_message_handler, resolve_channels
+from tests.test_image_store import jpeg_bytes
+
+
+def test_buffer_writes_full_batches_and_remaining_rows_on_flush():
+    batches = []
+    posted_at = datetime(2024, 1, 2, 23, 30, tzinfo=timezone(timedelta(hours=-3)))
+
+    async def run():
+        buffer = MessageBuffer(write_fn=batches.append, flush_size=3, flush_seconds=60)
+        for message_id in range(4):
+            await buffer.add('tikvahpharma', {'id': message_id}, posted_at)
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(run())
+
+    assert [len(batch) for batch in batches] == [3, 1]
+    # date_scraped is the message's UTC day
+    assert batches[0][0] == ('tikvahpharma', '2024-01-03', {'id': 0})
+    assert len(buffer.unbuilt) == 4
+
+
+def test_failed_writes_and_refreshes_are_retried():
+    attempts = []
+    refreshes = []
+
+    def flaky_write(rows):
+        attempts.append(len(rows))
+        if len(attempts) == 1:
+            raise RuntimeError('database unavailable')
+
+    async def run():
+        buffer = MessageBuffer(write_fn=flaky_write, flush_size=100, flush_seconds=60)
+        refresher = MartRefresher(buffer, refresh_fn=refreshes.append, interval=60)
+        await buffer.add('lobelia4cosmetics', {'id': 1}, datetime.now(timezone.utc))
+        first = await buffer.flush()
+        second = await buffer.flush()
+        built = await refresher.refresh()
+        nothing_new = await refresher.refresh()
+        return first, second, built, nothing_new
+
+    first, second, built, nothing_new = asyncio.run(run())
+
+    assert (first, second) == (0, 1)
+    assert attempts == [1, 1]
+    assert built is True and nothing_new is False
+    assert refreshes == [1]
+
+
+def test_streamed_photo_messages_are_stored_and_buffered(tmp_path, monkeypatch):
+    posted_at = datetime(2024, 1, 2, 10, tzinfo=timezone.utc)
+    message = SimpleNamespace(
+        id=42, date=posted_at, peer_id=PeerChannel(channel_id=1001), media=MessageMediaPhoto(),
+        to_dict=lambda: {'id': 42, 'date': posted_at, 'message': 'Amoxicillin in stock'},
+    )
+    data = jpeg_bytes()
+    detections_requested = []
+
+    class FakeClient:
+        async def download_media(self, message, file=None):
+            return data
+
+    async def fake_request_detection(detection_client, image_path, image_hash, message_id, channel_name, date_str):
+        detections_requested.append((image_hash, message_id, channel_name, date_str))
+
+    monkeypatch.setattr(scraper, 'request_detection', fake_request_detection)
+    image_store = ImageStore(store_dir=str(tmp_path), use_phash=False)
+    batches = []
+
+    async def run():
+        buffer = MessageBuffer(write_fn=batches.append, flush_size=100, flush_seconds=60)
+        detections = set()
+        handler = new_message_handler(FakeClient(), {1001: 'tikvahpharma'}, image_store, buffer,
+                                      detection_client=object(), detections=detections)
+        await handler(SimpleNamespace(message=message))
+        await asyncio.gather(*detections)
+        await buffer.flush()
+
+    asyncio.run(run())
+    image_store.close()
+
+    [(channel_name, date_scraped, msg_dict)] = batches[0]
+    assert (channel_name, date_scraped) == ('tikvahpharma', '2024-01-02')
+    assert os.path.exists(msg_dict['downloaded_image'])
+    assert msg_dict['downloaded_image'] == image_store.path(msg_dict['image_hash'])
+    assert detections_requested == [(msg_dict['image_hash'], 42, 'tikvahpharma', '2024-01-02')]
+
+
+def test_stream_channels_are_resolved_through_the_entity_cache(tmp_path):
+    cache = scraper.EntityCache(str(tmp_path / 'entities.json'))
+    cache.put('tikvahpharma', InputPeerChannel(channel_id=1001, access_hash=-42))
+
+    class Client:
+        async def get_input_entity(self, channel_url):
+            raise AssertionError(f"{channel_url} should come from the cache")
+
+    peers, channel_names = asyncio.run(resolve_channels(Client(), ['https://t.me/tikvahpharma'], cache))
+
+    assert [(peer.channel_id, peer.access_hash) for peer in peers] == [(1001, -42)]
+    assert channel_names == {1001: 'tikvahpharma'}
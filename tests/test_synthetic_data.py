@@ -0,0 +1,42 @@
+import json
+import os
+
+from benchmarks.synthetic_data import generate
+from src.lake_catalog import find_partition_files
+
+
+def read_lake(data_dir):
+    contents = {}
+    for path in find_partition_files(data_dir, '.json'):
+        with open(path, encoding='utf-8') as f:
+            contents[os.path.relpath(path, data_dir)] = json.load(f)
+    return contents
+
+
+def test_generator_is_deterministic_and_matches_scraper_layout(tmp_path):
+    first, second = tmp_path / 'a', tmp_path / 'b'
+    summary = generate(str(first), messages=25, channels=2, days=3, unique_images=2, image_size=32)
+    generate(str(second), messages=25, channels=2, days=3, unique_images=2, image_size=32)
+
+    lake = read_lake(str(first))
+    assert summary['messages'] == 25
+    assert sum(len(messages) for messages in lake.values()) == 25
+    assert sorted(lake) == sorted(
+        os.path.join(f'2024-01-0{day}', f'bench_channel_00{channel}.json')
+        for day in (1, 2, 3) for channel in (0, 1)
+    )
+
+    for messages in lake.values():
+        for message in messages:
+            if 'downloaded_image' in message:
+                image = message['downloaded_image']
+                assert image.endswith(f"{message['image_hash']}.jpg")
+                assert os.path.exists(image)
+
+    second_lake = {key: [{k: v for k, v in m.items() if k != 'downloaded_image'} for m in msgs]
+                   for key, msgs in read_lake(str(second)).items()}
+    first_lake = {key: [{k: v for k, v in m.items() if k != 'downloaded_image'} for m in msgs]
+                  for key, msgs in lake.items()}
+    assert first_lake == second_lake
+    stored = [name for _, _, files in os.walk(tmp_path / 'images') for name in files]
+    assert len(stored) == summary['unique_images'] == 2
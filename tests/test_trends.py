@@ -0,0 +1,38 @@
+from collections import Counter
+
+from src.trends import CountMinSketch, growth_score, rank, terms
+
+
+def test_sketch_never_undercounts_and_survives_storage():
+    counts = Counter({f'word{i}': i % 7 + 1 for i in range(2000)})
+    counts['paracetamol'] = 500
+    sketch = CountMinSketch(width=512)
+    sketch.add(counts)
+
+    assert all(sketch.estimate(term) >= count for term, count in counts.items())
+    assert sketch.estimate('paracetamol') - 500 < 100
+    restored = CountMinSketch.from_bytes(sketch.to_bytes(), width=512)
+    assert restored.estimate('paracetamol') == sketch.estimate('paracetamol')
+
+
+def test_merged_sketches_add_up():
+    monday, tuesday = CountMinSketch(), CountMinSketch()
+    monday.add({'vitamin': 3})
+    tuesday.add({'vitamin': 4, 'sunscreen': 1})
+
+    week = CountMinSketch().merge(monday).merge(tuesday)
+    assert week.estimate('vitamin') == 7
+    assert week.estimate('sunscreen') == 1
+
+
+def test_terms_skip_short_words_and_numbers():
+    assert terms("Paracetamol 500mg, call 0911223344 ከ ዛሬ ጀምሮ!") == ['paracetamol', 'call', 'ጀምሮ']
+    assert terms(None) == []
+
+
+def test_growth_favours_new_volume_over_small_fluctuations():
+    assert growth_score(20, 5) > growth_score(3, 0) > growth_score(10, 10) == 0
+
+    ranked = rank({'vitamin': (20, 5), 'sunscreen': (3, 0), 'ibuprofen': (10, 10), 'gone': (0, 8)}, limit=2)
+    assert [item['name'] for item in ranked] == ['vitamin', 'sunscreen']
+    assert ranked[0]['current_mentions'] == 20 and ranked[0]['previous_mentions'] == 5
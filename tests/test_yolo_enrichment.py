@@ -0,0 +1,83 @@
+import json
+import os
+from contextlib import contextmanager
+
+import src.yolo_enrichment as enrich
+from src.lake_catalog import PartitionCatalog
+
+
+class FakeCursor:
+    def execute(self, query, params=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+
+def test_channel_days_with_failed_images_are_retried(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / 'lake')
+    messages = []
+    for message_id, name in ((1, 'good'), (2, 'bad')):
+        image_path = str(tmp_path / f'{name}.jpg')
+        open(image_path, 'wb').close()
+        messages.append({'id': message_id, 'downloaded_image': image_path, 'image_hash': name})
+    os.makedirs(os.path.join(data_dir, '2024-01-01'))
+    with open(os.path.join(data_dir, '2024-01-01', 'chan_a.json'), 'w') as f:
+        json.dump(messages, f)
+
+    checkpoints = {}
+    processed = {}
+    detected = []
+    broken = {'bad'}
+
+    def fake_detect(model, image_path):
+        name = os.path.basename(image_path)[:-len('.jpg')]
+        detected.append(name)
+        if name in broken:
+            raise RuntimeError('cannot decode image')
+        return [{'class': 'bottle', 'confidence': 0.9, 'bbox': [0, 0, 1, 1]}]
+
+    @contextmanager
+    def fake_connection():
+        yield FakeConnection()
+
+    monkeypatch.setattr(enrich, 'connection', fake_connection)
+    monkeypatch.setattr(enrich, 'create_image_detections_table', lambda: None)
+    monkeypatch.setattr(enrich, 'get_model', lambda: None)
+    monkeypatch.setattr(enrich, 'detect', fake_detect)
+    monkeypatch.setattr(enrich, 'load_checkpoints', lambda cur: dict(checkpoints))
+    monkeypatch.setattr(enrich, 'save_checkpoint', lambda cur, channel, day, version, images: checkpoints.update(
+        {(channel, day): version}))
+    monkeypatch.setattr(enrich, 'load_cached_detections', lambda cur, hashes: {
+        image_hash: processed[image_hash] for image_hash in hashes if image_hash in processed})
+    monkeypatch.setattr(enrich, 'store_processed_image', lambda cur, image_hash, path, detections: processed.update(
+        {image_hash: detections}))
+    monkeypatch.setattr(enrich, 'delete_detections', lambda cur, channel, day: None)
+    monkeypatch.setattr(enrich, 'write_detections', lambda *args: [1])
+    monkeypatch.setattr(enrich, 'notify_rows', lambda cur, channel, ids, **fields: None)
+
+    enrich.process_images_with_yolo(data_dir=data_dir)
+    assert sorted(detected) == ['bad', 'good']
+    assert checkpoints == {}
+    assert PartitionCatalog(data_dir).get('2024-01-01', 'chan_a').enriched_at is None
+
+    broken.clear()
+    detected.clear()
+    enrich.process_images_with_yolo(data_dir=data_dir)
+    assert detected == ['bad']
+    assert list(checkpoints) == [('chan_a', '2024-01-01')]
+
+    detected.clear()
+    enrich.process_images_with_yolo(data_dir=data_dir)
+    assert detected == []